@@ -3,9 +3,10 @@ from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
 from flask_wtf.csrf import CSRFProtect
 from config import Config
+from app.database import RoutingSession
 
 # Initialize extensions
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 login_manager = LoginManager()
 csrf = CSRFProtect()
 
@@ -15,10 +16,26 @@ def create_app(config_class=Config):
     app.config.from_object(config_class)
     
     # Initialize extensions with app
+    from app import database
+    database.configure(app)
     db.init_app(app)
+    database.init_app(app)
     login_manager.init_app(app)
     csrf.init_app(app)  
     
+    from app import (assets, cache, http_cache, identity, images, jobs, metrics, passwords,
+                     query_budget, recommendations, typeahead)
+    assets.init_app(app)
+    http_cache.init_app(app)
+    typeahead.init_app(app)
+    passwords.init_app(app)
+    images.init_app(app)
+    jobs.init_app(app)
+    identity.init_app(app)
+    query_budget.init_app(app)
+    metrics.init_app(app)
+    cache.init_app(app)
+    
     # Configure login manager
     login_manager.login_view = 'login'
     login_manager.login_message = 'Please log in to access this page.'
@@ -26,7 +43,10 @@ def create_app(config_class=Config):
     
     # Import and register routes and models
     with app.app_context():
-        from app import routes, models
+        from app import routes, models, api
+        from app.cli import register_commands
+        
+        register_commands(app)
         
         # Register error handlers
         @app.errorhandler(404)
@@ -0,0 +1,310 @@
+"""Read-only JSON catalog API (``/api/v1``)
+
+List endpoints select plain column tuples, never ORM objects, and page
+with keyset cursors (``next_cursor`` / ``prev_cursor``). ``?fields=``
+trims a book to the named fields, and ``GET /api/v1/books?ids=1,2,3``
+fetches up to API_MAX_BATCH books in one query. Catalog responses carry
+the same ETags as the HTML pages (see app/http_cache.py).
+
+Responses are encoded with orjson when it is installed, else the stdlib
+``json`` module.
+"""
+from datetime import datetime
+from urllib.parse import urljoin
+
+from flask import current_app as app, request, url_for, Response
+from flask_login import current_user
+
+from app import db, images, typeahead
+from app.cart_summary import set_cart_summary
+from app.database import replica_reads
+from app.http_cache import book_version, catalog_version, conditional
+from app.models import Book, Cart, Review, User, BOOK_CATEGORIES
+from app.pagination import paginate_keyset
+from app.query_budget import query_budget
+
+try:
+    import orjson
+except ImportError:  # optional; the stdlib encoder is used without it
+    orjson = None
+    import json
+
+API_PREFIX = '/api/v1'
+
+
+class ApiError(Exception):
+    """Rendered as ``{"error": message}`` with the given status"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+# ---- encoding ----
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+
+def json_response(payload, status=200):
+    """Encode ``payload`` with the fastest available encoder"""
+    if orjson is not None:
+        body = orjson.dumps(payload)
+    else:
+        body = json.dumps(payload, default=_json_default, separators=(',', ':'))
+    return Response(body, status=status, mimetype='application/json')
+
+
+@app.errorhandler(ApiError)
+def api_error(error):
+    return json_response({'error': error.message}, error.status)
+
+
+# ---- fields ----
+
+def _cover_url(row):
+    if row.cover_hash:
+        return urljoin(request.host_url, images.cover_url(row.cover_hash, 'detail'))
+    return row.image_url
+
+
+# Public field -> (columns it needs, function of the row or None to copy the column)
+BOOK_FIELDS = {
+    'id': ([Book.id], None),
+    'isbn': ([Book.isbn], None),
+    'title': ([Book.title], None),
+    'author': ([Book.author], None),
+    'category': ([Book.category], None),
+    'description': ([Book.description], None),
+    'price_npr': ([Book.price_npr], None),
+    'stock_quantity': ([Book.stock_quantity], None),
+    'average_rating': ([Book.average_rating], None),
+    'rating_count': ([Book.rating_count], None),
+    'cover_url': ([Book.cover_hash, Book.image_url], _cover_url),
+    'created_at': ([Book.created_at], None),
+    'updated_at': ([Book.updated_at], None),
+}
+
+LIST_FIELDS = ('id', 'title', 'author', 'category', 'price_npr', 'stock_quantity',
+               'average_rating', 'rating_count', 'cover_url')
+
+REVIEW_FIELDS = {
+    'id': Review.id,
+    'rating': Review.rating,
+    'review_text': Review.review_text,
+    'created_at': Review.created_at,
+    'username': User.username,
+}
+
+
+def _requested_fields(default):
+    raw = request.args.get('fields')
+    if not raw:
+        return list(default)
+    fields = list(dict.fromkeys(name.strip() for name in raw.split(',') if name.strip()))
+    unknown = [name for name in fields if name not in BOOK_FIELDS]
+    if unknown:
+        raise ApiError(f'Unknown field(s): {", ".join(unknown)}')
+    return fields
+
+
+class _Row:
+    """Attribute access by column name to a column tuple"""
+    __slots__ = ('_values', '_positions')
+
+    def __init__(self, values, positions):
+        self._values = values
+        self._positions = positions
+
+    def __getattr__(self, name):
+        return self._values[self._positions[name]]
+
+
+def _book_query(fields):
+    """Column query for ``fields`` (id first) plus a serializer for its rows"""
+    columns = [Book.id] + list(dict.fromkeys(
+        col for name in fields for col in BOOK_FIELDS[name][0] if col is not Book.id
+    ))
+    positions = {col.key: i for i, col in enumerate(columns)}
+
+    def serialize(values):
+        # A single-column page comes back as bare ids
+        row = _Row(values if isinstance(values, tuple) else (values,), positions)
+        item = {}
+        for name in fields:
+            needs, fn = BOOK_FIELDS[name]
+            item[name] = fn(row) if fn else getattr(row, needs[0].key)
+        return item
+
+    return db.session.query(*columns), serialize
+
+
+def _arg(name, type_):
+    value = request.args.get(name)
+    if value in (None, ''):
+        return None
+    try:
+        return type_(value)
+    except ValueError:
+        raise ApiError(f'Invalid value for {name}: {value!r}') from None
+
+
+def _bool_arg(name):
+    value = request.args.get(name)
+    if value in (None, ''):
+        return None
+    if value.lower() in ('1', 'true', 'yes'):
+        return True
+    if value.lower() in ('0', 'false', 'no'):
+        return False
+    raise ApiError(f'Invalid value for {name}: {value!r}')
+
+
+def _limit():
+    limit = _arg('limit', int) or app.config['API_PAGE_SIZE']
+    return max(1, min(limit, app.config['API_MAX_PAGE_SIZE']))
+
+
+# Sort name -> keyset ordering; the last key must be unique
+BOOK_SORTS = {
+    'id': [(Book.id, False)],
+    'rating': [(Book.average_rating, True), (Book.id, True)],
+    'newest': [(Book.created_at, True), (Book.id, True)],
+    'price': [(Book.price_npr, False), (Book.id, False)],
+}
+
+
+def _page_payload(page, serialize):
+    return {
+        'data': [serialize(item) for item in page.items],
+        'next_cursor': page.next_cursor,
+        'prev_cursor': page.prev_cursor,
+    }
+
+
+# ============== BOOKS ==============
+
+def _list_version():
+    return catalog_version(request.args.get('category') or None)
+
+
+@app.route(f'{API_PREFIX}/books')
+@replica_reads
+@conditional(lambda: _list_version())
+@query_budget(1)
+def api_books():
+    """Books, filtered and keyset-paginated, or a batch fetched by ``ids``"""
+    fields = _requested_fields(LIST_FIELDS)
+    query, serialize = _book_query(fields)
+
+    if 'ids' in request.args:
+        try:
+            ids = [int(part) for part in request.args['ids'].split(',') if part.strip()]
+        except ValueError:
+            raise ApiError('ids must be a comma-separated list of integers') from None
+        if len(ids) > app.config['API_MAX_BATCH']:
+            raise ApiError(f'At most {app.config["API_MAX_BATCH"]} ids per request')
+        found = {row[0]: tuple(row) for row in query.filter(Book.id.in_(ids))}
+        ids = list(dict.fromkeys(ids))
+        data = [serialize(found[book_id]) for book_id in ids if book_id in found]
+        missing = [book_id for book_id in ids if book_id not in found]
+        return json_response({'data': data, 'missing': missing})
+
+    category = request.args.get('category')
+    if category:
+        if category not in BOOK_CATEGORIES:
+            raise ApiError(f'Unknown category: {category!r}')
+        query = query.filter(Book.category == category)
+    min_price, max_price = _arg('min_price', float), _arg('max_price', float)
+    if min_price is not None:
+        query = query.filter(Book.price_npr >= min_price)
+    if max_price is not None:
+        query = query.filter(Book.price_npr <= max_price)
+    min_rating = _arg('min_rating', float)
+    if min_rating is not None:
+        query = query.filter(Book.average_rating >= min_rating)
+    in_stock = _bool_arg('in_stock')
+    if in_stock is True:
+        query = query.filter(Book.stock_quantity > 0)
+    elif in_stock is False:
+        query = query.filter(Book.stock_quantity <= 0)
+
+    sort = request.args.get('sort', 'id')
+    if sort not in BOOK_SORTS:
+        raise ApiError(f'sort must be one of: {", ".join(BOOK_SORTS)}')
+    page = paginate_keyset(query, BOOK_SORTS[sort], cursor=request.args.get('cursor'),
+                           per_page=_limit())
+    return json_response(_page_payload(page, serialize))
+
+
+@app.route(f'{API_PREFIX}/books/<int:id>')
+@replica_reads
+@conditional(lambda id: book_version(id))
+@query_budget(1)
+def api_book(id):
+    """One book; every field unless ``fields`` says otherwise"""
+    query, serialize = _book_query(_requested_fields(BOOK_FIELDS))
+    row = query.filter(Book.id == id).first()
+    if row is None:
+        raise ApiError('Book not found', 404)
+    return json_response({'data': serialize(tuple(row))})
+
+
+@app.route(f'{API_PREFIX}/books/<int:id>/reviews')
+@replica_reads
+@conditional(lambda id: book_version(id))
+@query_budget(2)
+def api_book_reviews(id):
+    """A book's reviews, newest first"""
+    if db.session.query(Book.id).filter(Book.id == id).first() is None:
+        raise ApiError('Book not found', 404)
+    query = (db.session.query(*REVIEW_FIELDS.values())
+             .join(User, Review.user_id == User.id)
+             .filter(Review.book_id == id))
+    page = paginate_keyset(query, [(Review.created_at, True), (Review.id, True)],
+                           cursor=request.args.get('cursor'), per_page=_limit())
+    names = list(REVIEW_FIELDS)
+    return json_response(_page_payload(page, lambda row: dict(zip(names, row))))
+
+
+# ============== SUGGESTIONS ==============
+
+@app.route(f'{API_PREFIX}/suggest')
+def api_suggest():
+    """Title and author completions for the search box, best rated first"""
+    limit = max(1, min(_arg('limit', int) or 8, typeahead.MAX_RESULTS))
+    matches = typeahead.get_index().suggest(request.args.get('q', ''), limit)
+    response = json_response({'data': [
+        {'id': book_id, 'title': title, 'author': author, 'url': url_for('book_detail', id=book_id)}
+        for book_id, title, author in matches
+    ]})
+    response.headers['Cache-Control'] = f'public, max-age={app.config["TYPEAHEAD_SYNC_SECONDS"]}'
+    return response
+
+
+# ============== CART ==============
+
+@app.route(f'{API_PREFIX}/cart')
+@query_budget(1)
+def api_cart():
+    """The logged-in user's cart lines and totals"""
+    if not current_user.is_authenticated:
+        raise ApiError('Login required', 401)
+    rows = (db.session.query(Cart.book_id, Book.title, Book.price_npr, Cart.quantity,
+                             Book.stock_quantity)
+            .join(Book, Cart.book_id == Book.id)
+            .filter(Cart.user_id == current_user.id)
+            .order_by(Cart.added_at, Cart.id)
+            .all())
+    items = [{'book_id': book_id, 'title': title, 'price_npr': price, 'quantity': quantity,
+              'in_stock': stock >= quantity}
+             for book_id, title, price, quantity, stock in rows]
+    subtotal = round(sum(price * quantity for _, _, price, quantity, _ in rows), 2)
+    # Exact figures, so resynchronise the header badge's cached summary
+    set_cart_summary(len(rows), subtotal)
+    response = json_response({'count': len(rows), 'subtotal': subtotal, 'items': items})
+    response.headers['Cache-Control'] = 'private, no-store'
+    return response
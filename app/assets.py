@@ -0,0 +1,237 @@
+"""Fingerprinted, precompressed static assets
+
+``flask build-assets`` copies every file under ``app/static`` into
+``app/static/dist``. CSS and JS are minified on the way, and each file is
+renamed after a hash of its contents (``css/style.3f9a0c1b2d4e.css``).
+Compressible files also get ``.gz`` siblings, plus ``.br`` ones when the
+optional ``brotli`` package is installed. ``dist/manifest.json`` maps
+each source name to its built name.
+
+When the manifest exists, ``url_for('static', filename='css/style.css')``
+returns the hashed name. The static view then serves the smallest
+precompressed copy the browser accepts, with a one-year immutable
+Cache-Control header. A changed file gets a new name, so deploys never
+leave browsers holding stale copies. Files not in the manifest are
+served as before.
+"""
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import posixpath
+import re
+import shutil
+
+from flask import current_app, request, send_from_directory
+
+try:
+    import brotli
+except ImportError:  # optional; .br files are skipped without it
+    brotli = None
+
+BUILD_DIR = 'dist'
+MANIFEST_NAME = 'manifest.json'
+
+ASSET_MAX_AGE = 365 * 24 * 3600
+
+COMPRESSIBLE = {'.css', '.js', '.svg', '.json', '.txt', '.html'}
+
+# Content-Encoding -> file suffix, in order of preference
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+_STRING = r'"(?:\\.|[^"\\\n])*"|\'(?:\\.|[^\'\\\n])*\''
+_CSS_TOKENS = re.compile(rf'({_STRING})|/\*.*?\*/', re.S)
+_JS_TOKENS = re.compile(rf'({_STRING}|`(?:\\.|[^`\\])*`)|/\*.*?\*/|//[^\n]*', re.S)
+_CSS_URL = re.compile(r'url\(\s*([\'"]?)([^\'")]+)\1\s*\)')
+
+
+class Manifest:
+    """Source name -> built name, plus the encodings built for each file"""
+
+    def __init__(self, files=None, encodings=None):
+        self.files = files or {}
+        self.encodings = encodings or {}
+        self.built = set(self.files.values())
+
+    @classmethod
+    def load(cls, path):
+        """Read a manifest; a missing file gives an empty one"""
+        try:
+            with open(path, encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return cls()
+        return cls(data['files'], data['encodings'])
+
+    def pick_encoding(self, built_name, accept_encodings):
+        for encoding, suffix in ENCODINGS:
+            if encoding in self.encodings.get(built_name, ()) and accept_encodings[encoding]:
+                return encoding, suffix
+        return None, ''
+
+
+def init_app(app):
+    """Load the manifest and route static URLs through it"""
+    manifest = Manifest()
+    if app.config['USE_ASSET_MANIFEST']:
+        manifest = Manifest.load(os.path.join(app.static_folder, BUILD_DIR, MANIFEST_NAME))
+    app.extensions['asset_manifest'] = manifest
+    if manifest.files:
+        app.url_defaults(_fingerprint_static_urls)
+        app.view_functions['static'] = serve_static
+
+
+def _fingerprint_static_urls(endpoint, values):
+    if endpoint == 'static' and 'filename' in values:
+        files = current_app.extensions['asset_manifest'].files
+        values['filename'] = files.get(values['filename'], values['filename'])
+
+
+def serve_static(filename):
+    """Serve a built asset, precompressed when the browser accepts it"""
+    manifest = current_app.extensions['asset_manifest']
+    if filename not in manifest.built:
+        return current_app.send_static_file(filename)
+    encoding, suffix = manifest.pick_encoding(filename, request.accept_encodings)
+    response = send_from_directory(current_app.static_folder, filename + suffix,
+                                   mimetype=mimetypes.guess_type(filename)[0], max_age=ASSET_MAX_AGE)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    if manifest.encodings.get(filename):
+        response.vary.add('Accept-Encoding')
+    response.headers['Cache-Control'] = f'public, max-age={ASSET_MAX_AGE}, immutable'
+    return response
+
+
+# ---- build ----
+
+def _strip(text, tokens, squeeze):
+    """Drop comments matched by ``tokens`` and squeeze the code between strings"""
+    parts, code, pos = [], [], 0
+    for match in tokens.finditer(text):
+        code.append(text[pos:match.start()])
+        if match.group(1):
+            parts.append(squeeze(''.join(code)))
+            parts.append(match.group(1))
+            code = []
+        else:
+            code.append(' ')
+        pos = match.end()
+    code.append(text[pos:])
+    parts.append(squeeze(''.join(code)))
+    return ''.join(parts).strip()
+
+
+def _squeeze_css(code):
+    code = re.sub(r'\s+', ' ', code)
+    code = re.sub(r'\s*([{};,>])\s*', r'\1', code)
+    return code.replace(';}', '}')
+
+
+def _squeeze_js(code):
+    # Line breaks are kept so automatic semicolon insertion still applies
+    return re.sub(r'\s*\n\s*', '\n', re.sub(r'[ \t]+', ' ', code))
+
+
+def minify_css(text):
+    return _strip(text, _CSS_TOKENS, _squeeze_css)
+
+
+def minify_js(text):
+    """Remove comments, indentation and blank lines
+
+    Deliberately conservative: identifiers and line breaks are left alone.
+    Regex literals containing quotes or ``//`` are not supported.
+    """
+    return _strip(text, _JS_TOKENS, _squeeze_js)
+
+
+MINIFIERS = {'.css': minify_css, '.js': minify_js}
+
+
+def _fingerprint(name, data):
+    root, ext = posixpath.splitext(name)
+    return f'{root}.{hashlib.sha256(data).hexdigest()[:12]}{ext}'
+
+
+def _rewrite_css_urls(name, text, files):
+    """Point relative url() references at the built names"""
+    def replace(match):
+        quote, target = match.groups()
+        if re.match(r'^(?:[a-z]+:|/|#)', target, re.I):
+            return match.group(0)
+        path, _, tail = target.partition('?')
+        source = posixpath.normpath(posixpath.join(posixpath.dirname(name), path))
+        if source not in files:
+            return match.group(0)
+        # The stylesheet is built into the same directory under BUILD_DIR
+        built = posixpath.relpath(files[source], posixpath.join(BUILD_DIR, posixpath.dirname(name)))
+        return f'url({quote}{built}{"?" + tail if tail else ""}{quote})'
+    return _CSS_URL.sub(replace, text)
+
+
+def _sources(static_dir):
+    for root, dirs, names in os.walk(static_dir):
+        if os.path.samefile(root, static_dir):
+            dirs[:] = [d for d in dirs if d != BUILD_DIR]
+        for filename in names:
+            path = os.path.join(root, filename)
+            yield os.path.relpath(path, static_dir).replace(os.sep, '/'), path
+
+
+def _write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f'{path}.tmp-{os.getpid()}'
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def _compress(data):
+    variants = {'gzip': gzip.compress(data, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        variants['br'] = brotli.compress(data, quality=11)
+    return {encoding: blob for encoding, blob in variants.items() if len(blob) < len(data)}
+
+
+def build(static_dir, clean=False):
+    """Build fingerprinted, minified and precompressed copies of static files
+
+    Earlier builds are kept unless ``clean`` is set, so pages rendered
+    before a deploy can still load their assets. Returns a list of
+    ``(source, built, original size, built size, encodings)`` tuples.
+    """
+    out_dir = os.path.join(static_dir, BUILD_DIR)
+    if clean and os.path.isdir(out_dir):
+        shutil.rmtree(out_dir)
+
+    # CSS last, so its url() references can use the other files' built names
+    sources = sorted(_sources(static_dir), key=lambda item: (item[0].endswith('.css'), item[0]))
+    files, encodings, report = {}, {}, []
+    for name, path in sources:
+        with open(path, 'rb') as f:
+            original = f.read()
+        ext = posixpath.splitext(name)[1].lower()
+        data = original
+        if ext in MINIFIERS:
+            text = MINIFIERS[ext](original.decode('utf-8'))
+            if ext == '.css':
+                text = _rewrite_css_urls(name, text, files)
+            data = text.encode('utf-8')
+        built = posixpath.join(BUILD_DIR, _fingerprint(name, data))
+        files[name] = built
+        target = os.path.join(static_dir, *built.split('/'))
+        _write(target, data)
+
+        compressed = _compress(data) if ext in COMPRESSIBLE else {}
+        for encoding, suffix in ENCODINGS:
+            if encoding in compressed:
+                _write(target + suffix, compressed[encoding])
+        if compressed:
+            encodings[built] = sorted(compressed)
+        report.append((name, built, len(original), len(data), compressed))
+
+    manifest = json.dumps({'files': files, 'encodings': encodings}, indent=2, sort_keys=True)
+    _write(os.path.join(out_dir, MANIFEST_NAME), manifest.encode('utf-8'))
+    return report
@@ -0,0 +1,248 @@
+"""Rendered-page cache for anonymous catalog browsing
+
+Pages are cached per full URL and tagged with namespaces (``index``,
+``category:<name>``, ``book:<id>``). Every namespace has a generation
+counter that is part of the cache key, so invalidating a namespace is a
+single counter bump and stale entries simply age out of the LRU. Views
+under ``@conditional`` (app/http_cache.py) also key pages by their ETag,
+so a cached body never goes out under a newer validator.
+
+The generation counters always live in the SQLite file at
+CACHE_SQLITE_PATH, whatever the backend, so a bump made by one worker
+process reaches every worker on the host at once.
+
+Backends for the entries (``CACHE_TYPE``):
+
+- ``memory``: per-process LRU with TTL (the default)
+- ``sqlite``: the same SQLite file, shared by every worker on the host,
+  standing in for a local cache server
+- ``null``: caching disabled
+"""
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import current_app, g, request, session, Response
+from flask_login import current_user
+
+# Namespace every cached page belongs to, for invalidating everything
+CATALOG_NAMESPACE = 'catalog'
+
+
+class NullCache:
+    """Backend that never stores anything"""
+
+    def get(self, key):
+        return None
+
+    def set(self, key, value, timeout=None):
+        pass
+
+    def delete(self, key):
+        pass
+
+    def clear(self):
+        pass
+
+
+class MemoryCache:
+    """Thread-safe in-process LRU cache with per-entry expiry"""
+
+    def __init__(self, threshold=1000, default_timeout=300):
+        self.threshold = threshold
+        self.default_timeout = default_timeout
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, timeout=None):
+        timeout = self.default_timeout if timeout is None else timeout
+        with self._lock:
+            self._entries[key] = (time.monotonic() + timeout, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.threshold:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class _SQLiteFile:
+    """One autocommit connection per thread to a SQLite file in WAL mode"""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode = WAL')
+            conn.execute('PRAGMA synchronous = NORMAL')
+            self._local.conn = conn
+        return conn
+
+
+class SQLiteCache(_SQLiteFile):
+    """Cache in a SQLite file so several worker processes share entries"""
+
+    def __init__(self, path, threshold=10000, default_timeout=300):
+        super().__init__(path)
+        self.threshold = threshold
+        self.default_timeout = default_timeout
+        with self._connect() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS cache_entries '
+                         '(key TEXT PRIMARY KEY, value BLOB NOT NULL, expires_at REAL NOT NULL)')
+            conn.execute('CREATE INDEX IF NOT EXISTS ix_cache_entries_expires_at '
+                         'ON cache_entries (expires_at)')
+
+    def get(self, key):
+        row = self._connect().execute(
+            'SELECT value FROM cache_entries WHERE key = ? AND expires_at >= ?',
+            (key, time.time())
+        ).fetchone()
+        return row[0] if row else None
+
+    def set(self, key, value, timeout=None):
+        timeout = self.default_timeout if timeout is None else timeout
+        conn = self._connect()
+        conn.execute('INSERT OR REPLACE INTO cache_entries (key, value, expires_at) VALUES (?, ?, ?)',
+                     (key, value, time.time() + timeout))
+        # Keep the file bounded: drop expired rows, then the soonest to expire
+        conn.execute('DELETE FROM cache_entries WHERE expires_at < ?', (time.time(),))
+        conn.execute('DELETE FROM cache_entries WHERE key IN (SELECT key FROM cache_entries '
+                     'ORDER BY expires_at DESC LIMIT -1 OFFSET ?)', (self.threshold,))
+
+    def delete(self, key):
+        self._connect().execute('DELETE FROM cache_entries WHERE key = ?', (key,))
+
+    def clear(self):
+        self._connect().execute('DELETE FROM cache_entries')
+
+
+class SQLiteCounters(_SQLiteFile):
+    """Generation counters every worker process on the host reads and bumps"""
+
+    def __init__(self, path):
+        super().__init__(path)
+        with self._connect() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS cache_counters '
+                         '(key TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+
+    def get(self, keys):
+        """Each key's value, 0 for keys never bumped"""
+        placeholders = ', '.join('?' * len(keys))
+        values = dict(self._connect().execute(
+            f'SELECT key, value FROM cache_counters WHERE key IN ({placeholders})', keys
+        ).fetchall())
+        return [values.get(key, 0) for key in keys]
+
+    def incr(self, key):
+        row = self._connect().execute(
+            'INSERT INTO cache_counters (key, value) VALUES (?, 1) '
+            'ON CONFLICT (key) DO UPDATE SET value = value + 1 RETURNING value',
+            (key,)
+        ).fetchone()
+        return row[0]
+
+
+def init_app(app):
+    """Create the backend selected by CACHE_TYPE and the shared generation counters"""
+    cache_type = app.config['CACHE_TYPE']
+    threshold = app.config['CACHE_THRESHOLD']
+    timeout = app.config['CACHE_DEFAULT_TIMEOUT']
+    if cache_type == 'memory':
+        backend = MemoryCache(threshold, timeout)
+    elif cache_type == 'sqlite':
+        backend = SQLiteCache(app.config['CACHE_SQLITE_PATH'], threshold, timeout)
+    elif cache_type == 'null':
+        backend = NullCache()
+    else:
+        raise ValueError(f'Unknown CACHE_TYPE {cache_type!r}')
+    app.extensions['page_cache'] = backend
+    app.extensions['cache_generations'] = SQLiteCounters(app.config['CACHE_SQLITE_PATH'])
+
+
+def get_backend():
+    return current_app.extensions['page_cache']
+
+
+def generations(*namespaces):
+    """The current generation of each namespace, as every worker sees it"""
+    return current_app.extensions['cache_generations'].get([f'gen:{namespace}' for namespace in namespaces])
+
+
+def generation(namespace):
+    return generations(namespace)[0]
+
+
+def invalidate(*namespaces):
+    """Invalidate every page cached under any of the given namespaces, in every worker"""
+    counters = current_app.extensions['cache_generations']
+    for namespace in namespaces:
+        counters.incr(f'gen:{namespace}')
+
+
+def invalidate_all():
+    """Invalidate every cached page (after bulk catalog changes)"""
+    invalidate(CATALOG_NAMESPACE)
+
+
+def _is_cacheable_request():
+    return (request.method == 'GET'
+            and not current_user.is_authenticated
+            and not session.get('_flashes'))
+
+
+def cached_page(namespaces, timeout=None):
+    """Cache a view's response for anonymous visitors
+
+    ``namespaces`` is called with the view's keyword arguments and returns
+    the namespaces the page depends on. Logged-in users, requests with
+    pending flash messages and non-200 responses always bypass the cache.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if not _is_cacheable_request():
+                return f(*args, **kwargs)
+
+            backend = get_backend()
+            tags = [CATALOG_NAMESPACE] + list(namespaces(**kwargs))
+            # The ETag set by @conditional, so a body is only served under the
+            # validator it was rendered for
+            key = (f'page:{request.full_path}:{".".join(map(str, generations(*tags)))}'
+                   f':{g.get("etag", "")}')
+
+            body = backend.get(key)
+            if body is not None:
+                response = Response(body, mimetype='text/html')
+                response.headers['X-Cache'] = 'HIT'
+                return response
+
+            response = current_app.make_response(f(*args, **kwargs))
+            if response.status_code == 200 and not response.direct_passthrough:
+                backend.set(key, response.get_data(), timeout)
+            response.headers['X-Cache'] = 'MISS'
+            return response
+        return decorated_function
+    return decorator
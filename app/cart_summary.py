@@ -0,0 +1,95 @@
+"""Per-user cart summary (item count and subtotal) cached in the session
+
+The header shows the cart badge on every page. Rather than counting cart
+rows on each request, the summary is computed once, kept in the signed
+session cookie and adjusted in place by the cart routes.
+
+The summary is stamped with two page cache generations: the user's
+``cart:<id>``, which every committed cart change bumps, and the catalog's,
+which book edits, deletes and imports bump. A summary whose stamp is no
+longer current is reloaded, so changes made from another device or by an
+admin show up on the user's next request.
+"""
+from flask import session
+from flask_login import current_user
+from sqlalchemy import func
+
+from app import cache, db
+from app.cache import CATALOG_NAMESPACE
+from app.models import Book, Cart
+
+SESSION_KEY = 'cart_summary'
+
+EMPTY_SUMMARY = {'count': 0, 'subtotal': 0.0}
+
+
+def load_cart_summary(user_id):
+    """Compute the summary for a user with one aggregate query"""
+    count, subtotal = (db.session.query(func.count(Cart.id),
+                                        func.coalesce(func.sum(Book.price_npr * Cart.quantity), 0))
+                       .select_from(Cart)
+                       .join(Book, Cart.book_id == Book.id)
+                       .filter(Cart.user_id == user_id)
+                       .one())
+    return {'user_id': user_id, 'count': count, 'subtotal': round(subtotal, 2)}
+
+
+def _stamp(user_id):
+    return cache.generations(f'cart:{user_id}', CATALOG_NAMESPACE)
+
+
+def _cached(stamp):
+    summary = session.get(SESSION_KEY)
+    if summary is None or summary.get('user_id') != current_user.id or summary.get('stamp') != stamp:
+        return None
+    return summary
+
+
+def get_cart_summary():
+    """Return the current user's summary, loading it when missing or stale"""
+    if not current_user.is_authenticated:
+        return EMPTY_SUMMARY
+    # Stamped before loading, so a change committed meanwhile reloads it again
+    stamp = _stamp(current_user.id)
+    summary = _cached(stamp)
+    if summary is None:
+        summary = load_cart_summary(current_user.id)
+        summary['stamp'] = stamp
+        session[SESSION_KEY] = summary
+    return summary
+
+
+def set_cart_summary(count, subtotal, stamp=None):
+    """Store exact values already known to the caller"""
+    session[SESSION_KEY] = {'user_id': current_user.id, 'count': count,
+                            'subtotal': round(subtotal, 2),
+                            'stamp': stamp or _stamp(current_user.id)}
+
+
+def adjust_cart_summary(count_delta=0, subtotal_delta=0.0):
+    """Apply a change the current request committed, without re-querying
+
+    Other sessions of the user reload their summaries. This one is adjusted
+    in place unless the cart also changed elsewhere since it was loaded.
+    """
+    cart_generation, catalog_generation = _stamp(current_user.id)
+    summary = _cached([cart_generation, catalog_generation])
+    cache.invalidate(f'cart:{current_user.id}')
+    stamp = _stamp(current_user.id)
+    if summary is None or stamp != [cart_generation + 1, catalog_generation]:
+        # The next read will load it fresh
+        session.pop(SESSION_KEY, None)
+        return
+    set_cart_summary(max(summary['count'] + count_delta, 0),
+                     max(summary['subtotal'] + subtotal_delta, 0.0), stamp)
+
+
+def invalidate_cart_summary():
+    """Reload every session's summary after a cart change the caller committed"""
+    cache.invalidate(f'cart:{current_user.id}')
+    session.pop(SESSION_KEY, None)
+
+
+def reset_cart_summary():
+    """Forget the cached summary (on login and logout)"""
+    session.pop(SESSION_KEY, None)
@@ -0,0 +1,75 @@
+"""Single-statement cart writes
+
+Adding a book and saving quantities are each one SQL statement, so
+concurrent requests (a double-clicked "Add to cart") cannot create
+duplicate rows or push a quantity past the available stock. The unique
+``(user_id, book_id)`` index on ``cart`` is what makes the upsert atomic.
+"""
+from collections import namedtuple
+from datetime import datetime
+
+from sqlalchemy import (DateTime, Float, Integer, bindparam, case, column, select, text,
+                        update)
+
+from app import db
+from app.models import Book, Cart
+
+# Outcome of add_book: ``added`` is False when nothing could be added
+AddResult = namedtuple('AddResult', 'added inserted quantity price')
+
+
+# Inserts the row only while the book is in stock; an existing row is
+# bumped instead, unless it already holds every copy, in which case the
+# conflict matches but nothing is updated and RETURNING yields no row.
+# Valid on both SQLite (3.35+) and PostgreSQL.
+ADD_STATEMENT = text("""
+    INSERT INTO cart (user_id, book_id, quantity, added_at)
+    SELECT :user_id, books.id, 1, :now FROM books
+    WHERE books.id = :book_id AND books.stock_quantity > 0
+    ON CONFLICT (user_id, book_id) DO UPDATE SET quantity = cart.quantity + 1
+    WHERE cart.quantity < (SELECT stock_quantity FROM books WHERE books.id = excluded.book_id)
+    RETURNING quantity, added_at, (SELECT price_npr FROM books WHERE books.id = cart.book_id)
+""").bindparams(bindparam('now', type_=DateTime)).columns(
+    column('quantity', Integer), column('added_at', DateTime), column('price', Float))
+
+
+def add_book(user_id, book_id):
+    """Put one more copy of a book in the user's cart, capped by stock
+
+    Returns an AddResult; ``inserted`` tells a new cart row from a bumped
+    quantity. Nothing is returned for a missing or out-of-stock book or
+    when the cart already holds every copy; the caller tells those apart.
+    The caller commits.
+    """
+    now = datetime.utcnow()
+    row = db.session.execute(ADD_STATEMENT, {'user_id': user_id, 'book_id': book_id,
+                                             'now': now}).first()
+    if row is None:
+        return AddResult(False, False, 0, 0.0)
+    quantity, added_at, price = row
+    # Only a freshly inserted row carries this request's timestamp
+    return AddResult(True, added_at == now, quantity, price)
+
+
+def update_quantities(user_id, quantities):
+    """Set several of a user's cart quantities in one UPDATE
+
+    ``quantities`` maps cart item ids to the requested quantity. Each is
+    capped at the book's stock (rows whose book is out of stock keep their
+    quantity). Items belonging to other users are ignored. Returns the ids
+    whose stored quantity differs from the request. The caller commits.
+    """
+    if not quantities:
+        return []
+    cart = Cart.__table__
+    books = Book.__table__
+    requested = case(quantities, value=cart.c.id)
+    stock = select(books.c.stock_quantity).where(books.c.id == cart.c.book_id).scalar_subquery()
+    stmt = (update(cart)
+            .where(cart.c.user_id == user_id, cart.c.id.in_(list(quantities)))
+            .values(quantity=case((requested <= stock, requested),
+                                  (stock > 0, stock),
+                                  else_=cart.c.quantity))
+            .returning(cart.c.id, cart.c.quantity))
+    return [item_id for item_id, quantity in db.session.execute(stmt)
+            if quantity != quantities[item_id]]
@@ -0,0 +1,218 @@
+"""Streaming bulk import of supplier catalog feeds
+
+Rows are read lazily from CSV or JSON Lines (optionally gzip-compressed),
+validated with the same rules as the admin ``BookForm`` and written in
+batches with an ``INSERT ... ON CONFLICT (isbn) DO UPDATE`` upsert, so the
+file never has to fit in memory and re-running a feed is idempotent.
+
+After every committed batch the number of rows consumed is saved to a
+checkpoint file next to the feed, which lets an interrupted import resume
+where it stopped when asked to. The checkpoint records the feed's size,
+modification time and a hash of its first MiB, and is ignored when the
+file at that path no longer matches, such as when a new nightly feed has
+replaced the one that failed.
+"""
+import csv
+import gzip
+import hashlib
+import json
+import os
+import time
+from datetime import datetime
+
+from sqlalchemy.dialects import postgresql, sqlite
+from werkzeug.datastructures import MultiDict
+
+from app import db, search
+from app.forms import BookForm
+from app.models import Book
+
+# Columns a feed may provide; isbn is the upsert key and is required
+FEED_FIELDS = ('isbn', 'title', 'author', 'price_npr', 'category',
+               'description', 'image_url', 'stock_quantity')
+
+# Columns overwritten when a feed row matches an existing book
+UPDATED_FIELDS = ('title', 'author', 'price_npr', 'category',
+                  'description', 'image_url', 'stock_quantity')
+
+# Leading bytes of a feed hashed into its checkpoint fingerprint
+FINGERPRINT_BYTES = 1024 * 1024
+
+
+class ImportReport:
+    """Counters for one import run"""
+
+    def __init__(self, skipped=0, stale_checkpoint=False):
+        self.skipped = skipped
+        # A checkpoint was found but belonged to a different file
+        self.stale_checkpoint = stale_checkpoint
+        self.read = 0
+        self.inserted = 0
+        self.updated = 0
+        self.invalid = 0
+        self.batches = 0
+        self.started = time.perf_counter()
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    @property
+    def rows_per_second(self):
+        return self.read / self.elapsed if self.elapsed else 0.0
+
+
+def _open(path):
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8', newline='')
+    return open(path, 'r', encoding='utf-8', newline='')
+
+
+def detect_format(path):
+    """Guess the feed format from the file name"""
+    name = path[:-3] if path.endswith('.gz') else path
+    return 'jsonl' if name.endswith(('.jsonl', '.ndjson', '.json')) else 'csv'
+
+
+def read_rows(path, fmt):
+    """Yield feed rows as dicts, one at a time"""
+    with _open(path) as f:
+        if fmt == 'csv':
+            yield from csv.DictReader(f)
+        else:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def make_validator():
+    """Return a reusable BookForm for validating feed rows
+
+    Building a form is most of the per-row cost, so one instance is kept
+    for the whole import and re-processed with each row.
+    """
+    return BookForm(formdata=MultiDict(), meta={'csrf': False})
+
+
+def validate_row(row, form=None):
+    """Return ``(values, errors)`` for a feed row using BookForm's rules"""
+    form = form or make_validator()
+    data = MultiDict({k: '' if row.get(k) is None else str(row[k]) for k in FEED_FIELDS})
+    form.process(formdata=data)
+    # A known ISBN is an update, so skip the per-row uniqueness lookup
+    form.original_isbn = form.isbn.data
+    if not form.validate():
+        return None, form.errors
+    if not form.isbn.data:
+        return None, {'isbn': ['ISBN is required for catalog imports.']}
+    values = {field: form[field].data for field in FEED_FIELDS}
+    values['description'] = values['description'] or None
+    values['image_url'] = values['image_url'] or None
+    return values, None
+
+
+def _upsert_statement():
+    dialect = db.engine.dialect.name
+    if dialect == 'sqlite':
+        insert = sqlite.insert
+    elif dialect == 'postgresql':
+        insert = postgresql.insert
+    else:
+        raise RuntimeError(f'Bulk upsert is not supported on {dialect}')
+    stmt = insert(Book.__table__)
+    return stmt.on_conflict_do_update(
+        index_elements=[Book.__table__.c.isbn],
+        set_={**{field: stmt.excluded[field] for field in UPDATED_FIELDS},
+              'updated_at': datetime.utcnow()}
+    )
+
+
+def write_batch(batch, report):
+    """Upsert one batch of validated rows and refresh their search entries"""
+    # A row repeated within one batch would hit the same key twice; last one wins
+    by_isbn = {values['isbn']: values for values in batch}
+    isbns = list(by_isbn)
+    existing = {isbn for (isbn,) in db.session.query(Book.isbn).filter(Book.isbn.in_(isbns))}
+    db.session.execute(_upsert_statement(), list(by_isbn.values()))
+    ids = [book_id for (book_id,) in db.session.query(Book.id).filter(Book.isbn.in_(isbns))]
+    search.index_books(ids)
+    db.session.commit()
+    report.inserted += len(isbns) - len(existing)
+    report.updated += len(existing)
+    report.batches += 1
+
+
+def checkpoint_path(path):
+    return f'{path}.import-state.json'
+
+
+def source_fingerprint(path):
+    """Size, modification time and leading-bytes hash identifying one version of a feed"""
+    stat = os.stat(path)
+    with open(path, 'rb') as f:
+        head = hashlib.sha256(f.read(FINGERPRINT_BYTES)).hexdigest()
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'head_sha256': head}
+
+
+def _load_checkpoint(path, source):
+    """Rows already imported from this version of the feed, and whether a stale checkpoint was found"""
+    try:
+        with open(checkpoint_path(path)) as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return 0, False
+    if state.get('source') != source:
+        return 0, True
+    return state.get('rows_done', 0), False
+
+
+def _save_checkpoint(path, source, rows_done):
+    tmp = checkpoint_path(path) + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump({'source': source, 'rows_done': rows_done}, f)
+    os.replace(tmp, checkpoint_path(path))
+
+
+def import_catalog(path, fmt=None, batch_size=1000, resume=False, errors=None, progress=None):
+    """Stream ``path`` into the books table and return an ImportReport
+
+    With ``resume``, rows counted in a checkpoint left by an interrupted
+    import of the same file are skipped. ``errors`` is an optional writable
+    text file receiving one JSON line per rejected row. ``progress`` is
+    called with the report after each batch. The checkpoint is removed once
+    the whole file has been loaded.
+    """
+    fmt = fmt or detect_format(path)
+    source = source_fingerprint(path)
+    skip, stale = _load_checkpoint(path, source) if resume else (0, False)
+    report = ImportReport(skipped=skip, stale_checkpoint=stale)
+    form = make_validator()
+    batch = []
+    rows_done = 0
+
+    for line_no, row in enumerate(read_rows(path, fmt), start=1):
+        rows_done = line_no
+        if line_no <= skip:
+            continue
+        report.read += 1
+        values, row_errors = validate_row(row, form)
+        if row_errors:
+            report.invalid += 1
+            if errors is not None:
+                errors.write(json.dumps({'row': line_no, 'errors': row_errors, 'data': row}) + '\n')
+            continue
+        batch.append(values)
+        if len(batch) >= batch_size:
+            write_batch(batch, report)
+            _save_checkpoint(path, source, rows_done)
+            batch = []
+            if progress:
+                progress(report)
+
+    if batch:
+        write_batch(batch, report)
+        if progress:
+            progress(report)
+    if os.path.exists(checkpoint_path(path)):
+        os.remove(checkpoint_path(path))
+    return report
@@ -0,0 +1,112 @@
+"""Checkout: turn a user's cart into an order in one transaction
+
+Stock is reserved with a conditional decrement (``UPDATE books SET
+stock_quantity = stock_quantity - :n WHERE id = :id AND stock_quantity >=
+:n``) instead of read-modify-write, so concurrent buyers of the same title
+can never oversell it. Either every cart line is reserved and the order is
+written, or the whole transaction is rolled back and the caller gets the
+list of shortages.
+
+Lines are reserved in book id order, so two carts sharing titles lock the
+rows in the same order (no deadlocks on PostgreSQL). On SQLite the
+transaction takes the database write lock; when another checkout holds it
+the attempt fails with "database is locked" and is retried with a short
+random backoff, up to CHECKOUT_RETRIES times.
+"""
+import random
+import time
+from collections import namedtuple
+
+from flask import current_app
+from sqlalchemy import select, update
+from sqlalchemy.exc import OperationalError
+
+from app import db
+from app.models import Book, Cart, Order, OrderItem
+
+# A cart line that could not be reserved; ``available`` is the stock left
+Shortage = namedtuple('Shortage', 'book_id title requested available')
+
+
+class CheckoutError(Exception):
+    """Checkout could not run (empty cart, database too busy)"""
+
+
+class CheckoutResult:
+    """Outcome of place_order: an order, or the lines that were short"""
+
+    def __init__(self, order=None, shortages=()):
+        self.order = order
+        self.shortages = list(shortages)
+
+    @property
+    def ok(self):
+        return self.order is not None
+
+
+def _cart_lines(user_id):
+    return db.session.execute(
+        select(Cart.book_id, Cart.quantity, Book.title, Book.price_npr)
+        .join(Book, Cart.book_id == Book.id)
+        .where(Cart.user_id == user_id)
+        .order_by(Cart.book_id)
+    ).all()
+
+
+def _reserve(book_id, quantity):
+    """Take ``quantity`` copies off the shelf; False if not enough are left"""
+    books = Book.__table__
+    result = db.session.execute(
+        update(books)
+        .where(books.c.id == book_id, books.c.stock_quantity >= quantity)
+        .values(stock_quantity=books.c.stock_quantity - quantity)
+    )
+    return result.rowcount == 1
+
+
+def _attempt(user_id):
+    lines = _cart_lines(user_id)
+    if not lines:
+        raise CheckoutError('Your cart is empty.')
+
+    short = [line for line in lines if not _reserve(line.book_id, line.quantity)]
+    if short:
+        db.session.rollback()
+        available = dict(db.session.execute(
+            select(Book.id, Book.stock_quantity).where(Book.id.in_([line.book_id for line in short]))
+        ).all())
+        db.session.rollback()
+        return CheckoutResult(shortages=[
+            Shortage(line.book_id, line.title, line.quantity, available.get(line.book_id, 0))
+            for line in short
+        ])
+
+    total = sum(line.price_npr * line.quantity for line in lines)
+    order = Order(user_id=user_id, total_npr=round(total, 2))
+    order.items = [OrderItem(book_id=line.book_id, title=line.title,
+                             unit_price_npr=line.price_npr, quantity=line.quantity)
+                   for line in lines]
+    db.session.add(order)
+    # Only the lines that were ordered, in case the cart changed meanwhile
+    db.session.execute(Cart.__table__.delete().where(
+        Cart.user_id == user_id, Cart.book_id.in_([line.book_id for line in lines])
+    ))
+    db.session.commit()
+    return CheckoutResult(order=order)
+
+
+def place_order(user_id):
+    """Convert the user's cart into an order, all or nothing
+
+    Returns a CheckoutResult. Raises CheckoutError for an empty cart or
+    when the database stays locked through every retry.
+    """
+    attempts = current_app.config['CHECKOUT_RETRIES']
+    for attempt in range(attempts):
+        try:
+            return _attempt(user_id)
+        except OperationalError as exc:
+            db.session.rollback()
+            if attempt == attempts - 1:
+                raise CheckoutError('The store is very busy right now. Please try again.') from exc
+            time.sleep(random.uniform(0, 0.01 * 2 ** attempt))
@@ -0,0 +1,314 @@
+"""Maintenance commands, run with ``flask --app run <command>``"""
+import time
+
+import click
+from sqlalchemy import inspect, text
+from sqlalchemy.schema import CreateColumn
+
+
+def merge_duplicate_cart_rows(conn):
+    """Fold duplicate (user_id, book_id) cart rows into the oldest one"""
+    conn.execute(text(
+        'UPDATE cart SET quantity = (SELECT SUM(c2.quantity) FROM cart c2 '
+        'WHERE c2.user_id = cart.user_id AND c2.book_id = cart.book_id) '
+        'WHERE id IN (SELECT MIN(id) FROM cart GROUP BY user_id, book_id HAVING COUNT(*) > 1)'
+    ))
+    return conn.execute(text(
+        'DELETE FROM cart WHERE id NOT IN (SELECT MIN(id) FROM cart GROUP BY user_id, book_id)'
+    )).rowcount
+
+
+def backfill_book_updated_at(conn):
+    """Start existing books' update stamps at their creation time"""
+    conn.execute(text('UPDATE books SET updated_at = created_at'))
+
+
+# Data fixes that must run before a unique index can be created
+PRE_INDEX_MIGRATIONS = {
+    'unique_user_book_cart': merge_duplicate_cart_rows,
+}
+
+
+def backfill_rating_histogram(conn):
+    """Count existing reviews into the books' per-star columns"""
+    for stars in range(1, 6):
+        conn.execute(text(
+            f'UPDATE books SET rating_{stars}_count = '
+            f'(SELECT COUNT(*) FROM reviews WHERE reviews.book_id = books.id AND reviews.rating = {stars})'
+        ))
+
+
+def backfill_rating_totals(conn):
+    """Count and sum existing reviews into the books' running rating totals"""
+    conn.execute(text(
+        'UPDATE books SET '
+        'rating_count = (SELECT COUNT(*) FROM reviews WHERE reviews.book_id = books.id), '
+        'rating_sum = (SELECT COALESCE(SUM(rating), 0) FROM reviews WHERE reviews.book_id = books.id)'
+    ))
+
+
+# Backfills run right after a column is added to an existing table
+POST_COLUMN_MIGRATIONS = {
+    'books.updated_at': backfill_book_updated_at,
+    # Added together; reviews update the average from these totals
+    'books.rating_sum': backfill_rating_totals,
+    # The per-star columns are added together; the last one fills them all
+    'books.rating_5_count': backfill_rating_histogram,
+}
+
+
+def backfill_facet_counts(conn):
+    """Count the existing books into their facet cells"""
+    from app import facets
+
+    facets.rebuild_counts(conn)
+
+
+def backfill_stat_counters(conn):
+    """Compute the dashboard counters from the existing rows"""
+    from app import stats
+
+    stats.rebuild_counters(conn)
+
+
+def backfill_daily_stats(conn):
+    """Count the existing users and reviews into their creation days"""
+    from app import stats
+
+    stats.rebuild_series(conn)
+
+
+# Backfills run once a table is created in an existing database
+POST_TABLE_MIGRATIONS = {
+    'facet_counts': backfill_facet_counts,
+    'stat_counters': backfill_stat_counters,
+    'daily_stats': backfill_daily_stats,
+}
+
+
+def upgrade_schema(db):
+    """Bring an existing database up to the current models
+
+    Creates missing tables, adds missing columns (new NOT NULL columns must
+    carry a server default) and creates missing indexes. Backfills in
+    POST_TABLE_MIGRATIONS and POST_COLUMN_MIGRATIONS run after their table
+    or column is added, and data fixes in PRE_INDEX_MIGRATIONS before their
+    index is created. Returns a list of the changes made. This is
+    deliberately additive; nothing is dropped.
+    """
+    existing_tables = set(inspect(db.engine).get_table_names())
+    created = [table.name for table in db.metadata.sorted_tables if table.name not in existing_tables]
+    changes = [f'created table {name}' for name in created]
+    db.create_all()
+    inspector = inspect(db.engine)
+    with db.engine.begin() as conn:
+        for name in created:
+            backfill = POST_TABLE_MIGRATIONS.get(name)
+            if backfill:
+                backfill(conn)
+        for table in db.metadata.sorted_tables:
+            existing = {col['name'] for col in inspector.get_columns(table.name)}
+            for col in table.columns:
+                if col.name in existing:
+                    continue
+                ddl = CreateColumn(col).compile(dialect=db.engine.dialect)
+                conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {ddl}'))
+                changes.append(f'added column {table.name}.{col.name}')
+                backfill = POST_COLUMN_MIGRATIONS.get(f'{table.name}.{col.name}')
+                if backfill:
+                    backfill(conn)
+            existing_indexes = {ix['name'] for ix in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in existing_indexes:
+                    migrate = PRE_INDEX_MIGRATIONS.get(index.name)
+                    if migrate:
+                        merged = migrate(conn)
+                        if merged:
+                            changes.append(f'merged {merged} duplicate row(s) in {table.name}')
+                    index.create(conn)
+                    changes.append(f'created index {index.name}')
+    return changes
+
+
+def register_commands(app):
+    """Attach the maintenance commands to the app's CLI"""
+
+    @app.cli.command('upgrade-db')
+    def upgrade_db():
+        """Add tables, columns and indexes introduced since the database was created"""
+        from app import db
+
+        changes = upgrade_schema(db)
+        for change in changes:
+            click.echo(change)
+        click.echo('Database is up to date.' if not changes else f'{len(changes)} change(s) applied.')
+
+    @app.cli.command('import-catalog')
+    @click.argument('path', type=click.Path(exists=True, dir_okay=False))
+    @click.option('--format', 'fmt', type=click.Choice(['csv', 'jsonl']),
+                  help='Feed format (guessed from the file name by default).')
+    @click.option('--batch-size', default=1000, show_default=True, help='Rows per upsert batch.')
+    @click.option('--resume/--restart', default=False, show_default=True,
+                  help='Continue from the checkpoint an interrupted import of the same file '
+                       'left, or start from the first row.')
+    @click.option('--errors', 'errors_path', type=click.Path(dir_okay=False),
+                  help='Write rejected rows with their validation errors to this JSONL file.')
+    def import_catalog_command(path, fmt, batch_size, resume, errors_path):
+        """Bulk-load a CSV or JSONL catalog feed, upserting books by ISBN"""
+        from app import cache
+        from app.catalog_import import import_catalog
+
+        def progress(report):
+            click.echo(f'  {report.skipped + report.read:>10,} rows  '
+                       f'{report.inserted:,} inserted  {report.updated:,} updated  '
+                       f'{report.invalid:,} rejected  {report.rows_per_second:,.0f} rows/s')
+
+        errors = open(errors_path, 'w', encoding='utf-8') if errors_path else None
+        try:
+            report = import_catalog(path, fmt=fmt, batch_size=batch_size, resume=resume,
+                                    errors=errors, progress=progress)
+        finally:
+            if errors:
+                errors.close()
+        cache.invalidate_all()
+
+        if report.stale_checkpoint:
+            click.echo('Ignored a checkpoint left by a different version of the file.')
+        if report.skipped:
+            click.echo(f'Resumed after {report.skipped:,} rows already imported.')
+        click.echo(f'Read {report.read:,} rows in {report.elapsed:.1f}s '
+                   f'({report.rows_per_second:,.0f} rows/s, {report.batches} batches).')
+        click.echo(f'Inserted {report.inserted:,}, updated {report.updated:,}, '
+                   f'rejected {report.invalid:,}.')
+
+    @app.cli.command('repair-ratings')
+    def repair_ratings():
+        """Recompute every book's rating count, sum, average and histogram from its reviews"""
+        from app.models import Book
+
+        updated = Book.rebuild_rating_aggregates()
+        click.echo(f'Recomputed rating aggregates for {updated} books.')
+
+    @app.cli.command('rebuild-facets')
+    def rebuild_facets():
+        """Recreate the facet count triggers and recount every cell from the books table"""
+        from app import cache, db, facets
+        from app.models import FacetCount
+
+        with db.engine.begin() as conn:
+            facets.drop_triggers(conn)
+            facets.install_triggers(conn)
+            facets.rebuild_counts(conn)
+        cache.invalidate_all()
+        click.echo(f'Counted books into {FacetCount.query.filter(FacetCount.book_count > 0).count()} facet cells.')
+
+    @app.cli.command('rebuild-stats')
+    def rebuild_stats():
+        """Recreate the dashboard statistics triggers and recount every figure"""
+        from app import db, stats
+
+        with db.engine.begin() as conn:
+            stats.drop_triggers(conn)
+            stats.install_triggers(conn)
+            stats.rebuild_counters(conn)
+            stats.rebuild_series(conn)
+        counters = stats.counters()
+        click.echo(f'Recounted {counters.books:,.0f} books, {counters.users:,.0f} users, '
+                   f'{counters.reviews:,.0f} reviews and {counters.cart_lines:,.0f} cart lines.')
+
+    @app.cli.command('refresh-recommendations')
+    @click.option('--full', is_flag=True,
+                  help='Rebuild every list instead of only those touched by new activity.')
+    def refresh_recommendations(full):
+        """Recompute the "readers also liked" neighbours of each book"""
+        from app import recommendations
+
+        started = time.perf_counter()
+        run = recommendations.refresh(full=full)
+        if recommendations.sparse is None:
+            click.echo('numpy/scipy are not installed; counted in pure Python.')
+        click.echo(f'{"Full" if run.full else "Incremental"} run refreshed {run.books_refreshed:,} '
+                   f'books in {time.perf_counter() - started:.1f}s.')
+
+    @app.cli.command('reindex-search')
+    def reindex_search():
+        """Rebuild the full-text search index from the books table"""
+        from app import db, search
+        from app.models import Book
+
+        if db.engine.dialect.name != 'sqlite':
+            click.echo('Full-text index is only used with SQLite; nothing to do.')
+            return
+        search.rebuild_index()
+        click.echo(f'Indexed {Book.query.count()} books.')
+
+    @app.cli.command('ingest-covers')
+    @click.option('--all', 'refetch', is_flag=True,
+                  help='Also re-fetch books that already have a local cover.')
+    def ingest_covers(refetch):
+        """Download remote cover images into local storage and render their sizes"""
+        from app import db, images, jobs
+        from app.models import Book
+
+        query = Book.query.filter(Book.image_url.like('http%'))
+        if not refetch:
+            query = query.filter(Book.cover_hash.is_(None))
+        for book_id, url in query.with_entities(Book.id, Book.image_url).all():
+            images.ingest_url(book_id, url)
+        db.session.commit()
+
+        # Run the queue here rather than waiting for a worker
+        succeeded, failed = jobs.run_pending()
+        click.echo(f'Processed {succeeded} job(s), {failed} failed; '
+                   'failures are retried by `run-jobs` (see `jobs-status`).')
+
+    @app.cli.command('run-jobs')
+    @click.option('--threads', default=4, show_default=True, help='Jobs run at the same time.')
+    @click.option('--burst', is_flag=True, help='Exit once no job is due instead of waiting for more.')
+    def run_jobs(threads, burst):
+        """Run background jobs from the queue until interrupted"""
+        from app import jobs
+
+        jobs.recover_stale()
+        if burst:
+            succeeded, failed = jobs.run_pending()
+            click.echo(f'Ran {succeeded + failed} job(s), {failed} failed.')
+            return
+        pool = jobs.WorkerPool(app, threads)
+        pool.start()
+        click.echo(f'Running jobs with {threads} thread(s); Ctrl+C stops after the current jobs.')
+        try:
+            while True:
+                time.sleep(60)
+        except KeyboardInterrupt:
+            click.echo('Stopping...')
+            pool.stop()
+
+    @app.cli.command('jobs-status')
+    @click.option('--retry-failed', is_flag=True, help='Queue failed jobs again with fresh attempts.')
+    def jobs_status(retry_failed):
+        """Show queued, running and failed background jobs"""
+        from app import jobs
+
+        if retry_failed:
+            click.echo(f'Queued {jobs.retry_failed()} failed job(s) again.')
+        rows = jobs.queue_stats()
+        for name, status, count, first_due in rows:
+            due = f'  first due {first_due:%Y-%m-%d %H:%M:%S}' if status == 'pending' else ''
+            click.echo(f'  {name:<28} {status:<8} {count:>6,}{due}')
+        if not rows:
+            click.echo('No jobs queued.')
+
+    @app.cli.command('build-assets')
+    @click.option('--clean', is_flag=True, help='Delete earlier builds first.')
+    def build_assets(clean):
+        """Minify, fingerprint and precompress the files under app/static"""
+        from app import assets
+
+        report = assets.build(app.static_folder, clean=clean)
+        for source, built, original_size, size, compressed in report:
+            sizes = '  '.join(f'{encoding} {len(blob):,}' for encoding, blob in sorted(compressed.items()))
+            click.echo(f'  {source} -> {built}  {original_size:,} -> {size:,} bytes  {sizes}')
+        if assets.brotli is None:
+            click.echo('brotli is not installed; only gzip copies were written.')
+        click.echo(f'Built {len(report)} asset(s). Restart the app to serve them.')
@@ -0,0 +1,111 @@
+"""Engine tuning and read-replica routing
+
+``configure(app)`` runs before ``db.init_app`` and turns the ``DB_POOL_*``
+settings into engine options for server databases (SQLite file databases
+keep SQLAlchemy's defaults), adding a ``replica`` bind when
+``DATABASE_REPLICA_URL`` is set. ``init_app(app)`` then runs
+``SQLITE_PRAGMAS`` on every new SQLite connection, which by default
+switches to WAL so readers are no longer blocked by review and cart writes.
+
+Views decorated with ``@replica_reads`` send their SELECTs to the replica;
+flushes and INSERT/UPDATE/DELETE statements always go to the primary. For
+``REPLICA_STICKY_SECONDS`` after a user's own write their reads stay on the
+primary, so replication lag never hides a change they just made.
+"""
+import time
+from functools import wraps
+
+from flask import current_app, g, has_request_context, request, session
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+REPLICA_BIND = 'replica'
+
+# Session key holding the time until which the user's reads use the primary
+STICKY_KEY = '_primary_until'
+
+_SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+class RoutingSession(Session):
+    """Session that sends reads from @replica_reads views to the replica"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (bind is None and not self._flushing and _replica_requested()
+                and (clause is None or getattr(clause, 'is_select', False))):
+            return self._db.engines[REPLICA_BIND]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def _replica_requested():
+    return has_request_context() and g.get('_replica_reads', False)
+
+
+def _pool_options(config, url):
+    if make_url(url).get_backend_name() == 'sqlite':
+        return {}
+    return {
+        'pool_size': config['DB_POOL_SIZE'],
+        'max_overflow': config['DB_MAX_OVERFLOW'],
+        'pool_timeout': config['DB_POOL_TIMEOUT'],
+        'pool_recycle': config['DB_POOL_RECYCLE'],
+        'pool_pre_ping': config['DB_POOL_PRE_PING'],
+    }
+
+
+def configure(app):
+    """Derive engine options and binds from the config (before db.init_app)"""
+    config = app.config
+    options = _pool_options(config, config['SQLALCHEMY_DATABASE_URI'])
+    # Anything set explicitly in SQLALCHEMY_ENGINE_OPTIONS wins
+    config['SQLALCHEMY_ENGINE_OPTIONS'] = {**options, **config.get('SQLALCHEMY_ENGINE_OPTIONS', {})}
+
+    replica_url = config.get('DATABASE_REPLICA_URL')
+    if replica_url:
+        binds = dict(config.get('SQLALCHEMY_BINDS') or {})
+        binds[REPLICA_BIND] = {'url': replica_url, **_pool_options(config, replica_url)}
+        config['SQLALCHEMY_BINDS'] = binds
+
+
+def _pragma_listener(pragmas):
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name} = {value}')
+        cursor.close()
+    return set_pragmas
+
+
+def init_app(app):
+    """Install SQLite pragmas and the read-your-writes hook"""
+    db = app.extensions['sqlalchemy']
+    pragmas = app.config['SQLITE_PRAGMAS']
+    if pragmas:
+        with app.app_context():
+            for engine in db.engines.values():
+                if engine.dialect.name == 'sqlite':
+                    event.listen(engine, 'connect', _pragma_listener(pragmas))
+
+    if app.config.get('DATABASE_REPLICA_URL'):
+        @app.after_request
+        def stick_to_primary_after_write(response):
+            if request.method not in _SAFE_METHODS:
+                session[STICKY_KEY] = time.time() + app.config['REPLICA_STICKY_SECONDS']
+            return response
+
+
+def replica_available():
+    """True when this request may read from the replica"""
+    return (REPLICA_BIND in (current_app.config.get('SQLALCHEMY_BINDS') or {})
+            and session.get(STICKY_KEY, 0) < time.time())
+
+
+def replica_reads(f):
+    """Route a read-only view's SELECTs to the replica when one is configured"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if replica_available():
+            g._replica_reads = True
+        return f(*args, **kwargs)
+    return decorated_function
@@ -0,0 +1,122 @@
+"""Streaming CSV / JSONL exports for admins
+
+Exports are built from plain column selects (no ORM objects), read through
+a server-side cursor in ``yield_per`` chunks and written to the response
+as they arrive, optionally gzip-compressed on the fly. Memory use stays
+flat however large the table is.
+"""
+import csv
+import io
+import json
+import zlib
+from datetime import datetime
+
+from sqlalchemy import select
+
+from app import db
+from app.models import Book, Cart, Review, User
+
+EXPORT_FORMATS = ('csv', 'jsonl')
+
+# Rows fetched from the cursor per round trip
+CHUNK_ROWS = 1000
+
+
+def _books():
+    return select(Book.id, Book.isbn, Book.title, Book.author, Book.category,
+                  Book.price_npr, Book.stock_quantity, Book.average_rating,
+                  Book.rating_count, Book.description, Book.image_url,
+                  Book.created_at).order_by(Book.id)
+
+
+def _reviews():
+    return (select(Review.id, Review.book_id, Book.isbn, Review.user_id, User.username,
+                   Review.rating, Review.review_text, Review.created_at)
+            .join(Book, Review.book_id == Book.id)
+            .join(User, Review.user_id == User.id)
+            .order_by(Review.id))
+
+
+def _carts():
+    return (select(Cart.id, Cart.user_id, Cart.book_id, Book.isbn, Book.category,
+                   Cart.quantity, Book.price_npr, Cart.added_at)
+            .join(Book, Cart.book_id == Book.id)
+            .order_by(Cart.id))
+
+
+# Every dataset joins or selects from books, so the filters apply uniformly
+DATASETS = {
+    'books': _books,
+    'reviews': _reviews,
+    'carts': _carts,
+}
+
+
+def build_query(dataset, category=None, in_stock=None):
+    """Return the select for a dataset with the optional filters applied"""
+    stmt = DATASETS[dataset]()
+    if category:
+        stmt = stmt.where(Book.category == category)
+    if in_stock is True:
+        stmt = stmt.where(Book.stock_quantity > 0)
+    elif in_stock is False:
+        stmt = stmt.where(Book.stock_quantity <= 0)
+    return stmt
+
+
+def stream_rows(stmt):
+    """Yield ``(columns, rows)`` chunks from a server-side cursor"""
+    with db.engine.connect() as conn:
+        result = conn.execution_options(stream_results=True, yield_per=CHUNK_ROWS).execute(stmt)
+        columns = list(result.keys())
+        # An empty first chunk lets encoders emit headers for empty exports
+        yield columns, []
+        for partition in result.partitions():
+            yield columns, partition
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+
+def encode_csv(chunks):
+    """Turn row chunks into CSV text, one string per chunk"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    header_written = False
+    for columns, rows in chunks:
+        if not header_written:
+            writer.writerow(columns)
+            header_written = True
+        writer.writerows(rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+
+def encode_jsonl(chunks):
+    """Turn row chunks into JSON Lines text, one string per chunk"""
+    for columns, rows in chunks:
+        yield ''.join(json.dumps(dict(zip(columns, row)), default=_json_default,
+                                 ensure_ascii=False) + '\n' for row in rows)
+
+
+def gzip_stream(chunks):
+    """Compress text chunks into a gzip byte stream incrementally"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export(dataset, fmt, category=None, in_stock=None, compress=False):
+    """Return a generator producing the whole export"""
+    chunks = stream_rows(build_query(dataset, category, in_stock))
+    body = encode_csv(chunks) if fmt == 'csv' else encode_jsonl(chunks)
+    if compress:
+        return gzip_stream(body)
+    return (chunk.encode('utf-8') for chunk in body)
@@ -0,0 +1,246 @@
+"""Faceted category browsing: price, rating and stock filters with counts
+
+Every book sits in one cell of (category, price band, rating band, in
+stock), and ``facet_counts`` holds the number of books in each cell. On
+SQLite, triggers on ``books`` move a book between cells in the same
+transaction as the write that changed it. That covers admin edits,
+checkout stock decrements, review aggregates and bulk imports alike. A
+request reads the few hundred cells once and derives every count from
+them, so counts never need a GROUP BY over the catalog. Other databases
+fall back to that GROUP BY. The navigation's per-category totals are
+also cached between catalog-wide invalidations.
+
+Listings filter the book columns directly and are ordered by one of
+SORTS. Each sort has a category index on books that leads with the sort
+key and carries the other facet columns. Filters are therefore checked
+inside the index, and only the rows of the page are read from the table.
+
+Changing the bands below needs ``flask --app run rebuild-facets``.
+"""
+import json
+from collections import Counter, namedtuple
+from types import SimpleNamespace
+
+from flask import g
+from sqlalchemy import Integer, case, cast, event, func, literal_column, select, text
+
+from app import cache, db
+from app.cache import CATALOG_NAMESPACE
+from app.models import Book, FacetCount
+
+# (label, low, high) in ascending order; a book's price band is its position
+PRICE_BANDS = [
+    ('Under Rs. 1,000', None, 1000),
+    ('Rs. 1,000 - 1,500', 1000, 1500),
+    ('Rs. 1,500 - 2,500', 1500, 2500),
+    ('Rs. 2,500 and over', 2500, None),
+]
+
+# "N stars & up" filters; a book's rating band is its whole stars
+RATING_FILTERS = (4, 3, 2, 1)
+
+# Sort name -> (label, keyset ordering); the last key must be unique
+SORTS = {
+    'rating': ('Highest rated', [(Book.average_rating, True), (Book.id, True)]),
+    'price_asc': ('Price: low to high', [(Book.price_npr, False), (Book.id, False)]),
+    'price_desc': ('Price: high to low', [(Book.price_npr, True), (Book.id, True)]),
+    'newest': ('Newest first', [(Book.created_at, True), (Book.id, True)]),
+}
+
+DEFAULT_SORT = 'rating'
+
+TRIGGERS = ('facet_counts_book_insert', 'facet_counts_book_update', 'facet_counts_book_delete')
+
+Cell = namedtuple('Cell', 'category price_band rating_band in_stock count')
+
+# Counts shown next to each option, given the other selections
+FacetCounts = namedtuple('FacetCounts', 'price rating in_stock total')
+
+
+# ---- cells ----
+
+def price_band(price):
+    return case(*[(price < high, band) for band, (_, _, high) in enumerate(PRICE_BANDS) if high is not None],
+                else_=len(PRICE_BANDS) - 1)
+
+
+def rating_band(rating):
+    return cast(func.coalesce(rating, 0), Integer)
+
+
+def _cell(row):
+    """Cell expressions for ``row``, which has the books columns as attributes"""
+    return (row.category, price_band(row.price_npr), rating_band(row.average_rating),
+            row.stock_quantity > 0)
+
+
+def _trigger_row(name):
+    return SimpleNamespace(**{column: literal_column(f'{name}.{column}')
+                              for column in ('category', 'price_npr', 'average_rating', 'stock_quantity')})
+
+
+def _trigger_ddl(dialect):
+    def sql(expr):
+        return str(expr.compile(dialect=dialect, compile_kwargs={'literal_binds': True}))
+
+    new = [sql(expr) for expr in _cell(_trigger_row('NEW'))]
+    old = [sql(expr) for expr in _cell(_trigger_row('OLD'))]
+    add = ('INSERT INTO facet_counts (category, price_band, rating_band, in_stock, book_count) '
+           f'VALUES ({", ".join(new)}, 1) '
+           'ON CONFLICT (category, price_band, rating_band, in_stock) '
+           'DO UPDATE SET book_count = book_count + 1;')
+    remove = ('UPDATE facet_counts SET book_count = book_count - 1 WHERE '
+              + ' AND '.join(f'{column} = {value}' for column, value in
+                             zip(('category', 'price_band', 'rating_band', 'in_stock'), old))
+              + ';')
+    moved = ' OR '.join(f'({before}) IS NOT ({after})' for before, after in zip(old, new))
+    return [
+        f'CREATE TRIGGER IF NOT EXISTS facet_counts_book_insert AFTER INSERT ON books '
+        f'BEGIN {add} END',
+        f'CREATE TRIGGER IF NOT EXISTS facet_counts_book_update '
+        f'AFTER UPDATE OF category, price_npr, average_rating, stock_quantity ON books '
+        f'WHEN {moved} BEGIN {remove} {add} END',
+        f'CREATE TRIGGER IF NOT EXISTS facet_counts_book_delete AFTER DELETE ON books '
+        f'BEGIN {remove} END',
+    ]
+
+
+def install_triggers(connection):
+    """Create the triggers that keep facet_counts current (SQLite only)"""
+    if connection.dialect.name != 'sqlite':
+        return
+    for ddl in _trigger_ddl(connection.dialect):
+        connection.execute(text(ddl))
+
+
+def drop_triggers(connection):
+    for name in TRIGGERS:
+        connection.execute(text(f'DROP TRIGGER IF EXISTS {name}'))
+
+
+def rebuild_counts(connection):
+    """Recount every cell from the books table (backfill or repair)"""
+    cell = _cell(Book.__table__.c)
+    facet_counts = FacetCount.__table__
+    connection.execute(facet_counts.delete())
+    connection.execute(facet_counts.insert().from_select(
+        ['category', 'price_band', 'rating_band', 'in_stock', 'book_count'],
+        select(*cell, func.count()).group_by(*cell)
+    ))
+
+
+@event.listens_for(db.metadata, 'after_create')
+def _create_triggers(target, connection, **kw):
+    # After every table, since the triggers span books and facet_counts
+    install_triggers(connection)
+
+
+def _cells():
+    """Every non-empty cell, read once per request"""
+    if '_facet_cells' not in g:
+        if db.engine.dialect.name == 'sqlite':
+            stmt = (select(FacetCount.category, FacetCount.price_band, FacetCount.rating_band,
+                           FacetCount.in_stock, FacetCount.book_count)
+                    .where(FacetCount.book_count > 0))
+        else:
+            cell = _cell(Book)
+            stmt = select(*cell, func.count()).group_by(*cell)
+        g._facet_cells = [Cell(*row) for row in db.session.execute(stmt)]
+    return g._facet_cells
+
+
+# ---- browsing ----
+
+def _choice(value, allowed):
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        return None
+    return value if value in allowed else None
+
+
+class Filters:
+    """Facet selections from the query string; invalid values are ignored"""
+
+    def __init__(self, args):
+        self.price = _choice(args.get('price'), range(len(PRICE_BANDS)))
+        self.rating = _choice(args.get('rating'), RATING_FILTERS)
+        self.in_stock = args.get('in_stock') == '1'
+        sort = args.get('sort')
+        self.sort = sort if sort in SORTS else DEFAULT_SORT
+
+    @property
+    def active(self):
+        return self.price is not None or self.rating is not None or self.in_stock
+
+    @property
+    def order_by(self):
+        return SORTS[self.sort][1]
+
+    def apply(self, query):
+        """Filter a Book query by the selections"""
+        sort_key = self.order_by[0][0]
+
+        def column(col):
+            # Only the sort key may drive the index search. Written as
+            # ``col + 0``, the other filters cannot tempt SQLite into a range
+            # scan plus a sort; they are checked inside the sort's index.
+            return col if col is sort_key else col + 0
+
+        if self.price is not None:
+            _, low, high = PRICE_BANDS[self.price]
+            if low is not None:
+                query = query.filter(column(Book.price_npr) >= low)
+            if high is not None:
+                query = query.filter(column(Book.price_npr) < high)
+        if self.rating is not None:
+            query = query.filter(column(Book.average_rating) >= self.rating)
+        if self.in_stock:
+            query = query.filter(column(Book.stock_quantity) > 0)
+        return query
+
+    def matches(self, cell, ignore=None):
+        """True if the cell passes every selection except ``ignore``"""
+        return ((ignore == 'price' or self.price is None or cell.price_band == self.price)
+                and (ignore == 'rating' or self.rating is None or cell.rating_band >= self.rating)
+                and (ignore == 'in_stock' or not self.in_stock or cell.in_stock))
+
+    def args(self, **changes):
+        """URL arguments for these selections with ``changes`` applied (None drops one)"""
+        args = {'price': self.price, 'rating': self.rating, 'in_stock': 1 if self.in_stock else None,
+                'sort': None if self.sort == DEFAULT_SORT else self.sort}
+        args.update(changes)
+        return {name: value for name, value in args.items() if value is not None}
+
+
+def category_totals():
+    """Books per category for the navigation
+
+    Cached under the catalog-wide generation, which every change to the
+    totals (adding, deleting or recategorising books, imports) bumps.
+    """
+    backend = cache.get_backend()
+    key = f'facets:categories:{cache.generation(CATALOG_NAMESPACE)}'
+    cached = backend.get(key)
+    if cached is not None:
+        return Counter(json.loads(cached))
+    totals = Counter()
+    for cell in _cells():
+        totals[cell.category] += cell.count
+    backend.set(key, json.dumps(totals).encode())
+    return totals
+
+
+def facet_counts(category, filters):
+    """Counts for every option in ``category``, each given the other selections"""
+    cells = [cell for cell in _cells() if cell.category == category]
+
+    def count(keep, ignore=None):
+        return sum(cell.count for cell in cells if keep(cell) and filters.matches(cell, ignore))
+
+    return FacetCounts(
+        price=[count(lambda cell: cell.price_band == band, 'price') for band in range(len(PRICE_BANDS))],
+        rating={stars: count(lambda cell: cell.rating_band >= stars, 'rating') for stars in RATING_FILTERS},
+        in_stock=count(lambda cell: cell.in_stock, 'in_stock'),
+        total=count(lambda cell: True),
+    )
@@ -1,7 +1,8 @@
 from flask_wtf import FlaskForm
+from flask_wtf.file import FileAllowed, FileField
 from wtforms import StringField, PasswordField, BooleanField, SubmitField, TextAreaField, FloatField, IntegerField, SelectField
-from wtforms.validators import DataRequired, Email, EqualTo, Length, ValidationError, NumberRange
-from app.models import User
+from wtforms.validators import DataRequired, InputRequired, Optional, Email, EqualTo, Length, ValidationError, NumberRange
+from app.models import User, Book, BOOK_CATEGORIES
 
 
 class RegistrationForm(FlaskForm):
@@ -45,8 +46,19 @@ class LoginForm(FlaskForm):
     submit = SubmitField('Login')
 
 
+def normalize_isbn(value):
+    """Strip spaces and hyphens so ISBNs compare reliably"""
+    if not value:
+        return None
+    return value.replace('-', '').replace(' ', '').upper() or None
+
+
 class BookForm(FlaskForm):
     """Book management form for admin"""
+    isbn = StringField('ISBN', filters=[normalize_isbn], validators=[
+        Optional(),
+        Length(min=10, max=13, message='ISBN must be 10 or 13 characters')
+    ])
     title = StringField('Title', validators=[
         DataRequired(),
         Length(max=200)
@@ -56,26 +68,31 @@ class BookForm(FlaskForm):
         Length(max=150)
     ])
     price_npr = FloatField('Price (NPR)', validators=[
-        DataRequired(),
+        InputRequired(),
         NumberRange(min=0, message='Price must be positive')
     ])
-    category = SelectField('Category', validators=[DataRequired()], choices=[
-        ('Photography', 'Photography'),
-        ('Investing', 'Investing'),
-        ('Literature', 'Literature'),
-        ('Languages', 'Languages'),
-        ('Biography', 'Biography'),
-        ('Reference', 'Reference'),
-        ('Wellness', 'Wellness'),
-        ('Graphic Novels', 'Graphic Novels')
-    ])
+    category = SelectField('Category', validators=[DataRequired()],
+                           choices=[(c, c) for c in BOOK_CATEGORIES])
     description = TextAreaField('Description', validators=[Length(max=2000)])
     image_url = StringField('Image URL', validators=[Length(max=500)])
+    cover = FileField('Upload Cover', validators=[
+        FileAllowed(['jpg', 'jpeg', 'png', 'webp', 'gif'], 'Cover must be a JPEG, PNG, WebP or GIF image.')
+    ])
     stock_quantity = IntegerField('Stock Quantity', validators=[
-        DataRequired(),
+        InputRequired(),
         NumberRange(min=0, message='Stock cannot be negative')
     ])
     submit = SubmitField('Save Book')
+    
+    def __init__(self, *args, original_isbn=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.original_isbn = original_isbn
+    
+    def validate_isbn(self, isbn):
+        """Check the ISBN is not already used by another book"""
+        if isbn.data and isbn.data != self.original_isbn:
+            if Book.query.filter_by(isbn=isbn.data).first():
+                raise ValidationError('Another book already uses this ISBN.')
 
 
 class ReviewForm(FlaskForm):
@@ -0,0 +1,186 @@
+"""Conditional GET (ETag / Last-Modified / 304) for catalog pages
+
+``@conditional(validator)`` runs a cheap version query before the view.
+``validator`` is called with the view's keyword arguments and returns a
+``Validator``, or None to let the view answer (for a 404, say). The ETag
+hashes that version with the release (templates and asset manifest) and
+the catalog-wide cache generation, which moves when the navigation's
+category counts do. For logged-in users it also hashes their identity and
+cart badge, since the page header shows them. A matching
+``If-None-Match`` is answered with 304 without querying or rendering the
+page.
+
+Anonymous pages are ``public`` with ``s-maxage=HTTP_CACHE_SHARED_MAX_AGE``,
+so a front proxy may serve them for a short while. Browsers always
+revalidate. Logged-in pages are ``private, no-cache``. Both carry
+``Vary: Cookie``.
+
+A book's version is its ``updated_at``, which every edit, stock change
+and review bumps. The book page adds the generation of its page cache,
+which a recommendation refresh bumps when its "also liked" list changes,
+so refreshes never write to ``books``. Listing pages use a catalog
+version: a row in ``stat_counters`` for the whole catalog and one per
+category, which SQLite triggers on ``books`` bump on every insert, update
+and delete, so checking it is a primary key lookup. Without those rows
+(other databases, or before ``upgrade-db``) the book count and newest
+``updated_at`` stand in, each read with its own query.
+"""
+import hashlib
+import os
+from collections import namedtuple
+from datetime import timezone
+from functools import wraps
+
+from flask import current_app, g, request, session, Response
+from flask_login import current_user
+from sqlalchemy import event, func, select, text
+
+from app import cache, db
+from app.cache import CATALOG_NAMESPACE
+from app.cart_summary import get_cart_summary
+from app.models import Book, StatCounter
+
+# ``token`` identifies the data a page shows; ``last_modified`` is only
+# given when it alone moves on every change (single-book pages)
+Validator = namedtuple('Validator', 'token last_modified')
+
+
+def init_app(app):
+    """Fingerprint the release, so a deploy changes every ETag"""
+    digest = hashlib.sha1()
+    roots = [app.jinja_loader.searchpath[0], os.path.join(app.static_folder, 'dist')]
+    for root in roots:
+        for dirpath, dirnames, filenames in sorted(os.walk(root)):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                if filename.endswith(('.html', '.json')):
+                    with open(os.path.join(dirpath, filename), 'rb') as f:
+                        digest.update(f.read())
+    app.extensions['release_fingerprint'] = digest.hexdigest()[:12]
+
+
+# ---- catalog versions ----
+
+# stat_counters row for the whole catalog; categories append ``:<name>``
+CATALOG_VERSION = 'catalog_version'
+
+# trigger -> (event, rows whose categories it bumps)
+VERSION_TRIGGERS = {
+    'catalog_version_insert': ('INSERT', ('NEW',)),
+    'catalog_version_update': ('UPDATE', ('OLD', 'NEW')),
+    'catalog_version_delete': ('DELETE', ('OLD',)),
+}
+
+
+def _bump(name):
+    # A new row starts at the current time, so a recreated database does not
+    # reuse the versions (and ETags) of the one it replaced
+    return ('INSERT INTO stat_counters (name, value) '
+            f"VALUES ({name}, CAST(strftime('%s', 'now') AS INTEGER)) "
+            'ON CONFLICT (name) DO UPDATE SET value = value + 1;')
+
+
+def install_triggers(connection):
+    """Create the triggers that move the catalog versions (SQLite only)"""
+    if connection.dialect.name != 'sqlite':
+        return
+    for name, (action, rows) in VERSION_TRIGGERS.items():
+        bumps = [_bump(f"'{CATALOG_VERSION}'")]
+        bumps += [_bump(f"'{CATALOG_VERSION}:' || {row}.category") for row in rows]
+        connection.execute(text(f'CREATE TRIGGER IF NOT EXISTS {name} AFTER {action} ON books '
+                                f'BEGIN {" ".join(bumps)} END'))
+
+
+@event.listens_for(db.metadata, 'after_create')
+def _create_triggers(target, connection, **kw):
+    # Needs both books and stat_counters, so after every table
+    install_triggers(connection)
+
+
+# ---- validators ----
+
+def catalog_version(category=None):
+    """Version of the whole catalog or one category"""
+    name = CATALOG_VERSION if category is None else f'{CATALOG_VERSION}:{category}'
+    version = db.session.scalar(select(StatCounter.value).where(StatCounter.name == name))
+    if version is not None:
+        return Validator(f'{name}:{version:.0f}', None)
+    # Separate queries, so each is answered from one end of an index
+    where = [] if category is None else [Book.category == category]
+    count = db.session.scalar(select(func.count()).select_from(Book).where(*where))
+    stamp = db.session.scalar(select(func.max(Book.updated_at)).where(*where))
+    return Validator(f'{category}:{count}:{stamp}', None)
+
+
+def book_version(book_id, neighbors=False):
+    """Version of one book, and of its "also liked" list with ``neighbors``"""
+    stamp = db.session.scalar(select(Book.updated_at).where(Book.id == book_id))
+    if stamp is None:
+        return None
+    if neighbors:
+        # The list is refreshed without touching the book, so ``updated_at``
+        # alone no longer moves on every change
+        return Validator(f'book:{book_id}:{stamp}:{cache.generation(f"book:{book_id}")}', None)
+    return Validator(f'book:{book_id}:{stamp}', stamp)
+
+
+# ---- decorator ----
+
+def _etag(token, anonymous):
+    parts = [current_app.extensions['release_fingerprint'], token,
+             str(cache.generation(CATALOG_NAMESPACE))]
+    if not anonymous:
+        generation = cache.generation(f'user:{current_user.id}')
+        parts += [current_user.get_id(), str(generation), str(get_cart_summary()['count'])]
+    return hashlib.sha1('|'.join(parts).encode()).hexdigest()[:20]
+
+
+def _not_modified(etag, last_modified):
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    if last_modified is not None and request.if_modified_since is not None:
+        return last_modified.replace(microsecond=0) <= request.if_modified_since
+    return False
+
+
+def conditional(validator):
+    """Answer 304 when the client's copy of a GET page is still current"""
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if request.method != 'GET' or session.get('_flashes'):
+                return f(*args, **kwargs)
+            found = validator(**kwargs)
+            if found is None:
+                return f(*args, **kwargs)
+
+            anonymous = not current_user.is_authenticated
+            etag = _etag(found.token, anonymous)
+            # Logged-in pages also change with the user's cart
+            last_modified = None
+            if anonymous and found.last_modified is not None:
+                last_modified = found.last_modified.replace(tzinfo=timezone.utc)
+
+            if _not_modified(etag, last_modified):
+                response = Response(status=304)
+            else:
+                # Part of the page cache key, so a cached body always matches its ETag
+                g.etag = etag
+                response = current_app.make_response(f(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+                # A response that sets the session cookie must not be shared
+                anonymous = anonymous and not session.modified
+
+            response.set_etag(etag, weak=True)
+            if last_modified is not None:
+                response.last_modified = last_modified
+            if anonymous:
+                response.headers['Cache-Control'] = \
+                    f'public, max-age=0, s-maxage={current_app.config["HTTP_CACHE_SHARED_MAX_AGE"]}'
+            else:
+                response.headers['Cache-Control'] = 'private, no-cache'
+            response.vary.add('Cookie')
+            return response
+        return decorated_function
+    return decorator
@@ -0,0 +1,119 @@
+"""Cached identity for logged-in users
+
+Flask-Login calls the user loader on every authenticated request. Rather
+than querying ``users`` each time, the loader keeps a small detached
+``CachedUser`` (id, username, email, admin flag) in a per-process LRU with
+a TTL (``IDENTITY_CACHE_SIZE`` / ``IDENTITY_CACHE_TIMEOUT``).
+
+Staleness is bounded two ways:
+
+- The id Flask-Login stores in the session and remember cookie is
+  stamped with ``users.auth_version`` (``"<id>:<version>"``). Changing the
+  password or the admin flag bumps the version, so every existing session
+  for that user stops matching and is logged out.
+- Any committed update or delete of a user bumps that user's page cache
+  generation, which is part of the identity cache key. Generations live in
+  the SQLite file every worker on the host shares (see app/cache.py),
+  whatever CACHE_TYPE is, so every worker drops its copy on its next
+  request, and a demoted admin is refused at once.
+"""
+from flask import current_app, has_app_context
+from flask_login import UserMixin
+from sqlalchemy import event, inspect, select
+from sqlalchemy.orm import Session, object_session
+
+from app import cache, db
+from app.models import User
+
+_PENDING_KEY = 'identity_invalidations'
+
+
+class CachedUser(UserMixin):
+    """Detached, read-only stand-in for User as current_user"""
+
+    def __init__(self, id, username, email, is_admin, created_at, auth_version):
+        self.id = id
+        self.username = username
+        self.email = email
+        self.is_admin = is_admin
+        self.created_at = created_at
+        self.auth_version = auth_version
+
+    def get_id(self):
+        return f'{self.id}:{self.auth_version}'
+
+    def __repr__(self):
+        return f'<CachedUser {self.username}>'
+
+
+def init_app(app):
+    """Create the app's identity cache"""
+    size = app.config['IDENTITY_CACHE_SIZE']
+    store = cache.MemoryCache(size, app.config['IDENTITY_CACHE_TIMEOUT']) if size else cache.NullCache()
+    app.extensions['identity_cache'] = store
+
+
+def _key(user_id):
+    generation = cache.generation(f'user:{user_id}')
+    return f'user:{user_id}:{generation}'
+
+
+def parse_session_id(session_id):
+    """Split a stored ``"<id>:<version>"``; ids from before stamping are version 0"""
+    user_id, _, version = session_id.partition(':')
+    return int(user_id), int(version or 0)
+
+
+def load_user(session_id):
+    """Return a CachedUser for a session id, or None if it no longer matches"""
+    try:
+        user_id, version = parse_session_id(session_id)
+    except ValueError:
+        return None
+    store = current_app.extensions['identity_cache']
+    key = _key(user_id)
+    user = store.get(key)
+    if user is None:
+        row = db.session.execute(
+            select(User.id, User.username, User.email, User.is_admin, User.created_at, User.auth_version)
+            .where(User.id == user_id)
+        ).first()
+        if row is None:
+            return None
+        user = CachedUser(**row._mapping)
+        store.set(key, user)
+    return user if user.auth_version == version else None
+
+
+def invalidate_user(user_id):
+    """Drop every worker's cached identity for a user"""
+    current_app.extensions['identity_cache'].delete(_key(user_id))
+    cache.invalidate(f'user:{user_id}')
+
+
+@event.listens_for(User, 'before_update')
+def _stamp_privilege_change(mapper, connection, target):
+    # Demotions must take effect now, not when the session expires
+    if inspect(target).attrs.is_admin.history.has_changes():
+        target.auth_version = (target.auth_version or 0) + 1
+
+
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def _queue_invalidation(mapper, connection, target):
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault(_PENDING_KEY, set()).add(target.id)
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_committed(session):
+    user_ids = session.info.pop(_PENDING_KEY, None)
+    if user_ids and has_app_context():
+        for user_id in user_ids:
+            invalidate_user(user_id)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_pending(session):
+    session.info.pop(_PENDING_KEY, None)
@@ -0,0 +1,206 @@
+"""Local cover images with pre-sized variants
+
+Covers are ingested from an admin upload or downloaded from a book's
+remote ``image_url``, and the original is kept in ``COVER_STORAGE_DIR``.
+A background worker then renders every size the templates use, at 1x and
+2x, as WebP and JPEG. Files are named after a hash of the original plus
+their pixel size (``<digest>-400x600.webp``), so a name never changes
+meaning and can be served with an immutable cache header. A size shared
+by two variants (grid at 2x is detail at 1x) is written only once.
+
+Rendering and downloads run as background jobs (app/jobs.py) keyed by
+book, so a newer cover replaces one still waiting for a worker.
+
+``Book.cover_hash`` is set once the variants exist. Until then, and for
+books without a local cover, templates fall back to ``image_url`` or a
+local placeholder.
+"""
+import hashlib
+import io
+import os
+import urllib.parse
+import urllib.request
+
+from flask import current_app, url_for
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from app import cache, db, jobs
+from app.models import Book
+
+# Display sizes (CSS pixels) used by the templates
+VARIANTS = {
+    'grid': (200, 300),
+    'cart': (60, 90),
+    'detail': (400, 600),
+}
+
+SCALES = (1, 2)
+
+# Output formats: extension -> (Pillow format, save options)
+FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+# Upload formats accepted, with the extension the original is stored under
+ACCEPTED_FORMATS = {'JPEG': 'jpg', 'PNG': 'png', 'WEBP': 'webp', 'GIF': 'gif'}
+
+# URL schemes covers may be downloaded from; urllib would also read file://
+FETCH_SCHEMES = ('http', 'https')
+
+
+class CoverError(ValueError):
+    """Raised for files that cannot be used as a cover"""
+
+
+def init_app(app):
+    """Create the storage directory and template helpers"""
+    os.makedirs(app.config['COVER_STORAGE_DIR'], exist_ok=True)
+    app.add_template_global(cover_size)
+    app.add_template_global(cover_url)
+    app.add_template_global(cover_srcset)
+
+
+# ---- template helpers ----
+
+def cover_size(variant):
+    return VARIANTS[variant]
+
+
+def variant_filename(digest, width, height, fmt):
+    return f'{digest}-{width}x{height}.{fmt}'
+
+
+def cover_url(digest, variant, scale=1, fmt='jpg'):
+    width, height = VARIANTS[variant]
+    return url_for('cover_file', filename=variant_filename(digest, width * scale, height * scale, fmt))
+
+
+def cover_srcset(digest, variant, fmt):
+    return ', '.join(f'{cover_url(digest, variant, scale, fmt)} {scale}x' for scale in SCALES)
+
+
+# ---- storage and rendering ----
+
+def _storage_path(name):
+    return os.path.join(current_app.config['COVER_STORAGE_DIR'], name)
+
+
+def _write_atomic(path, write):
+    tmp = f'{path}.tmp-{os.getpid()}'
+    write(tmp)
+    os.replace(tmp, path)
+
+
+def store_original(data):
+    """Validate image bytes and keep them; return ``(digest, path)``"""
+    if len(data) > current_app.config['COVER_MAX_BYTES']:
+        raise CoverError('Cover image is too large.')
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            img.verify()
+            ext = ACCEPTED_FORMATS.get(img.format)
+    except (UnidentifiedImageError, OSError, SyntaxError):
+        raise CoverError('File is not a readable image.') from None
+    if ext is None:
+        raise CoverError('Cover must be a JPEG, PNG, WebP or GIF image.')
+
+    digest = hashlib.sha256(data).hexdigest()[:20]
+    path = _storage_path(f'{digest}.orig.{ext}')
+    if not os.path.exists(path):
+        def write(tmp):
+            with open(tmp, 'wb') as f:
+                f.write(data)
+        _write_atomic(path, write)
+    return digest, path
+
+
+def _pixel_sizes():
+    return sorted({(w * scale, h * scale) for w, h in VARIANTS.values() for scale in SCALES})
+
+
+def render_variants(digest, source_path):
+    """Write every size and format for an original; existing files are kept"""
+    with Image.open(source_path) as img:
+        img = ImageOps.exif_transpose(img).convert('RGB')
+        for width, height in _pixel_sizes():
+            fitted = None
+            for fmt, (pil_format, options) in FORMATS.items():
+                path = _storage_path(variant_filename(digest, width, height, fmt))
+                if os.path.exists(path):
+                    continue
+                if fitted is None:
+                    fitted = ImageOps.fit(img, (width, height), Image.Resampling.LANCZOS)
+                _write_atomic(path, lambda tmp: fitted.save(tmp, pil_format, **options))
+
+
+def check_url(url):
+    """Raise CoverError unless ``url`` is an http or https URL"""
+    if urllib.parse.urlsplit(url).scheme.lower() not in FETCH_SCHEMES:
+        raise CoverError('Cover URLs must start with http:// or https://.')
+
+
+class _RedirectHandler(urllib.request.HTTPRedirectHandler):
+    # A remote server must not send the download on to ftp:// either
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        check_url(newurl)
+        return super().redirect_request(req, fp, code, msg, headers, newurl)
+
+
+_opener = urllib.request.build_opener(_RedirectHandler)
+
+
+def fetch(url):
+    """Download a remote http(s) cover, refusing anything over COVER_MAX_BYTES"""
+    check_url(url)
+    limit = current_app.config['COVER_MAX_BYTES']
+    request = urllib.request.Request(url, headers={'User-Agent': 'HeavenBookstore cover fetcher'})
+    with _opener.open(request, timeout=current_app.config['COVER_FETCH_TIMEOUT']) as response:
+        data = response.read(limit + 1)
+    if len(data) > limit:
+        raise CoverError('Cover image is too large.')
+    return data
+
+
+def _publish(book_id, digest):
+    db.session.execute(Book.__table__.update().where(Book.id == book_id).values(cover_hash=digest))
+    db.session.commit()
+    cache.invalidate_all()
+
+
+# ---- ingestion ----
+
+@jobs.task('covers.render')
+def _process_original(book_id, digest, path):
+    render_variants(digest, path)
+    _publish(book_id, digest)
+
+
+@jobs.task('covers.fetch')
+def _process_url(book_id, url):
+    digest, path = store_original(fetch(url))
+    _process_original(book_id, digest, path)
+
+
+def _job_key(book_id):
+    # Shared by both tasks: the latest upload or URL for a book wins
+    return f'cover:{book_id}'
+
+
+def ingest_upload(book_id, data):
+    """Store an uploaded cover now and queue rendering its variants
+
+    Raises CoverError straight away for unusable files. The job is queued
+    in the current transaction.
+    """
+    digest, path = store_original(data)
+    jobs.enqueue('covers.render', key=_job_key(book_id), book_id=book_id, digest=digest, path=path)
+
+
+def ingest_url(book_id, url):
+    """Queue downloading and processing a remote cover in the current transaction
+
+    Raises CoverError straight away for URLs that are not http or https.
+    """
+    check_url(url)
+    jobs.enqueue('covers.fetch', key=_job_key(book_id), book_id=book_id, url=url)
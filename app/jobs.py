@@ -0,0 +1,296 @@
+"""Durable background jobs in the application database
+
+Work that can follow a write, like rendering cover sizes or refreshing
+recommendations, is queued with ``enqueue()`` in the same transaction as
+the write. The job exists exactly when the write committed, and the
+request returns without waiting for it. No broker is involved; the queue
+is the ``jobs`` table.
+
+A job has a name registered with ``@task`` and JSON keyword arguments.
+Pending jobs are unique by key, which defaults to the name plus the
+arguments, so identical jobs are queued once. Callers pass their own key
+to coalesce: every cover job for a book shares one, and a newer upload
+replaces the pending job's arguments instead of queueing another. A
+``delay`` holds a job back, gathering the enqueues made meanwhile.
+
+Workers claim the oldest due job with one ``UPDATE ... RETURNING``, so
+two workers never get the same job. A successful job is deleted. A
+failing one is retried with exponential backoff and marked ``failed``
+after its last attempt. A job left running longer than
+JOBS_LEASE_SECONDS (its worker died) is handed out again.
+
+``flask --app run run-jobs`` runs a pool of worker threads. Each web
+process also runs JOBS_IN_PROCESS_WORKERS threads of its own, started on
+its first enqueue. Set that to 0 when dedicated workers run.
+"""
+import json
+import threading
+import time
+import traceback
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import delete, event, exists, func, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+
+from app import db
+from app.database import RoutingSession
+from app.models import Job
+
+# Longest wait between retries of a failing job
+MAX_RETRY_DELAY = timedelta(hours=1)
+
+# Characters of a failure's traceback kept on the job
+ERROR_LIMIT = 4000
+
+# Task name -> function
+TASKS = {}
+
+
+def task(name):
+    """Register a function as the task run for jobs called ``name``"""
+    def decorator(f):
+        TASKS[name] = f
+        return f
+    return decorator
+
+
+# ---- queueing ----
+
+def _insert_statement():
+    dialect = db.engine.dialect.name
+    if dialect == 'sqlite':
+        insert = sqlite.insert
+    elif dialect == 'postgresql':
+        insert = postgresql.insert
+    else:
+        raise RuntimeError(f'Job queueing is not supported on {dialect}')
+    jobs = Job.__table__
+    stmt = insert(jobs)
+    return stmt.on_conflict_do_update(
+        index_elements=[jobs.c.dedup_key],
+        index_where=jobs.c.status == 'pending',
+        set_={'name': stmt.excluded.name, 'args': stmt.excluded.args,
+              'coalesced': jobs.c.coalesced + 1}
+    )
+
+
+def enqueue(name, key=None, delay=0, **kwargs):
+    """Queue ``name(**kwargs)`` in the current transaction
+
+    The job is committed with the caller's next commit. A pending job with
+    the same ``key`` (default: name and arguments) takes the new arguments
+    and keeps its place in the queue.
+    """
+    if name not in TASKS:
+        raise KeyError(f'Unknown task: {name}')
+    args = json.dumps(kwargs, sort_keys=True, separators=(',', ':'))
+    db.session.execute(_insert_statement(), {
+        'name': name,
+        'dedup_key': key or f'{name}:{args}',
+        'args': args,
+        'status': 'pending',
+        'attempts': 0,
+        'max_attempts': current_app.config['JOBS_MAX_ATTEMPTS'],
+        'coalesced': 0,
+        'run_after': datetime.utcnow() + timedelta(seconds=delay),
+        'created_at': datetime.utcnow(),
+    })
+    db.session.info['jobs_enqueued'] = True
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _wake_after_commit(session):
+    if session.info.pop('jobs_enqueued', False):
+        pool = current_app.extensions['jobs']
+        if pool is not None:
+            pool.wake()
+
+
+@event.listens_for(RoutingSession, 'after_rollback')
+def _forget_after_rollback(session):
+    session.info.pop('jobs_enqueued', None)
+
+
+# ---- running ----
+
+def _claim():
+    """Mark the oldest due job running and return it, or None"""
+    jobs = Job.__table__
+    now = datetime.utcnow()
+    # An alias, so the subquery is not correlated with the UPDATE's table
+    candidate = jobs.alias('candidate')
+    due = (select(candidate.c.id)
+           .where(candidate.c.status == 'pending', candidate.c.run_after <= now)
+           .order_by(candidate.c.run_after, candidate.c.id)
+           .limit(1)
+           .scalar_subquery())
+    row = db.session.execute(
+        update(jobs).where(jobs.c.id == due)
+        .values(status='running', locked_at=now, attempts=jobs.c.attempts + 1)
+        .returning(jobs.c.id, jobs.c.name, jobs.c.args, jobs.c.attempts, jobs.c.max_attempts)
+    ).first()
+    db.session.commit()
+    return row
+
+
+def _no_pending_twin(jobs):
+    # A job returning to pending must not collide with a newer one for its key
+    twin = jobs.alias('twin')
+    return ~exists().where(twin.c.dedup_key == jobs.c.dedup_key, twin.c.status == 'pending')
+
+
+def _retry_or_fail(job, error):
+    jobs = Job.__table__
+    if job.attempts >= job.max_attempts:
+        db.session.execute(update(jobs).where(jobs.c.id == job.id)
+                           .values(status='failed', locked_at=None, last_error=error))
+    else:
+        delay = timedelta(seconds=current_app.config['JOBS_RETRY_SECONDS'] * 2 ** (job.attempts - 1))
+        retried = db.session.execute(
+            update(jobs).where(jobs.c.id == job.id, _no_pending_twin(jobs))
+            .values(status='pending', locked_at=None, last_error=error,
+                    run_after=datetime.utcnow() + min(delay, MAX_RETRY_DELAY))
+        ).rowcount
+        if not retried:
+            # A newer job for the same key will do the work
+            db.session.execute(delete(jobs).where(jobs.c.id == job.id))
+    db.session.commit()
+
+
+def run_one():
+    """Run the oldest due job; returns None if there was none, else whether it succeeded"""
+    job = _claim()
+    if job is None:
+        return None
+    try:
+        fn = TASKS.get(job.name)
+        if fn is None:
+            raise LookupError(f'Unknown task: {job.name}')
+        fn(**json.loads(job.args))
+    except Exception:
+        db.session.rollback()
+        current_app.logger.exception('Job %s (%s) failed on attempt %d', job.id, job.name, job.attempts)
+        _retry_or_fail(job, traceback.format_exc()[-ERROR_LIMIT:])
+        return False
+    db.session.execute(delete(Job.__table__).where(Job.id == job.id))
+    db.session.commit()
+    return True
+
+
+def run_pending():
+    """Run due jobs in this thread until none are left; returns ``(succeeded, failed)``"""
+    succeeded = failed = 0
+    while (result := run_one()) is not None:
+        if result:
+            succeeded += 1
+        else:
+            failed += 1
+    return succeeded, failed
+
+
+def recover_stale():
+    """Hand out again jobs whose worker stopped before finishing them; returns how many"""
+    jobs = Job.__table__
+    stale = (jobs.c.status == 'running') & (jobs.c.locked_at < datetime.utcnow() - timedelta(
+        seconds=current_app.config['JOBS_LEASE_SECONDS']))
+    # A job that keeps killing its worker runs out of attempts here
+    db.session.execute(update(jobs).where(stale, jobs.c.attempts >= jobs.c.max_attempts)
+                       .values(status='failed', locked_at=None, last_error='Worker lease expired'))
+    recovered = db.session.execute(update(jobs).where(stale, _no_pending_twin(jobs))
+                                   .values(status='pending', locked_at=None)).rowcount
+    db.session.execute(delete(jobs).where(stale))
+    db.session.commit()
+    if recovered:
+        current_app.logger.warning('Recovered %d job(s) from expired worker leases', recovered)
+    return recovered
+
+
+def retry_failed():
+    """Queue failed jobs again with fresh attempts; returns how many"""
+    jobs = Job.__table__
+    count = db.session.execute(
+        update(jobs).where(jobs.c.status == 'failed', _no_pending_twin(jobs))
+        .values(status='pending', attempts=0, run_after=datetime.utcnow())
+    ).rowcount
+    db.session.execute(delete(jobs).where(jobs.c.status == 'failed'))
+    db.session.commit()
+    return count
+
+
+def queue_stats():
+    """``(name, status, count, earliest run_after)`` for every kind of job in the table"""
+    return db.session.execute(
+        select(Job.name, Job.status, func.count(), func.min(Job.run_after))
+        .group_by(Job.name, Job.status)
+        .order_by(Job.name, Job.status)
+    ).all()
+
+
+# ---- worker pool ----
+
+class WorkerPool:
+    """Threads that run jobs until stopped, waiting between polls when idle"""
+
+    def __init__(self, app, threads):
+        self.app = app
+        self.threads = threads
+        self._wakeup = threading.Condition()
+        self._stopping = threading.Event()
+        self._started = False
+        self._workers = []
+        self._next_recovery = 0.0
+
+    def start(self):
+        with self._wakeup:
+            if self._started:
+                return
+            self._started = True
+        for n in range(self.threads):
+            worker = threading.Thread(target=self._loop, name=f'jobs-{n}', daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    def wake(self):
+        """Start the threads if needed and have an idle one look for jobs now"""
+        self.start()
+        with self._wakeup:
+            self._wakeup.notify()
+
+    def stop(self, timeout=None):
+        """Let each thread finish its current job, then exit"""
+        self._stopping.set()
+        with self._wakeup:
+            self._wakeup.notify_all()
+        for worker in self._workers:
+            worker.join(timeout)
+
+    def _recover_if_due(self):
+        with self._wakeup:
+            if time.monotonic() < self._next_recovery:
+                return
+            self._next_recovery = time.monotonic() + self.app.config['JOBS_LEASE_SECONDS'] / 2
+        recover_stale()
+
+    def _loop(self):
+        poll = self.app.config['JOBS_POLL_SECONDS']
+        while not self._stopping.is_set():
+            ran = None
+            with self.app.app_context():
+                try:
+                    self._recover_if_due()
+                    ran = run_one()
+                except Exception:
+                    # The database was unreachable or locked; try again after a poll
+                    self.app.logger.exception('Job worker error')
+                    db.session.rollback()
+                finally:
+                    db.session.remove()
+            if ran is None and not self._stopping.is_set():
+                with self._wakeup:
+                    self._wakeup.wait(poll)
+
+
+def init_app(app):
+    threads = app.config['JOBS_IN_PROCESS_WORKERS']
+    app.extensions['jobs'] = WorkerPool(app, threads) if threads else None
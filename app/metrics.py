@@ -0,0 +1,207 @@
+"""Per-request timing instrumentation
+
+Hooks SQLAlchemy cursor events and Flask's request and template signals to
+measure, for every request, the SQL statement count, time spent in the
+database, time spent rendering templates and total latency. Each response
+carries a ``Server-Timing`` header and the numbers are folded into
+per-endpoint histograms, exposed on the admin metrics page and as
+Prometheus text.
+"""
+import threading
+import time
+from bisect import bisect_left
+
+from flask import g, has_app_context, request, template_rendered, before_render_template
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Histogram bucket upper bounds in milliseconds (Prometheus style, the last
+# bucket is +Inf)
+BUCKETS_MS = (1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+class Histogram:
+    """Fixed-bucket histogram with interpolated quantiles"""
+
+    def __init__(self, buckets=BUCKETS_MS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        """Estimate the q-quantile by linear interpolation inside its bucket"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, bucket_count in enumerate(self.counts):
+            if seen + bucket_count >= rank and bucket_count:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                if i == len(self.buckets):
+                    return lower
+                upper = self.buckets[i]
+                return lower + (upper - lower) * (rank - seen) / bucket_count
+            seen += bucket_count
+        return self.buckets[-1]
+
+    @property
+    def mean(self):
+        return self.sum / self.count if self.count else 0.0
+
+
+class EndpointStats:
+    """Aggregated timings for one endpoint"""
+
+    def __init__(self):
+        self.latency = Histogram()
+        self.db = Histogram()
+        self.render = Histogram()
+        self.queries = 0
+
+
+class MetricsRegistry:
+    """Thread-safe collection of EndpointStats keyed by endpoint name"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._endpoints = {}
+
+    def record(self, endpoint, latency_ms, db_ms, render_ms, queries):
+        with self._lock:
+            stats = self._endpoints.get(endpoint)
+            if stats is None:
+                stats = self._endpoints[endpoint] = EndpointStats()
+            stats.latency.observe(latency_ms)
+            stats.db.observe(db_ms)
+            stats.render.observe(render_ms)
+            stats.queries += queries
+
+    def snapshot(self):
+        """Return a list of per-endpoint summaries sorted by total time spent"""
+        with self._lock:
+            rows = [{
+                'endpoint': endpoint,
+                'requests': stats.latency.count,
+                'p50': stats.latency.quantile(0.50),
+                'p95': stats.latency.quantile(0.95),
+                'p99': stats.latency.quantile(0.99),
+                'mean': stats.latency.mean,
+                'db_mean': stats.db.mean,
+                'render_mean': stats.render.mean,
+                'queries_per_request': stats.queries / stats.latency.count,
+                'total_ms': stats.latency.sum,
+            } for endpoint, stats in self._endpoints.items()]
+        return sorted(rows, key=lambda row: row['total_ms'], reverse=True)
+
+    def prometheus(self):
+        """Render all histograms in the Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            items = sorted(self._endpoints.items())
+            for name, attr, help_text in (
+                ('bookstore_request_duration_seconds', 'latency', 'Request latency'),
+                ('bookstore_db_duration_seconds', 'db', 'Time spent in SQL per request'),
+                ('bookstore_render_duration_seconds', 'render', 'Template render time per request'),
+            ):
+                lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} histogram')
+                for endpoint, stats in items:
+                    hist = getattr(stats, attr)
+                    cumulative = 0
+                    for bound, bucket_count in zip(hist.buckets, hist.counts):
+                        cumulative += bucket_count
+                        lines.append(f'{name}_bucket{{endpoint="{endpoint}",le="{bound / 1000:g}"}} {cumulative}')
+                    lines.append(f'{name}_bucket{{endpoint="{endpoint}",le="+Inf"}} {hist.count}')
+                    lines.append(f'{name}_sum{{endpoint="{endpoint}"}} {hist.sum / 1000:.6f}')
+                    lines.append(f'{name}_count{{endpoint="{endpoint}"}} {hist.count}')
+            lines.append('# HELP bookstore_sql_statements_total SQL statements issued')
+            lines.append('# TYPE bookstore_sql_statements_total counter')
+            for endpoint, stats in items:
+                lines.append(f'bookstore_sql_statements_total{{endpoint="{endpoint}"}} {stats.queries}')
+        return '\n'.join(lines) + '\n'
+
+    def reset(self):
+        with self._lock:
+            self._endpoints.clear()
+
+
+registry = MetricsRegistry()
+
+
+class RequestTimings:
+    """Timings accumulated while one request is being handled"""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.db_ms = 0.0
+        self.queries = 0
+        self.render_ms = 0.0
+        self.render_started = []
+
+
+def _current_timings():
+    if not has_app_context():
+        return None
+    return g.get('_request_timings')
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info['_query_started'] = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.pop('_query_started', None)
+    timings = _current_timings()
+    if timings is not None and started is not None:
+        timings.db_ms += (time.perf_counter() - started) * 1000
+        timings.queries += 1
+
+
+def _before_render(sender, template, context, **extra):
+    timings = _current_timings()
+    if timings is not None:
+        timings.render_started.append(time.perf_counter())
+
+
+def _after_render(sender, template, context, **extra):
+    timings = _current_timings()
+    if timings is not None and timings.render_started:
+        timings.render_ms += (time.perf_counter() - timings.render_started.pop()) * 1000
+
+
+def _start_request():
+    g._request_timings = RequestTimings()
+
+
+def _finish_request(response):
+    timings = g.pop('_request_timings', None)
+    if timings is None:
+        return response
+    total_ms = (time.perf_counter() - timings.start) * 1000
+    response.headers['Server-Timing'] = (
+        f'db;dur={timings.db_ms:.1f};desc="{timings.queries} queries", '
+        f'render;dur={timings.render_ms:.1f}, '
+        f'app;dur={total_ms:.1f}'
+    )
+    registry.record(request.endpoint or 'unmatched', total_ms,
+                    timings.db_ms, timings.render_ms, timings.queries)
+    return response
+
+
+def init_app(app):
+    """Install the instrumentation hooks when METRICS_ENABLED is set"""
+    if not app.config['METRICS_ENABLED']:
+        return
+    if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+    before_render_template.connect(_before_render, app)
+    template_rendered.connect(_after_render, app)
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
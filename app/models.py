@@ -1,13 +1,21 @@
 from datetime import datetime
-from werkzeug.security import generate_password_hash, check_password_hash
 from flask_login import UserMixin
-from app import db, login_manager
-from sqlalchemy import UniqueConstraint
+from app import db, login_manager, passwords
+from sqlalchemy import Float, Index, UniqueConstraint, case, cast, event, func, inspect, select, text
+
+# Review ratings, one to five stars
+RATING_STARS = range(1, 6)
+
+# Catalog categories, in navigation order
+BOOK_CATEGORIES = ['Photography', 'Investing', 'Literature', 'Languages',
+                   'Biography', 'Reference', 'Wellness', 'Graphic Novels']
+
 
 @login_manager.user_loader
 def load_user(user_id):
-    """Load user by ID for Flask-Login"""
-    return User.query.get(int(user_id))
+    """Load user by ID for Flask-Login (served from the identity cache)"""
+    from app import identity
+    return identity.load_user(user_id)
 
 
 class User(UserMixin, db.Model):
@@ -20,18 +28,34 @@ class User(UserMixin, db.Model):
     password_hash = db.Column(db.String(255), nullable=False)
     is_admin = db.Column(db.Boolean, default=False, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    # Stamped into the session id; bumping it signs the user out everywhere
+    auth_version = db.Column(db.Integer, default=0, server_default='0', nullable=False)
     
     # Relationships
     cart_items = db.relationship('Cart', backref='user', lazy='dynamic', cascade='all, delete-orphan')
     reviews = db.relationship('Review', backref='user', lazy='dynamic', cascade='all, delete-orphan')
+    orders = db.relationship('Order', backref='user', lazy='dynamic', order_by='Order.id.desc()')
     
     def set_password(self, password):
-        """Hash and set password"""
-        self.password_hash = generate_password_hash(password)
+        """Hash and set password, signing out existing sessions (may raise HasherBusy)"""
+        self.password_hash = passwords.hash_password(password)
+        self.auth_version = (self.auth_version or 0) + 1
+    
+    def upgrade_password_hash(self, password):
+        """Re-hash with the configured parameters, keeping sessions (may raise HasherBusy)"""
+        self.password_hash = passwords.hash_password(password)
     
     def check_password(self, password):
-        """Check if provided password matches hash"""
-        return check_password_hash(self.password_hash, password)
+        """Check if provided password matches hash (may raise HasherBusy)"""
+        return passwords.verify_password(self.password_hash, password)
+    
+    def password_needs_rehash(self):
+        """True when the stored hash predates the configured parameters"""
+        return passwords.needs_rehash(self.password_hash)
+    
+    def get_id(self):
+        """Session id for Flask-Login, stamped with auth_version"""
+        return f'{self.id}:{self.auth_version or 0}'
     
     def __repr__(self):
         return f'<User {self.username}>'
@@ -42,34 +66,175 @@ class Book(db.Model):
     __tablename__ = 'books'
     
     id = db.Column(db.Integer, primary_key=True)
+    # External catalog key used by supplier feeds (optional for hand-entered books)
+    isbn = db.Column(db.String(20), unique=True, index=True)
     title = db.Column(db.String(200), nullable=False, index=True)
     author = db.Column(db.String(150), nullable=False, index=True)
     price_npr = db.Column(db.Float, nullable=False)
     category = db.Column(db.String(50), nullable=False, index=True)
     description = db.Column(db.Text)
     image_url = db.Column(db.String(500))
+    # Digest naming the locally rendered cover variants (see app/images.py)
+    cover_hash = db.Column(db.String(64))
     stock_quantity = db.Column(db.Integer, default=0, nullable=False)
     average_rating = db.Column(db.Float, default=0.0)
+    # Review aggregates, maintained in SQL by the Review mapper events below
+    rating_count = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+    rating_sum = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+    # Reviews per star rating, for the book page's histogram
+    rating_1_count = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+    rating_2_count = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+    rating_3_count = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+    rating_4_count = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+    rating_5_count = db.Column(db.Integer, default=0, server_default='0', nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    # Stamped by every UPDATE, including the Core ones for stock and review
+    # aggregates; page ETags are derived from it (see app/http_cache.py)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow,
+                           server_default='1970-01-01 00:00:00.000000', nullable=False, index=True)
     
     # Relationships
     cart_items = db.relationship('Cart', backref='book', lazy='dynamic', cascade='all, delete-orphan')
     reviews = db.relationship('Review', backref='book', lazy='dynamic', cascade='all, delete-orphan')
     
-    def update_average_rating(self):
-        """Calculate and update average rating from all reviews"""
-        reviews = self.reviews.all()
-        if reviews:
-            total = sum(review.rating for review in reviews)
-            self.average_rating = round(total / len(reviews), 1)
-        else:
-            self.average_rating = 0.0
+    # Composite indexes backing the keyset-paginated listings. Each category
+    # sort key is followed by the other facet columns, so price, rating and
+    # stock filters are checked inside the index (see app/facets.py)
+    __table_args__ = (
+        Index('ix_books_category_rating_facets', 'category', 'average_rating', 'id',
+              'price_npr', 'stock_quantity'),
+        Index('ix_books_category_price_facets', 'category', 'price_npr', 'id',
+              'average_rating', 'stock_quantity'),
+        Index('ix_books_category_created_facets', 'category', 'created_at', 'id',
+              'price_npr', 'average_rating', 'stock_quantity'),
+        Index('ix_books_created_at_id', 'created_at', 'id'),
+        # Store-wide sorts for the admin book table and the home page
+        Index('ix_books_rating_id', 'average_rating', 'id'),
+        Index('ix_books_price_id', 'price_npr', 'id'),
+        Index('ix_books_stock_id', 'stock_quantity', 'id'),
+        Index('ix_books_category_updated_at', 'category', 'updated_at'),
+    )
+    
+    @property
+    def rating_histogram(self):
+        """``(stars, reviews)`` from five stars down to one"""
+        return [(stars, getattr(self, f'rating_{stars}_count') or 0) for stars in reversed(RATING_STARS)]
+    
+    @classmethod
+    def rebuild_rating_aggregates(cls):
+        """Recompute the rating count, sum, average and histogram from reviews
+        
+        One set-based UPDATE used to backfill or repair the aggregates.
+        Returns the number of books touched.
+        """
+        books = cls.__table__
+        reviews = Review.__table__
+        for_book = reviews.c.book_id == books.c.id
+        histogram = {
+            f'rating_{stars}_count': select(func.count()).where(for_book, reviews.c.rating == stars)
+                .scalar_subquery()
+            for stars in RATING_STARS
+        }
+        result = db.session.execute(books.update().values(
+            rating_count=select(func.count()).where(for_book).scalar_subquery(),
+            rating_sum=select(func.coalesce(func.sum(reviews.c.rating), 0)).where(for_book).scalar_subquery(),
+            average_rating=select(func.coalesce(func.round(func.avg(reviews.c.rating), 1), 0.0))
+                .where(for_book).scalar_subquery(),
+            **histogram
+        ))
         db.session.commit()
+        return result.rowcount
     
     def __repr__(self):
         return f'<Book {self.title}>'
 
 
+class FacetCount(db.Model):
+    """Number of books in one (category, price band, rating band, in stock) cell
+    
+    Kept up to date by SQLite triggers on books (see app/facets.py), so
+    facet counts never need a GROUP BY over the catalog.
+    """
+    __tablename__ = 'facet_counts'
+    
+    category = db.Column(db.String(50), primary_key=True)
+    price_band = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    rating_band = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    in_stock = db.Column(db.Boolean, primary_key=True)
+    book_count = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+    
+    def __repr__(self):
+        return f'<FacetCount {self.category} {self.price_band}/{self.rating_band}/{self.in_stock}: {self.book_count}>'
+
+
+class StatCounter(db.Model):
+    """One store-wide figure for the admin dashboard (books, stock value, ...)
+    
+    Kept up to date by SQLite triggers (see app/stats.py), so the dashboard
+    reads a few rows instead of aggregating whole tables.
+    """
+    __tablename__ = 'stat_counters'
+    
+    name = db.Column(db.String(40), primary_key=True)
+    value = db.Column(db.Float, default=0, server_default='0', nullable=False)
+    
+    def __repr__(self):
+        return f'<StatCounter {self.name}: {self.value}>'
+
+
+class DailyStat(db.Model):
+    """Rows created on one day (new users, reviews), for the dashboard charts"""
+    __tablename__ = 'daily_stats'
+    
+    metric = db.Column(db.String(40), primary_key=True)
+    day = db.Column(db.String(10), primary_key=True)  # YYYY-MM-DD (UTC)
+    value = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+    
+    # A metric's days are one primary-key range
+    __table_args__ = {'sqlite_with_rowid': False}
+    
+    def __repr__(self):
+        return f'<DailyStat {self.metric} {self.day}: {self.value}>'
+
+
+class BookNeighbor(db.Model):
+    """One "readers also liked" entry; rank 0 is the most similar book
+    
+    Written by the recommendation job (see app/recommendations.py) and read
+    with one primary-key range lookup per book page.
+    """
+    __tablename__ = 'book_neighbors'
+    
+    book_id = db.Column(db.Integer, db.ForeignKey('books.id'), primary_key=True, autoincrement=False)
+    rank = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    neighbor_id = db.Column(db.Integer, db.ForeignKey('books.id'), nullable=False)
+    score = db.Column(db.Float, nullable=False)
+    
+    # Rows are stored in the primary key itself, so a book's list is one range
+    __table_args__ = {'sqlite_with_rowid': False}
+    
+    def __repr__(self):
+        return f'<BookNeighbor {self.book_id}#{self.rank} -> {self.neighbor_id} ({self.score:.3f})>'
+
+
+class RecommendationRun(db.Model):
+    """One refresh of the neighbour lists and the activity it had seen"""
+    __tablename__ = 'recommendation_runs'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    full = db.Column(db.Boolean, nullable=False)
+    started_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    finished_at = db.Column(db.DateTime)
+    books_refreshed = db.Column(db.Integer, default=0, nullable=False)
+    # Highest ids included; the next incremental run starts after them
+    last_review_id = db.Column(db.Integer, default=0, nullable=False)
+    last_cart_id = db.Column(db.Integer, default=0, nullable=False)
+    last_order_item_id = db.Column(db.Integer, default=0, nullable=False)
+    
+    def __repr__(self):
+        return f'<RecommendationRun {self.id} full={self.full} books={self.books_refreshed}>'
+
+
 class Cart(db.Model):
     """Shopping cart model"""
     __tablename__ = 'cart'
@@ -80,6 +245,10 @@ class Cart(db.Model):
     quantity = db.Column(db.Integer, default=1, nullable=False)
     added_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     
+    # A unique index rather than a constraint so upgrade-db can add it to
+    # existing SQLite databases; it is also the add-to-cart upsert target
+    __table_args__ = (Index('unique_user_book_cart', 'user_id', 'book_id', unique=True),)
+    
     def __repr__(self):
         return f'<Cart User:{self.user_id} Book:{self.book_id}>'
 
@@ -90,13 +259,133 @@ class Review(db.Model):
     
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
-    book_id = db.Column(db.Integer, db.ForeignKey('books.id'), nullable=False, index=True)
+    book_id = db.Column(db.Integer, db.ForeignKey('books.id'), nullable=False)
     rating = db.Column(db.Integer, nullable=False)  # 1-5 stars
     review_text = db.Column(db.Text)
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     
-    # Unique constraint: one review per user per book
-    __table_args__ = (UniqueConstraint('user_id', 'book_id', name='unique_user_book_review'),)
+    # Unique constraint: one review per user per book. The composite indexes
+    # back the book page's keyset-paginated review sorts
+    __table_args__ = (
+        UniqueConstraint('user_id', 'book_id', name='unique_user_book_review'),
+        Index('ix_reviews_book_created_id', 'book_id', 'created_at', 'id'),
+        Index('ix_reviews_book_rating_created_id', 'book_id', 'rating', 'created_at', 'id'),
+    )
     
     def __repr__(self):
         return f'<Review User:{self.user_id} Book:{self.book_id} Rating:{self.rating}>'
+
+
+class Order(db.Model):
+    """Placed order, created from a cart at checkout"""
+    __tablename__ = 'orders'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
+    status = db.Column(db.String(20), default='placed', nullable=False)
+    total_npr = db.Column(db.Float, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    
+    # Relationships
+    items = db.relationship('OrderItem', backref='order', lazy='selectin', cascade='all, delete-orphan',
+                            order_by='OrderItem.id')
+    
+    def __repr__(self):
+        return f'<Order {self.id} User:{self.user_id}>'
+
+
+class OrderItem(db.Model):
+    """Line of an order; title and price are copied so history survives catalog edits"""
+    __tablename__ = 'order_items'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    order_id = db.Column(db.Integer, db.ForeignKey('orders.id'), nullable=False, index=True)
+    book_id = db.Column(db.Integer, db.ForeignKey('books.id', ondelete='SET NULL'), index=True)
+    title = db.Column(db.String(200), nullable=False)
+    unit_price_npr = db.Column(db.Float, nullable=False)
+    quantity = db.Column(db.Integer, nullable=False)
+    
+    @property
+    def subtotal(self):
+        return self.unit_price_npr * self.quantity
+    
+    def __repr__(self):
+        return f'<OrderItem Order:{self.order_id} Book:{self.book_id} x{self.quantity}>'
+
+
+class Job(db.Model):
+    """Background job waiting for, or being run by, a worker (see app/jobs.py)"""
+    __tablename__ = 'jobs'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(80), nullable=False)
+    # Pending jobs with the same key are one job; the latest arguments win
+    dedup_key = db.Column(db.String(255), nullable=False)
+    args = db.Column(db.Text, nullable=False, default='{}')  # JSON keyword arguments
+    status = db.Column(db.String(10), nullable=False, default='pending')  # pending, running or failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False)
+    # Enqueues folded into this job while it was pending
+    coalesced = db.Column(db.Integer, nullable=False, default=0)
+    run_after = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    locked_at = db.Column(db.DateTime)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    
+    __table_args__ = (
+        Index('ux_jobs_pending_key', 'dedup_key', unique=True,
+              sqlite_where=text("status = 'pending'"), postgresql_where=text("status = 'pending'")),
+        Index('ix_jobs_status_run_after', 'status', 'run_after', 'id'),
+    )
+    
+    def __repr__(self):
+        return f'<Job {self.id} {self.name} {self.status}>'
+
+
+def _apply_rating_change(connection, book_id, added=None, removed=None):
+    """Add and/or remove one rating from a book's aggregates in a single UPDATE
+    
+    The new average is derived from the updated columns inside the same
+    statement, so concurrent reviews cannot lose each other's changes.
+    """
+    books = Book.__table__
+    new_count = books.c.rating_count + (added is not None) - (removed is not None)
+    new_sum = books.c.rating_sum + (added or 0) - (removed or 0)
+    values = {
+        'rating_count': new_count,
+        'rating_sum': new_sum,
+        'average_rating': case(
+            (new_count > 0, func.round(cast(new_sum, Float) / new_count, 1)),
+            else_=0.0
+        ),
+    }
+    if added is not None:
+        values[f'rating_{added}_count'] = books.c[f'rating_{added}_count'] + 1
+    if removed is not None:
+        column = books.c[f'rating_{removed}_count']
+        values[column.name] = values.get(column.name, column) - 1
+    connection.execute(books.update().where(books.c.id == book_id).values(**values))
+
+
+@event.listens_for(Review, 'after_insert')
+def _review_inserted(mapper, connection, target):
+    _apply_rating_change(connection, target.book_id, added=target.rating)
+
+
+@event.listens_for(Review, 'after_update')
+def _review_updated(mapper, connection, target):
+    history = inspect(target).attrs.rating.history
+    if history.deleted:
+        _apply_rating_change(connection, target.book_id, added=target.rating, removed=history.deleted[0])
+    else:
+        # Only the text changed; the book page still has to be re-validated
+        books = Book.__table__
+        connection.execute(books.update().where(books.c.id == target.book_id)
+                           .values(updated_at=datetime.utcnow()))
+
+
+@event.listens_for(Review, 'after_delete')
+def _review_deleted(mapper, connection, target):
+    history = inspect(target).attrs.rating.history
+    old_rating = history.deleted[0] if history.deleted else target.rating
+    _apply_rating_change(connection, target.book_id, removed=old_rating)
@@ -0,0 +1,126 @@
+"""Keyset (seek) pagination helpers
+
+Pages are addressed by an opaque cursor holding the sort key of the row at
+the page boundary, so fetching page N is one indexed range scan of
+``per_page + 1`` rows no matter how deep N is.
+"""
+import base64
+import binascii
+import json
+from datetime import datetime
+
+from sqlalchemy import and_, or_
+
+
+class KeysetPage:
+    """One page of results plus the cursors needed to move around"""
+
+    def __init__(self, items, next_cursor=None, prev_cursor=None):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+
+def encode_cursor(values, direction):
+    """Pack boundary key values into a URL-safe token"""
+    payload = [direction] + [v.isoformat() if isinstance(v, datetime) else v for v in values]
+    raw = json.dumps(payload, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(token, order_by):
+    """Unpack a cursor token, returning (direction, values) or None if invalid"""
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        direction, *values = json.loads(raw)
+    except (ValueError, TypeError, binascii.Error):
+        return None
+    if direction not in ('next', 'prev') or len(values) != len(order_by):
+        return None
+    decoded = []
+    for value, (expr, _) in zip(values, order_by):
+        python_type = _python_type(expr)
+        try:
+            if python_type is datetime and value is not None:
+                value = datetime.fromisoformat(value)
+            elif python_type in (int, float) and value is not None:
+                value = python_type(value)
+        except (ValueError, TypeError):
+            return None
+        decoded.append(value)
+    return direction, decoded
+
+
+def _python_type(expr):
+    try:
+        return expr.type.python_type
+    except NotImplementedError:
+        return None
+
+
+def _seek_condition(order_by, values, forward):
+    """Build the row-comparison filter '(k1, k2, ...) after/before values'
+
+    Each key may sort ascending or descending, so the comparison is
+    expanded into the usual OR-of-ANDs form rather than a row-value test.
+    """
+    clauses = []
+    for i, (expr, descending) in enumerate(order_by):
+        less = descending == forward
+        cmp = expr < values[i] if less else expr > values[i]
+        equal_prefix = [order_by[j][0] == values[j] for j in range(i)]
+        clauses.append(and_(*equal_prefix, cmp))
+    return or_(*clauses)
+
+
+def paginate_keyset(query, order_by, cursor=None, per_page=20):
+    """Return a KeysetPage for ``query`` ordered by ``order_by``
+
+    ``order_by`` is a list of ``(expression, descending)`` pairs whose last
+    entry must be unique (normally the primary key). The query must not be
+    ordered already. Rows come back exactly as the query yields them.
+    """
+    decoded = decode_cursor(cursor, order_by) if cursor else None
+    direction, values = decoded if decoded else ('next', None)
+    forward = direction == 'next'
+
+    keys = [expr.label(f'_seek_{i}') for i, (expr, _) in enumerate(order_by)]
+    seek_query = query.add_columns(*keys)
+    if values is not None:
+        seek_query = seek_query.filter(_seek_condition(order_by, values, forward))
+
+    ordering = []
+    for expr, descending in order_by:
+        reverse = descending == forward
+        ordering.append(expr.desc() if reverse else expr.asc())
+    rows = seek_query.order_by(*ordering).limit(per_page + 1).all()
+
+    more = len(rows) > per_page
+    rows = rows[:per_page]
+    if not forward:
+        rows.reverse()
+
+    width = len(keys)
+    items = [row[0] if len(row) == width + 1 else tuple(row[:-width]) for row in rows]
+    if not rows:
+        return KeysetPage(items)
+
+    first_keys = tuple(rows[0][-width:])
+    last_keys = tuple(rows[-1][-width:])
+    if forward:
+        has_next, has_prev = more, values is not None
+    else:
+        has_next, has_prev = True, more
+    return KeysetPage(
+        items,
+        next_cursor=encode_cursor(last_keys, 'next') if has_next else None,
+        prev_cursor=encode_cursor(first_keys, 'prev') if has_prev else None,
+    )
@@ -0,0 +1,99 @@
+"""Password hashing on a bounded worker pool
+
+scrypt and PBKDF2 are deliberately slow. Run inline, a burst of logins
+puts one CPU-bound hash on every request thread and starves catalog
+requests. Hashes run instead on a small pool of ``PASSWORD_HASH_WORKERS``
+threads (hashlib releases the GIL while it works). At most
+``PASSWORD_HASH_QUEUE`` more hashes may wait. Beyond that ``HasherBusy``
+is raised straight away, and the login and registration views answer
+503 with Retry-After rather than piling up.
+
+``PASSWORD_HASH_METHOD`` picks the algorithm and cost. A stored hash made
+with other parameters is reported by ``needs_rehash`` and replaced on
+the user's next successful login.
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+from flask import current_app
+from werkzeug.security import (DEFAULT_PBKDF2_ITERATIONS, check_password_hash,
+                               generate_password_hash)
+
+
+class HasherBusy(Exception):
+    """Raised when the hashing pool and its queue are full"""
+
+
+class PasswordHasher:
+    """Bounded thread pool running password hashes"""
+
+    def __init__(self, method, workers=4, queue_size=32, timeout=10):
+        self.method = method
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='password-hash')
+        self._slots = threading.BoundedSemaphore(workers + queue_size)
+
+    def _run(self, fn, *args, **kwargs):
+        if not self._slots.acquire(blocking=False):
+            raise HasherBusy()
+        try:
+            future = self._executor.submit(fn, *args, **kwargs)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeout:
+            raise HasherBusy() from None
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, method=self.method)
+
+    def verify(self, pwhash, password):
+        return self._run(check_password_hash, pwhash, password)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+def canonical_method(method):
+    """Expand a method spec with werkzeug's defaults, e.g. scrypt -> scrypt:32768:8:1"""
+    name, *args = method.split(':')
+    if name == 'scrypt':
+        return 'scrypt:' + ':'.join(args or ['32768', '8', '1'])
+    if name == 'pbkdf2':
+        hash_name = args[0] if args else 'sha256'
+        iterations = args[1] if len(args) > 1 else DEFAULT_PBKDF2_ITERATIONS
+        return f'pbkdf2:{hash_name}:{iterations}'
+    return method
+
+
+def init_app(app):
+    """Create the app's hashing pool"""
+    app.extensions['password_hasher'] = PasswordHasher(
+        app.config['PASSWORD_HASH_METHOD'],
+        workers=app.config['PASSWORD_HASH_WORKERS'],
+        queue_size=app.config['PASSWORD_HASH_QUEUE'],
+        timeout=app.config['PASSWORD_HASH_TIMEOUT'],
+    )
+
+
+def get_hasher():
+    return current_app.extensions['password_hasher']
+
+
+def hash_password(password):
+    """Hash with the configured method; may raise HasherBusy"""
+    return get_hasher().hash(password)
+
+
+def verify_password(pwhash, password):
+    """Check a password against a stored hash; may raise HasherBusy"""
+    return get_hasher().verify(pwhash, password)
+
+
+def needs_rehash(pwhash):
+    """True when a stored hash was made with other parameters than configured"""
+    stored = pwhash.split('$', 1)[0]
+    return stored != canonical_method(get_hasher().method)
@@ -0,0 +1,73 @@
+"""SQL statement budgets for views
+
+``@query_budget(n)`` counts the statements a view issues (including those
+run while rendering its template). Going over budget raises
+``QueryBudgetExceeded`` when testing or when ``QUERY_BUDGET_ENFORCE`` is
+set, and logs a warning otherwise, so N+1 regressions surface early.
+
+Tests can also wrap any block in ``count_queries()`` directly.
+"""
+from contextlib import contextmanager
+from functools import wraps
+
+from flask import current_app, g, has_app_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+class QueryBudgetExceeded(AssertionError):
+    """Raised when a view issues more SQL statements than it declared"""
+
+
+class QueryCounter:
+    """Statements seen while the counter was active"""
+
+    def __init__(self):
+        self.statements = []
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+
+def _count_statement(conn, cursor, statement, parameters, context, executemany):
+    if not has_app_context():
+        return
+    for counter in g.get('_query_counters', ()):
+        counter.statements.append(statement)
+
+
+def init_app(app):
+    """Start counting statements on every engine"""
+    if not event.contains(Engine, 'before_cursor_execute', _count_statement):
+        event.listen(Engine, 'before_cursor_execute', _count_statement)
+
+
+@contextmanager
+def count_queries():
+    """Count the statements executed inside the block (needs an app context)"""
+    counter = QueryCounter()
+    counters = g.setdefault('_query_counters', [])
+    counters.append(counter)
+    try:
+        yield counter
+    finally:
+        counters.remove(counter)
+
+
+def query_budget(limit):
+    """Declare the maximum number of SQL statements a view may issue"""
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            with count_queries() as counter:
+                rv = f(*args, **kwargs)
+            if counter.count > limit:
+                message = (f'{f.__name__} issued {counter.count} SQL statements '
+                           f'(budget {limit}):\n' + '\n'.join(counter.statements))
+                if current_app.testing or current_app.config['QUERY_BUDGET_ENFORCE']:
+                    raise QueryBudgetExceeded(message)
+                current_app.logger.warning(message)
+            return rv
+        return decorated_function
+    return decorator
@@ -0,0 +1,266 @@
+"""Precomputed "readers also liked" recommendations
+
+A reader's shelf is every book they reviewed, have in their cart or have
+ordered. Two books are similar when readers share them. The score is the
+cosine of their reader sets, shared / sqrt(readers_a * readers_b), and a
+pair only counts with at least RECOMMENDATIONS_MIN_COREADERS shared
+readers. Each book's best RECOMMENDATIONS_PER_BOOK neighbours are stored in
+``book_neighbors``, so a book page reads them with one primary-key range
+lookup and computes nothing.
+
+``refresh()`` is a batch job (``flask --app run refresh-recommendations``).
+New reviews also queue a background job (app/jobs.py), which runs at
+most once every RECOMMENDATIONS_REFRESH_SECONDS. A full run rebuilds
+every list. An incremental run only recomputes the books on the shelves of readers
+active since the previous run. A new book on a shelf changes its scores
+with every other book there, so those are the lists that move. Other
+books' scores drift slightly as reader counts grow, and removed reviews
+or cart lines linger; both are settled by the next full run.
+
+With NumPy and SciPy installed, shared-reader counts are sparse matrix
+products over batches of books, which handles millions of reviews in a
+minute or two. Without them the same counts are taken in pure Python,
+which is fine for small catalogs.
+"""
+import heapq
+import math
+from array import array
+from collections import Counter, defaultdict
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import func, select, union, union_all
+
+from app import cache, db, jobs
+from app.models import Book, BookNeighbor, Cart, Order, OrderItem, RecommendationRun, Review
+
+try:
+    import numpy as np
+    from scipy import sparse
+except ImportError:  # optional; shared readers are counted in pure Python
+    np = sparse = None
+
+# Most (book, neighbour) counts one sparse product may hold, which bounds
+# the memory a batch of books takes
+PAIR_BUDGET = 20_000_000
+
+# Books whose lists are written per transaction
+WRITE_BATCH = 1000
+
+
+# ---- reader data ----
+
+def _shelf_rows():
+    """(user_id, book_id) for every review, cart line and ordered book; may repeat"""
+    return union_all(
+        select(Review.user_id, Review.book_id),
+        select(Cart.user_id, Cart.book_id),
+        select(Order.user_id, OrderItem.book_id)
+        .join(Order, OrderItem.order_id == Order.id)
+        .where(OrderItem.book_id.is_not(None)),
+    )
+
+
+def _high_water_marks():
+    return db.session.execute(select(
+        select(func.coalesce(func.max(Review.id), 0)).scalar_subquery(),
+        select(func.coalesce(func.max(Cart.id), 0)).scalar_subquery(),
+        select(func.coalesce(func.max(OrderItem.id), 0)).scalar_subquery(),
+    )).one()
+
+
+def _active_readers(run):
+    """Users with reviews, cart lines or ordered books newer than ``run``"""
+    return set(db.session.scalars(union(
+        select(Review.user_id).where(Review.id > run.last_review_id),
+        select(Cart.user_id).where(Cart.id > run.last_cart_id),
+        select(Order.user_id)
+        .join(OrderItem, OrderItem.order_id == Order.id)
+        .where(OrderItem.id > run.last_order_item_id),
+    )))
+
+
+class _SparseShelves:
+    """Reader x book incidence as SciPy sparse matrices"""
+
+    def __init__(self, users, books, book_slots):
+        users = np.frombuffer(users, dtype=np.int64)
+        books = np.frombuffer(books, dtype=np.int64)
+        shape = (int(users.max()) + 1 if users.size else 1, book_slots)
+        by_user = sparse.csr_matrix((np.ones(users.size, dtype=np.float32), (users, books)), shape=shape)
+        # Repeated pairs were summed; a reader either has a book or not
+        by_user.data[:] = 1
+        self.by_user = by_user
+        self.by_book = by_user.T.tocsr()
+        self.readers = np.diff(self.by_book.indptr)
+
+    def books_of(self, users):
+        users = [user for user in users if user < self.by_user.shape[0]]
+        return np.unique(self.by_user[users].indices).tolist() if users else []
+
+    def neighbors(self, book_ids, top_k, min_coreaders):
+        books = np.asarray(book_ids, dtype=np.int64)
+        # A book's product row holds at most this many counts
+        shelf_sizes = np.diff(self.by_user.indptr).astype(np.float64)
+        work = self.by_book[books] @ shelf_sizes
+        start = 0
+        while start < len(books):
+            size = max(1, int(np.searchsorted(np.cumsum(work[start:]), PAIR_BUDGET, side='right')))
+            batch = books[start:start + size]
+            shared = (self.by_book[batch] @ self.by_user).tocsr()
+            for row, book_id in enumerate(batch.tolist()):
+                lo, hi = shared.indptr[row], shared.indptr[row + 1]
+                others, counts = shared.indices[lo:hi], shared.data[lo:hi]
+                keep = (others != book_id) & (counts >= min_coreaders)
+                others, counts = others[keep], counts[keep]
+                if not others.size:
+                    yield book_id, []
+                    continue
+                scores = counts.astype(np.float64) / np.sqrt(float(self.readers[book_id]) * self.readers[others])
+                if scores.size > top_k:
+                    # Keep every tie with the k-th score, so ids break ties
+                    cutoff = -np.partition(-scores, top_k - 1)[top_k - 1]
+                    best = scores >= cutoff
+                    others, scores = others[best], scores[best]
+                order = np.lexsort((others, -scores))[:top_k]
+                yield book_id, list(zip(others[order].tolist(), scores[order].tolist()))
+            start += size
+
+
+class _SetShelves:
+    """Reader and book sets in plain dictionaries"""
+
+    def __init__(self, users, books, book_slots):
+        self.shelves = defaultdict(set)
+        self.readers = defaultdict(set)
+        for user_id, book_id in zip(users, books):
+            self.shelves[user_id].add(book_id)
+            self.readers[book_id].add(user_id)
+
+    def books_of(self, users):
+        return sorted(set().union(*(self.shelves.get(user, ()) for user in users)))
+
+    def neighbors(self, book_ids, top_k, min_coreaders):
+        for book_id in book_ids:
+            readers = self.readers.get(book_id, ())
+            shared = Counter()
+            for user_id in readers:
+                shared.update(self.shelves[user_id])
+            shared.pop(book_id, None)
+            scored = [(count / math.sqrt(len(readers) * len(self.readers[other])), other)
+                      for other, count in shared.items() if count >= min_coreaders]
+            best = heapq.nsmallest(top_k, scored, key=lambda item: (-item[0], item[1]))
+            yield book_id, [(other, score) for score, other in best]
+
+
+def _load_shelves(book_slots):
+    users, books = array('q'), array('q')
+    for user_id, book_id in db.session.execute(_shelf_rows()):
+        users.append(user_id)
+        books.append(book_id)
+    shelves = _SparseShelves if sparse is not None else _SetShelves
+    return shelves(users, books, book_slots)
+
+
+# ---- refresh ----
+
+def _store(lists):
+    """Replace the given books' lists; returns the ids whose neighbours changed"""
+    book_ids = [book_id for book_id, _ in lists]
+    before = defaultdict(list)
+    for book_id, neighbor_id in db.session.execute(
+        select(BookNeighbor.book_id, BookNeighbor.neighbor_id)
+        .where(BookNeighbor.book_id.in_(book_ids))
+        .order_by(BookNeighbor.book_id, BookNeighbor.rank)
+    ):
+        before[book_id].append(neighbor_id)
+    changed = [book_id for book_id, neighbors in lists
+               if [neighbor_id for neighbor_id, _ in neighbors] != before.get(book_id, [])]
+
+    table = BookNeighbor.__table__
+    db.session.execute(table.delete().where(table.c.book_id.in_(book_ids)))
+    rows = [{'book_id': book_id, 'rank': rank, 'neighbor_id': neighbor_id, 'score': score}
+            for book_id, neighbors in lists
+            for rank, (neighbor_id, score) in enumerate(neighbors)]
+    if rows:
+        db.session.execute(table.insert(), rows)
+    db.session.commit()
+    return changed
+
+
+def refresh(full=False):
+    """Recompute neighbour lists and return the finished RecommendationRun
+
+    Incremental unless ``full`` is set or no earlier run has finished.
+    """
+    config = current_app.config
+    previous = None
+    if not full:
+        previous = (RecommendationRun.query
+                    .filter(RecommendationRun.finished_at.is_not(None))
+                    .order_by(RecommendationRun.id.desc())
+                    .first())
+    review_id, cart_id, order_item_id = _high_water_marks()
+    run = RecommendationRun(full=previous is None, last_review_id=review_id,
+                            last_cart_id=cart_id, last_order_item_id=order_item_id)
+    db.session.add(run)
+    db.session.commit()
+
+    book_slots = (db.session.scalar(select(func.max(Book.id))) or 0) + 1
+    shelves = _load_shelves(book_slots)
+    if previous is None:
+        targets = db.session.scalars(select(Book.id).order_by(Book.id)).all()
+        table = BookNeighbor.__table__
+        db.session.execute(table.delete().where(table.c.book_id.not_in(select(Book.id))))
+    else:
+        targets = shelves.books_of(_active_readers(previous))
+
+    changed, batch = [], []
+    for item in shelves.neighbors(targets, config['RECOMMENDATIONS_PER_BOOK'],
+                                  config['RECOMMENDATIONS_MIN_COREADERS']):
+        batch.append(item)
+        if len(batch) == WRITE_BATCH:
+            changed += _store(batch)
+            batch = []
+    if batch:
+        changed += _store(batch)
+
+    if len(changed) > WRITE_BATCH:
+        cache.invalidate_all()
+    elif changed:
+        cache.invalidate(*(f'book:{book_id}' for book_id in changed))
+
+    run.books_refreshed = len(targets)
+    run.finished_at = datetime.utcnow()
+    db.session.commit()
+    current_app.logger.info('Recommendations refreshed for %d books (%d changed, %s)',
+                            len(targets), len(changed), 'full' if run.full else 'incremental')
+    return run
+
+
+def also_liked(book_id):
+    """A book's precomputed neighbours, most similar first"""
+    return (Book.query
+            .join(BookNeighbor, BookNeighbor.neighbor_id == Book.id)
+            .filter(BookNeighbor.book_id == book_id)
+            .order_by(BookNeighbor.rank)
+            .all())
+
+
+# ---- background refresh ----
+
+@jobs.task('recommendations.refresh')
+def _refresh_job():
+    refresh()
+
+
+def schedule_refresh():
+    """Queue an incremental refresh, e.g. with a new review
+
+    The job waits RECOMMENDATIONS_REFRESH_SECONDS and every request made
+    meanwhile joins it, so refreshes run at most that often.
+    """
+    delay = current_app.config['RECOMMENDATIONS_REFRESH_SECONDS']
+    if delay is None:
+        return
+    jobs.enqueue('recommendations.refresh', key='recommendations.refresh', delay=delay)
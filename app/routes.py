@@ -1,10 +1,25 @@
-from flask import current_app as app, render_template, redirect, url_for, flash, request, jsonify
+from flask import current_app as app, render_template, redirect, url_for, flash, request, jsonify, abort, make_response, send_from_directory, get_template_attribute, Response, stream_with_context
 from flask_login import login_user, logout_user, current_user, login_required
+from datetime import datetime
 from functools import wraps
-from app import db
-from app.models import User, Book, Cart, Review
+from app import (db, carts, checkout, export, facets, images, metrics, recommendations, stats,
+                 typeahead, search as search_index)
+from app.cache import cached_page, invalidate, invalidate_all
+from app.http_cache import book_version, catalog_version, conditional
+from app.database import replica_reads
+from app.passwords import HasherBusy
+from app.models import User, Book, BookNeighbor, Cart, Review, Order, OrderItem, BOOK_CATEGORIES
+from app.cart_summary import (get_cart_summary, set_cart_summary, adjust_cart_summary,
+                              invalidate_cart_summary, reset_cart_summary)
 from app.forms import RegistrationForm, LoginForm, BookForm, ReviewForm
-from sqlalchemy import or_
+from app.pagination import paginate_keyset
+from app.query_budget import query_budget
+from sqlalchemy import func, or_
+from sqlalchemy.orm import joinedload
+
+
+# Covers are immutable, so browsers may keep them for a year
+COVER_MAX_AGE = 365 * 24 * 3600
 
 
 def admin_required(f):
@@ -18,81 +33,158 @@ def admin_required(f):
     return decorated_function
 
 
+def hasher_busy(template, form):
+    """503 with Retry-After when the password hashing pool is saturated"""
+    flash('We are handling a lot of sign-ins right now. Please try again in a moment.', 'warning')
+    response = make_response(render_template(template, form=form), 503)
+    response.headers['Retry-After'] = '2'
+    return response
+
+
+def ingest_cover(book_id, form, previous_url):
+    """Queue local cover processing for an uploaded file or a new image URL
+    
+    Called before the book's commit, so the job is saved with the book.
+    """
+    try:
+        if form.cover.data:
+            images.ingest_upload(book_id, form.cover.data.read())
+        elif form.image_url.data and form.image_url.data != previous_url:
+            images.ingest_url(book_id, form.image_url.data)
+        else:
+            return
+    except images.CoverError as exc:
+        flash(f'Cover not saved: {exc}', 'warning')
+        return
+    flash('The cover is being processed and will appear shortly.', 'info')
+
+
+@app.context_processor
+def inject_navigation():
+    """Category nav (with book counts) and cart badge shared by every page"""
+    return {'categories': BOOK_CATEGORIES, 'category_counts': facets.category_totals(),
+            'cart_count': get_cart_summary()['count']}
+
+
 # ============== PUBLIC ROUTES ==============
 
 @app.route('/')
 @app.route('/index')
+@replica_reads
+@conditional(lambda: catalog_version())
+@cached_page(lambda: ['index'])
+@query_budget(3)
 def index():
     """Home page with best sellers"""
     books = Book.query.order_by(Book.average_rating.desc()).limit(15).all()
-    categories = ['Photography', 'Investing', 'Literature', 'Languages', 
-                  'Biography', 'Reference', 'Wellness', 'Graphic Novels']
     
-    # Get cart count
-    cart_count = 0
-    if current_user.is_authenticated:
-        cart_count = Cart.query.filter_by(user_id=current_user.id).count()
-    
-    return render_template('index.html', books=books, categories=categories, cart_count=cart_count)
+    return render_template('index.html', books=books)
 
 
 @app.route('/category/<category>')
+@replica_reads
+@conditional(lambda category: catalog_version(category))
+@cached_page(lambda category: [f'category:{category}'])
+@query_budget(3)
 def category(category):
-    """Display books by category"""
-    books = Book.query.filter_by(category=category).all()
-    categories = ['Photography', 'Investing', 'Literature', 'Languages', 
-                  'Biography', 'Reference', 'Wellness', 'Graphic Novels']
-    
-    cart_count = 0
-    if current_user.is_authenticated:
-        cart_count = Cart.query.filter_by(user_id=current_user.id).count()
-    
-    return render_template('category.html', books=books, category=category, 
-                         categories=categories, cart_count=cart_count)
+    """Display books by category, filtered by price, rating and stock facets"""
+    filters = facets.Filters(request.args)
+    page = paginate_keyset(
+        filters.apply(Book.query.filter_by(category=category)),
+        filters.order_by,
+        cursor=request.args.get('cursor'),
+        per_page=app.config['BOOKS_PER_PAGE']
+    )
+    books = page.items
+    
+    return render_template('category.html', books=books, page=page, category=category,
+                           filters=filters, counts=facets.facet_counts(category, filters),
+                           price_bands=facets.PRICE_BANDS, rating_filters=facets.RATING_FILTERS,
+                           sorts=facets.SORTS)
+
+
+# Review sort name -> (label, keyset ordering); each has a composite index on reviews
+REVIEW_SORTS = {
+    'newest': ('Newest', [(Review.created_at, True), (Review.id, True)]),
+    'rating': ('Highest rated', [(Review.rating, True), (Review.created_at, True), (Review.id, True)]),
+}
+
+
+def _review_page(book_id):
+    """One keyset page of a book's reviews in the requested sort"""
+    sort = request.args.get('sort')
+    if sort not in REVIEW_SORTS:
+        sort = 'newest'
+    page = paginate_keyset(
+        Review.query.options(joinedload(Review.user)).filter_by(book_id=book_id),
+        REVIEW_SORTS[sort][1],
+        cursor=request.args.get('cursor'),
+        per_page=app.config['REVIEWS_PER_PAGE']
+    )
+    return page, sort
 
 
 @app.route('/book/<int:id>')
+@replica_reads
+@conditional(lambda id: book_version(id, neighbors=True))
+@cached_page(lambda id: [f'book:{id}'])
+@query_budget(5)
 def book_detail(id):
-    """Book detail page with reviews"""
+    """Book detail page with the rating histogram and the first page of reviews"""
     book = Book.query.get_or_404(id)
-    reviews = Review.query.filter_by(book_id=id).order_by(Review.created_at.desc()).all()
+    page, review_sort = _review_page(id)
     form = ReviewForm()
     
-    categories = ['Photography', 'Investing', 'Literature', 'Languages', 
-                  'Biography', 'Reference', 'Wellness', 'Graphic Novels']
-    
-    cart_count = 0
+    user_review = None
     if current_user.is_authenticated:
-        cart_count = Cart.query.filter_by(user_id=current_user.id).count()
         # Check if user already reviewed this book
         user_review = Review.query.filter_by(user_id=current_user.id, book_id=id).first()
-    else:
-        user_review = None
     
-    return render_template('book_detail.html', book=book, reviews=reviews, 
-                         form=form, user_review=user_review, categories=categories, 
-                         cart_count=cart_count)
+    return render_template('book_detail.html', book=book, reviews=page.items, page=page,
+                         review_sort=review_sort, review_sorts=REVIEW_SORTS,
+                         form=form, user_review=user_review,
+                         also_liked=recommendations.also_liked(id))
+
+
+@app.route('/book/<int:id>/reviews')
+@replica_reads
+@conditional(lambda id: book_version(id))
+@cached_page(lambda id: [f'book:{id}'])
+@query_budget(2)
+def book_reviews(id):
+    """Later pages of a book's reviews, as the HTML fragment the book page appends"""
+    if db.session.query(Book.id).filter(Book.id == id).first() is None:
+        abort(404)
+    page, review_sort = _review_page(id)
+    review_page = get_template_attribute('_reviews.html', 'review_page')
+    return review_page(id, page.items, page, review_sort)
 
 
 @app.route('/search')
+@replica_reads
+@conditional(lambda: catalog_version())
 def search():
-    """Search for books by name"""
-    query = request.args.get('q', '')
+    """Search for books by title, author or description"""
+    query = request.args.get('q', '').strip()
     
     if query:
-        books = Book.query.filter(Book.title.ilike(f'%{query}%')).all()
+        matches, order_by = search_index.search_books(query)
+        page = paginate_keyset(matches, order_by, cursor=request.args.get('cursor'),
+                               per_page=app.config['BOOKS_PER_PAGE'])
+        books = page.items
     else:
+        page = None
         books = []
     
-    categories = ['Photography', 'Investing', 'Literature', 'Languages', 
-                  'Biography', 'Reference', 'Wellness', 'Graphic Novels']
-    
-    cart_count = 0
-    if current_user.is_authenticated:
-        cart_count = Cart.query.filter_by(user_id=current_user.id).count()
-    
-    return render_template('search.html', books=books, query=query, 
-                         categories=categories, cart_count=cart_count)
+    return render_template('search.html', books=books, query=query, page=page)
+
+
+@app.route('/covers/<path:filename>')
+def cover_file(filename):
+    """Serve a rendered cover; names are content-hashed, so they never change"""
+    response = send_from_directory(app.config['COVER_STORAGE_DIR'], filename, max_age=COVER_MAX_AGE)
+    response.headers['Cache-Control'] = f'public, max-age={COVER_MAX_AGE}, immutable'
+    return response
 
 
 # ============== AUTHENTICATION ROUTES ==============
@@ -106,7 +198,10 @@ def register():
     form = RegistrationForm()
     if form.validate_on_submit():
         user = User(username=form.username.data, email=form.email.data)
-        user.set_password(form.password.data)
+        try:
+            user.set_password(form.password.data)
+        except HasherBusy:
+            return hasher_busy('register.html', form)
         db.session.add(user)
         db.session.commit()
         flash('Registration successful! Please log in.', 'success')
@@ -128,8 +223,18 @@ def login():
             or_(User.username == form.username.data, User.email == form.username.data)
         ).first()
         
-        if user and user.check_password(form.password.data):
+        try:
+            valid = user is not None and user.check_password(form.password.data)
+            if valid and user.password_needs_rehash():
+                # Hashed with older parameters; upgrade while we have the password
+                user.upgrade_password_hash(form.password.data)
+                db.session.commit()
+        except HasherBusy:
+            return hasher_busy('login.html', form)
+        
+        if valid:
             login_user(user, remember=form.remember_me.data)
+            reset_cart_summary()
             flash(f'Welcome back, {user.username}!', 'success')
             next_page = request.args.get('next')
             return redirect(next_page) if next_page else redirect(url_for('index'))
@@ -144,6 +249,7 @@ def login():
 def logout():
     """User logout"""
     logout_user()
+    reset_cart_summary()
     flash('You have been logged out.', 'info')
     return redirect(url_for('index'))
 
@@ -152,56 +258,61 @@ def logout():
 @login_required
 def profile():
     """User profile page"""
-    categories = ['Photography', 'Investing', 'Literature', 'Languages', 
-                  'Biography', 'Reference', 'Wellness', 'Graphic Novels']
-    cart_count = Cart.query.filter_by(user_id=current_user.id).count()
-    
-    return render_template('profile.html', categories=categories, cart_count=cart_count)
+    return render_template('profile.html')
 
 
 # ============== CART ROUTES ==============
 
 @app.route('/cart')
 @login_required
+# The third is the navigation's category counts, read after each catalog-wide invalidation
+@query_budget(3)
 def cart():
     """Shopping cart page"""
-    cart_items = Cart.query.filter_by(user_id=current_user.id).all()
+    cart_items = (Cart.query.options(joinedload(Cart.book))
+                  .filter_by(user_id=current_user.id)
+                  .order_by(Cart.added_at, Cart.id)
+                  .all())
     
-    # Calculate total
-    total = sum(item.book.price_npr * item.quantity for item in cart_items)
+    # Calculate total in SQL rather than over the loaded rows
+    total = (db.session.query(func.coalesce(func.sum(Book.price_npr * Cart.quantity), 0))
+             .select_from(Cart)
+             .join(Book, Cart.book_id == Book.id)
+             .filter(Cart.user_id == current_user.id)
+             .scalar())
     
-    categories = ['Photography', 'Investing', 'Literature', 'Languages', 
-                  'Biography', 'Reference', 'Wellness', 'Graphic Novels']
-    cart_count = len(cart_items)
+    # Both figures are exact here, so resynchronise the cached summary
+    set_cart_summary(len(cart_items), total)
     
-    return render_template('cart.html', cart_items=cart_items, total=total, 
-                         categories=categories, cart_count=cart_count)
+    return render_template('cart.html', cart_items=cart_items, total=total)
 
 
 @app.route('/cart/add/<int:book_id>', methods=['POST'])
 @login_required
 def add_to_cart(book_id):
     """Add book to cart"""
-    book = Book.query.get_or_404(book_id)
-    
-    # Check if book already in cart
-    cart_item = Cart.query.filter_by(user_id=current_user.id, book_id=book_id).first()
-    
-    if cart_item:
-        # Increase quantity
-        cart_item.quantity += 1
-    else:
-        # Add new cart item
-        cart_item = Cart(user_id=current_user.id, book_id=book_id, quantity=1)
-        db.session.add(cart_item)
+    # One upsert inserts the row or bumps its quantity, capped by stock
+    result = carts.add_book(current_user.id, book_id)
+    is_ajax = request.is_json or request.headers.get('X-Requested-With') == 'XMLHttpRequest'
+    
+    if not result.added:
+        db.session.rollback()
+        book = Book.query.get_or_404(book_id)
+        if book.stock_quantity <= 0:
+            message = 'Sorry, this book is out of stock.'
+        else:
+            message = f'Only {book.stock_quantity} in stock, and all of them are in your cart.'
+        if is_ajax:
+            return jsonify({'success': False, 'message': message}), 409
+        flash(message, 'warning')
+        return redirect(request.referrer or url_for('index'))
     
     db.session.commit()
-    
-    # Get updated cart count
-    cart_count = Cart.query.filter_by(user_id=current_user.id).count()
+    adjust_cart_summary(1 if result.inserted else 0, result.price)
+    cart_count = get_cart_summary()['count']
     
     # Return JSON for AJAX requests
-    if request.is_json or request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+    if is_ajax:
         return jsonify({'success': True, 'cart_count': cart_count, 'message': 'Book added to cart!'})
     
     flash('Book added to cart!', 'success')
@@ -212,41 +323,107 @@ def add_to_cart(book_id):
 @login_required
 def remove_from_cart(item_id):
     """Remove item from cart"""
-    cart_item = Cart.query.get_or_404(item_id)
+    cart_item = Cart.query.options(joinedload(Cart.book)).get_or_404(item_id)
     
     # Ensure user owns this cart item
     if cart_item.user_id != current_user.id:
         flash('Unauthorized action.', 'danger')
         return redirect(url_for('cart'))
     
+    subtotal = cart_item.book.price_npr * cart_item.quantity
     db.session.delete(cart_item)
     db.session.commit()
+    adjust_cart_summary(-1, -subtotal)
     flash('Item removed from cart.', 'success')
     
     return redirect(url_for('cart'))
 
 
-@app.route('/cart/update/<int:item_id>', methods=['POST'])
+@app.route('/cart/update', methods=['POST'])
 @login_required
-def update_cart(item_id):
-    """Update cart item quantity"""
-    cart_item = Cart.query.get_or_404(item_id)
+def update_cart_items():
+    """Save every quantity on the cart page in one request"""
+    quantities = {}
+    for key, value in request.form.items():
+        if not key.startswith('quantity-'):
+            continue
+        try:
+            item_id, quantity = int(key[len('quantity-'):]), int(value)
+        except ValueError:
+            quantity = 0
+        if quantity < 1:
+            flash('Invalid quantity.', 'danger')
+            return redirect(url_for('cart'))
+        quantities[item_id] = quantity
+    
+    capped = carts.update_quantities(current_user.id, quantities)
+    db.session.commit()
+    # The cart page recomputes the summary exactly
+    invalidate_cart_summary()
     
-    # Ensure user owns this cart item
-    if cart_item.user_id != current_user.id:
-        flash('Unauthorized action.', 'danger')
+    if capped:
+        flash('Some quantities were reduced to the number of copies in stock.', 'warning')
+    else:
+        flash('Cart updated.', 'success')
+    return redirect(url_for('cart'))
+
+
+# ============== ORDER ROUTES ==============
+
+@app.route('/checkout', methods=['POST'])
+@login_required
+def place_order():
+    """Turn the cart into an order, reserving stock for every line"""
+    try:
+        result = checkout.place_order(current_user.id)
+    except checkout.CheckoutError as exc:
+        flash(str(exc), 'warning')
         return redirect(url_for('cart'))
     
-    quantity = request.form.get('quantity', type=int)
-    
-    if quantity and quantity > 0:
-        cart_item.quantity = quantity
-        db.session.commit()
-        flash('Cart updated.', 'success')
-    else:
-        flash('Invalid quantity.', 'danger')
+    if not result.ok:
+        for shortage in result.shortages:
+            if shortage.available:
+                flash(f'Only {shortage.available} of "{shortage.title}" left '
+                      f'(you asked for {shortage.requested}).', 'warning')
+            else:
+                flash(f'"{shortage.title}" has just sold out.', 'warning')
+        flash('Nothing was charged. Please adjust your cart and try again.', 'info')
+        return redirect(url_for('cart'))
     
-    return redirect(url_for('cart'))
+    order = result.order
+    invalidate_cart_summary()
+    # Book pages show the stock left; category pages filter and count by it
+    book_ids = [item.book_id for item in order.items]
+    sold_out = (db.session.query(Book.category)
+                .filter(Book.id.in_(book_ids), Book.stock_quantity <= 0)
+                .distinct())
+    invalidate(*(f'book:{book_id}' for book_id in book_ids),
+               *(f'category:{category}' for category, in sold_out))
+    flash(f'Order #{order.id} placed. Thank you!', 'success')
+    return redirect(url_for('order_detail', order_id=order.id))
+
+
+@app.route('/orders')
+@login_required
+def orders():
+    """Current user's orders, newest first"""
+    page = paginate_keyset(
+        Order.query.filter_by(user_id=current_user.id),
+        [(Order.id, True)],
+        cursor=request.args.get('cursor'),
+        per_page=app.config['BOOKS_PER_PAGE']
+    )
+    return render_template('orders.html', orders=page.items, page=page)
+
+
+@app.route('/orders/<int:order_id>')
+@login_required
+def order_detail(order_id):
+    """Single order, visible to its owner and admins"""
+    order = Order.query.get_or_404(order_id)
+    if order.user_id != current_user.id and not current_user.is_admin:
+        abort(404)
+    return render_template('order_detail.html', order=order)
 
 
 # ============== REVIEW ROUTES ==============
@@ -278,34 +455,107 @@ def submit_review(id):
             db.session.add(review)
             flash('Thank you for your review!', 'success')
         
+        # Rating aggregates on the book are adjusted by the Review mapper events
+        category = book.category
+        recommendations.schedule_refresh()
         db.session.commit()
-        
-        # Update book's average rating
-        book.update_average_rating()
+        invalidate('index', f'category:{category}', f'book:{id}')
     
     return redirect(url_for('book_detail', id=id))
 
 
 # ============== ADMIN ROUTES ==============
 
+# Admin book table sort name -> (label, keyset ordering); each has an index on books
+ADMIN_BOOK_SORTS = {
+    'newest': ('Newest', [(Book.created_at, True), (Book.id, True)]),
+    'title': ('Title', [(Book.title, False), (Book.id, False)]),
+    'price': ('Price', [(Book.price_npr, False), (Book.id, False)]),
+    'stock': ('Stock (lowest first)', [(Book.stock_quantity, False), (Book.id, False)]),
+    'rating': ('Rating', [(Book.average_rating, True), (Book.id, True)]),
+}
+
+
+def _admin_books(query, sort):
+    """The admin book table's query and ordering for a search and sort"""
+    if not query:
+        return Book.query, ADMIN_BOOK_SORTS[sort][1]
+    digits = query.replace('-', '')
+    if digits.isdigit() and len(digits) >= 10:
+        return Book.query.filter(Book.isbn.in_({query, digits})), [(Book.id, False)]
+    # Searches list the best matches first, whatever the sort
+    return search_index.search_books(query)
+
+
 @app.route('/admin')
 @login_required
 @admin_required
+# Books, counters and series, plus the navigation's counts and cart badge on cold caches
+@query_budget(5)
 def admin_dashboard():
-    """Admin dashboard"""
-    books = Book.query.all()
-    total_books = Book.query.count()
-    total_users = User.query.count()
-    total_reviews = Review.query.count()
-    
-    categories = ['Photography', 'Investing', 'Literature', 'Languages', 
-                  'Biography', 'Reference', 'Wellness', 'Graphic Novels']
-    cart_count = Cart.query.filter_by(user_id=current_user.id).count()
+    """Admin dashboard: store figures, daily activity and the book table"""
+    query = request.args.get('q', '').strip()
+    sort = request.args.get('sort')
+    if sort not in ADMIN_BOOK_SORTS:
+        sort = 'newest'
+    books, order_by = _admin_books(query, sort)
+    page = paginate_keyset(
+        books,
+        order_by,
+        cursor=request.args.get('cursor'),
+        per_page=app.config['BOOKS_PER_PAGE']
+    )
+    
+    return render_template('admin/dashboard.html', books=page.items, page=page,
+                         query=query, sort=sort, sorts=ADMIN_BOOK_SORTS,
+                         counters=stats.counters(),
+                         series=stats.daily_series(app.config['STATS_SERIES_DAYS']),
+                         low_stock=stats.LOW_STOCK)
+
+
+@app.route('/admin/metrics')
+@login_required
+@admin_required
+def admin_metrics():
+    """Per-endpoint latency, SQL and render timings"""
+    return render_template('admin/metrics.html', endpoints=metrics.registry.snapshot(),
+                         metrics_enabled=app.config['METRICS_ENABLED'])
+
+
+@app.route('/admin/metrics/prometheus')
+def admin_metrics_prometheus():
+    """Metrics in Prometheus text format for admins or a scraper holding METRICS_TOKEN"""
+    token = app.config['METRICS_TOKEN']
+    authorized = token and request.headers.get('Authorization') == f'Bearer {token}'
+    if not authorized and not (current_user.is_authenticated and current_user.is_admin):
+        abort(403)
+    return Response(metrics.registry.prometheus(), mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/admin/export/<dataset>.<fmt>')
+@login_required
+@admin_required
+def admin_export(dataset, fmt):
+    """Stream books, reviews or carts as CSV or JSONL"""
+    if dataset not in export.DATASETS or fmt not in export.EXPORT_FORMATS:
+        abort(404)
+    
+    category = request.args.get('category') or None
+    in_stock = request.args.get('in_stock', type=int)
+    compress = request.args.get('gzip', type=int) == 1
+    
+    body = export.export(dataset, fmt, category=category,
+                         in_stock=None if in_stock is None else bool(in_stock),
+                         compress=compress)
+    filename = f'{dataset}-{datetime.utcnow():%Y%m%d-%H%M%S}.{fmt}'
+    if compress:
+        filename += '.gz'
+        mimetype = 'application/gzip'
+    else:
+        mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
     
-    return render_template('admin/dashboard.html', books=books, 
-                         total_books=total_books, total_users=total_users, 
-                         total_reviews=total_reviews, categories=categories, 
-                         cart_count=cart_count)
+    return Response(stream_with_context(body), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"'})
 
 
 @app.route('/admin/book/add', methods=['GET', 'POST'])
@@ -317,6 +567,7 @@ def add_book():
     
     if form.validate_on_submit():
         book = Book(
+            isbn=form.isbn.data,
             title=form.title.data,
             author=form.author.data,
             price_npr=form.price_npr.data,
@@ -326,16 +577,17 @@ def add_book():
             stock_quantity=form.stock_quantity.data
         )
         db.session.add(book)
-        db.session.commit()
+        db.session.flush()
+        search_index.index_book(book)
         flash('Book added successfully!', 'success')
+        ingest_cover(book.id, form, previous_url=None)
+        db.session.commit()
+        typeahead.book_changed(book)
+        # Every page's navigation shows the category counts
+        invalidate_all()
         return redirect(url_for('admin_dashboard'))
     
-    categories = ['Photography', 'Investing', 'Literature', 'Languages', 
-                  'Biography', 'Reference', 'Wellness', 'Graphic Novels']
-    cart_count = Cart.query.filter_by(user_id=current_user.id).count()
-    
-    return render_template('admin/add_book.html', form=form, categories=categories, 
-                         cart_count=cart_count)
+    return render_template('admin/add_book.html', form=form)
 
 
 @app.route('/admin/book/edit/<int:id>', methods=['GET', 'POST'])
@@ -344,9 +596,12 @@ def add_book():
 def edit_book(id):
     """Edit existing book"""
     book = Book.query.get_or_404(id)
-    form = BookForm(obj=book)
+    form = BookForm(obj=book, original_isbn=book.isbn)
     
     if form.validate_on_submit():
+        old_category = book.category
+        old_image_url = book.image_url
+        book.isbn = form.isbn.data
         book.title = form.title.data
         book.author = form.author.data
         book.price_npr = form.price_npr.data
@@ -354,16 +609,22 @@ def edit_book(id):
         book.description = form.description.data
         book.image_url = form.image_url.data
         book.stock_quantity = form.stock_quantity.data
-        db.session.commit()
+        if not book.image_url and not form.cover.data:
+            # Cover removed
+            book.cover_hash = None
+        search_index.index_book(book)
         flash('Book updated successfully!', 'success')
+        ingest_cover(id, form, previous_url=old_image_url)
+        db.session.commit()
+        typeahead.book_changed(book)
+        if book.category != old_category:
+            # Every page's navigation shows the category counts
+            invalidate_all()
+        else:
+            invalidate('index', f'category:{old_category}', f'book:{id}')
         return redirect(url_for('admin_dashboard'))
     
-    categories = ['Photography', 'Investing', 'Literature', 'Languages', 
-                  'Biography', 'Reference', 'Wellness', 'Graphic Novels']
-    cart_count = Cart.query.filter_by(user_id=current_user.id).count()
-    
-    return render_template('admin/edit_book.html', form=form, book=book, 
-                         categories=categories, cart_count=cart_count)
+    return render_template('admin/edit_book.html', form=form, book=book)
 
 
 @app.route('/admin/book/delete/<int:id>', methods=['POST'])
@@ -372,7 +633,14 @@ def edit_book(id):
 def delete_book(id):
     """Delete book"""
     book = Book.query.get_or_404(id)
+    search_index.remove_book(book.id)
+    BookNeighbor.query.filter_by(book_id=id).delete()
+    # Past orders keep their copied title and price but stop linking to the book
+    OrderItem.query.filter_by(book_id=id).update({'book_id': None})
     db.session.delete(book)
     db.session.commit()
+    typeahead.book_deleted(id)
+    # Every page's navigation shows the category counts
+    invalidate_all()
     flash('Book deleted successfully!', 'success')
     return redirect(url_for('admin_dashboard'))
@@ -0,0 +1,133 @@
+"""Full-text search over the book catalog.
+
+On SQLite the catalog is mirrored into an FTS5 table (``books_fts``) whose
+rowid is the book id, so matches are ranked with BM25 and never scan
+``books``. Other databases fall back to a plain ILIKE filter.
+"""
+import re
+
+from sqlalchemy import Float, Integer, column, or_, table, text
+
+from app import db
+from app.models import Book
+
+FTS_TABLE = 'books_fts'
+
+# BM25 column weights: a title hit outranks an author hit, which outranks
+# a hit somewhere in the description.
+BM25_WEIGHTS = (10.0, 5.0, 1.0)
+
+books_fts = table(FTS_TABLE, column('rowid', Integer), column('rank', Float))
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+# Database URLs already known to carry the index, so the sqlite_master
+# lookup happens once per process rather than once per search.
+_indexed_databases = set()
+
+
+def fts_enabled():
+    """Return True when the FTS5 index exists in the current database"""
+    engine = db.engine
+    if engine.dialect.name != 'sqlite':
+        return False
+    url = str(engine.url)
+    if url in _indexed_databases:
+        return True
+    row = db.session.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+        {'name': FTS_TABLE}
+    ).first()
+    if row is not None:
+        _indexed_databases.add(url)
+    return row is not None
+
+
+def create_index():
+    """Create the FTS5 table if it does not exist yet"""
+    db.session.execute(text(
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+        "title, author, description, tokenize = 'unicode61 remove_diacritics 2')"
+    ))
+    weights = ', '.join(str(w) for w in BM25_WEIGHTS)
+    db.session.execute(
+        text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rank) VALUES ('rank', :rank)"),
+        {'rank': f'bm25({weights})'}
+    )
+    _indexed_databases.add(str(db.engine.url))
+
+
+def rebuild_index():
+    """Drop and repopulate the FTS5 table from the books table"""
+    _indexed_databases.discard(str(db.engine.url))
+    db.session.execute(text(f"DROP TABLE IF EXISTS {FTS_TABLE}"))
+    create_index()
+    db.session.execute(text(
+        f"INSERT INTO {FTS_TABLE}(rowid, title, author, description) "
+        "SELECT id, title, author, COALESCE(description, '') FROM books"
+    ))
+    db.session.commit()
+
+
+def index_book(book):
+    """Insert or refresh a book's index entry (book must be flushed)"""
+    if not fts_enabled():
+        return
+    remove_book(book.id)
+    db.session.execute(
+        text(f"INSERT INTO {FTS_TABLE}(rowid, title, author, description) "
+             "VALUES (:id, :title, :author, :description)"),
+        {'id': book.id, 'title': book.title, 'author': book.author,
+         'description': book.description or ''}
+    )
+
+
+def index_books(book_ids):
+    """Refresh the index entries of many books in two statements (bulk loads)"""
+    if not book_ids or not fts_enabled():
+        return
+    ids = ', '.join(str(int(book_id)) for book_id in book_ids)
+    db.session.execute(text(f"DELETE FROM {FTS_TABLE} WHERE rowid IN ({ids})"))
+    db.session.execute(text(
+        f"INSERT INTO {FTS_TABLE}(rowid, title, author, description) "
+        f"SELECT id, title, author, COALESCE(description, '') FROM books WHERE id IN ({ids})"
+    ))
+
+
+def remove_book(book_id):
+    """Remove a book from the index"""
+    if not fts_enabled():
+        return
+    db.session.execute(text(f"DELETE FROM {FTS_TABLE} WHERE rowid = :id"), {'id': book_id})
+
+
+def build_match_expression(query):
+    """Turn free text into an FTS5 query that prefix-matches every term
+
+    Each word is quoted so user input can never inject FTS5 operators.
+    Returns None when the query has no searchable characters.
+    """
+    tokens = _TOKEN_RE.findall(query.lower())
+    if not tokens:
+        return None
+    return ' '.join(f'"{token}"*' for token in tokens)
+
+
+def search_books(query):
+    """Return ``(query, order_by)`` for the search box, best matches first
+
+    The query is left unordered so callers can hand both parts to
+    ``paginate_keyset``; with FTS5 the seek key is ``(rank, id)``.
+    """
+    if fts_enabled():
+        match = build_match_expression(query)
+        if match is None:
+            return Book.query.filter(db.false()), [(Book.id, False)]
+        books = (Book.query
+                 .join(books_fts, books_fts.c.rowid == Book.id)
+                 .filter(text(f"{FTS_TABLE} MATCH :match").bindparams(match=match)))
+        return books, [(books_fts.c.rank, False), (Book.id, False)]
+
+    pattern = f'%{query}%'
+    books = Book.query.filter(or_(Book.title.ilike(pattern), Book.author.ilike(pattern)))
+    return books, [(Book.title, False), (Book.id, False)]
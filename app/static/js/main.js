@@ -45,8 +45,9 @@ $(document).ready(function() {
                 }
             },
             error: function(xhr) {
-                // Show error message
-                showToast('danger', 'Failed to add book to cart. Please try again.');
+                // Show the server's reason (e.g. out of stock) when it gave one
+                const message = xhr.responseJSON && xhr.responseJSON.message;
+                showToast('danger', message || 'Failed to add book to cart. Please try again.');
                 
                 // Reset button
                 button.html(originalText);
@@ -181,6 +182,130 @@ $(document).ready(function() {
     });
     
     
+    // ========== Category Sort ==========
+    $('.sort-select').on('change', function() {
+        this.form.submit();
+    });
+    
+    
+    // ========== More Reviews ==========
+    // Appends the next page in place; without JavaScript the link opens it
+    $(document).on('click', '.reviews-more a[data-url]', function(e) {
+        e.preventDefault();
+        const link = $(this);
+        const more = link.closest('.reviews-more');
+        if (link.hasClass('disabled')) return;
+        link.addClass('disabled').html('<i class="fas fa-spinner fa-spin"></i> Loading...');
+        
+        $.ajax({
+            url: link.data('url'),
+            method: 'GET',
+            dataType: 'html',
+            success: function(html) {
+                // The fragment carries its own "More reviews" link when there is a next page
+                more.replaceWith(html);
+            },
+            error: function() {
+                link.removeClass('disabled').text('More reviews');
+                showToast('danger', 'Could not load more reviews. Please try again.');
+            }
+        });
+    });
+    
+    
+    // ========== Search Suggestions ==========
+    // Debounced lookups; a newer keystroke aborts the request in flight
+    $('.search-form input[data-suggest-url]').each(function() {
+        const input = $(this);
+        const menu = $('<ul class="typeahead-menu" role="listbox"></ul>').hide();
+        let timer = null;
+        let controller = null;
+        let active = -1;
+        
+        input.closest('.input-group').append(menu);
+        
+        function close() {
+            menu.hide().empty();
+            active = -1;
+        }
+        
+        function highlight(index) {
+            const items = menu.children();
+            active = (index + items.length) % items.length;
+            items.removeClass('active').eq(active).addClass('active');
+        }
+        
+        function render(books) {
+            menu.empty();
+            active = -1;
+            if (!books.length) {
+                menu.hide();
+                return;
+            }
+            books.forEach(function(book) {
+                $('<li role="option"></li>')
+                    .append($('<a></a>').attr('href', book.url)
+                        .append($('<span class="typeahead-title"></span>').text(book.title))
+                        .append($('<span class="typeahead-author"></span>').text(book.author)))
+                    .appendTo(menu);
+            });
+            menu.show();
+        }
+        
+        function lookup(query) {
+            if (controller) {
+                controller.abort();
+            }
+            controller = new AbortController();
+            const url = input.data('suggest-url') + '?q=' + encodeURIComponent(query);
+            fetch(url, { signal: controller.signal, headers: { 'Accept': 'application/json' } })
+                .then(response => response.ok ? response.json() : { data: [] })
+                .then(payload => render(payload.data))
+                .catch(function(error) {
+                    if (error.name !== 'AbortError') {
+                        close();
+                    }
+                });
+        }
+        
+        input.on('input', function() {
+            clearTimeout(timer);
+            const query = input.val().trim();
+            if (!query) {
+                if (controller) {
+                    controller.abort();
+                }
+                close();
+                return;
+            }
+            timer = setTimeout(() => lookup(query), 150);
+        });
+        
+        input.on('keydown', function(e) {
+            if (!menu.is(':visible')) {
+                return;
+            }
+            if (e.key === 'ArrowDown') {
+                e.preventDefault();
+                highlight(active + 1);
+            } else if (e.key === 'ArrowUp') {
+                e.preventDefault();
+                highlight(active - 1);
+            } else if (e.key === 'Enter' && active >= 0) {
+                e.preventDefault();
+                window.location.href = menu.children().eq(active).find('a').attr('href');
+            } else if (e.key === 'Escape') {
+                close();
+            }
+        });
+        
+        // Delay so a click on a suggestion lands before the menu goes
+        input.on('blur', function() {
+            setTimeout(close, 150);
+        });
+    });
+    
+    
     // ========== Back to Top Button (Optional) ==========
     const backToTopBtn = $('<button class="back-to-top" title="Back to Top"><i class="fas fa-arrow-up"></i></button>');
     $('body').append(backToTopBtn);
@@ -0,0 +1,214 @@
+"""Store-wide figures and daily activity for the admin dashboard
+
+Each counter is a sum over one table: books, users, reviews and cart
+lines, stock units and value, and low-stock and sold-out titles. New
+users and reviews are also bucketed by the UTC day they were created. On
+SQLite, triggers on those tables add a row's contribution when it is
+inserted, move it when a counted column changes and take it back when
+the row is deleted. The figures live in ``stat_counters`` and
+``daily_stats``, so the dashboard reads a handful of rows however large
+the catalog grows. Other databases fall back to aggregating the tables.
+
+Changing LOW_STOCK or the counters below needs
+``flask --app run rebuild-stats``.
+"""
+from collections import namedtuple
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from sqlalchemy import case, event, func, literal_column, select, text
+
+from app import db
+from app.models import Book, Cart, DailyStat, Review, StatCounter, User
+
+# Titles with this many copies or fewer (but some) count as low on stock
+LOW_STOCK = 5
+
+
+def _book_counters(row):
+    stock = row.stock_quantity
+    return {
+        'books': 1,
+        'stock_units': stock,
+        'stock_value': row.price_npr * stock,
+        'low_stock': case(((stock > 0) & (stock <= LOW_STOCK), 1), else_=0),
+        'out_of_stock': case((stock <= 0, 1), else_=0),
+    }
+
+
+def _cart_counters(row):
+    return {'cart_lines': 1, 'cart_units': row.quantity}
+
+
+# table -> (counters for a row, columns whose updates change them, daily metric)
+SOURCES = {
+    Book.__table__: (_book_counters, ('price_npr', 'stock_quantity'), None),
+    User.__table__: (lambda row: {'users': 1}, (), 'new_users'),
+    Review.__table__: (lambda row: {'reviews': 1}, (), 'new_reviews'),
+    Cart.__table__: (_cart_counters, ('quantity',), None),
+}
+
+COUNTERS = tuple(name for table, (counters, _, _) in SOURCES.items() for name in counters(table.c))
+
+METRICS = tuple(metric for _, _, metric in SOURCES.values() if metric)
+
+TRIGGERS = tuple(f'stats_{table.name}_{action}' for table in SOURCES
+                 for action in ('insert', 'update', 'delete'))
+
+Counters = namedtuple('Counters', COUNTERS)
+
+
+# ---- triggers ----
+
+def _trigger_row(table, name):
+    return SimpleNamespace(**{column.name: literal_column(f'{name}.{column.name}') for column in table.c})
+
+
+def _trigger_ddl(dialect):
+    def sql(expr):
+        if isinstance(expr, int):
+            return str(expr)
+        return str(expr.compile(dialect=dialect, compile_kwargs={'literal_binds': True}))
+
+    def add_counter(name, value):
+        return ('INSERT INTO stat_counters (name, value) '
+                f"VALUES ('{name}', {value}) "
+                'ON CONFLICT (name) DO UPDATE SET value = value + excluded.value;')
+
+    def add_day(metric, row, value):
+        return ('INSERT INTO daily_stats (metric, day, value) '
+                f"VALUES ('{metric}', date({row}.created_at), {value}) "
+                'ON CONFLICT (metric, day) DO UPDATE SET value = value + excluded.value;')
+
+    statements = []
+    for table, (counters, watched, metric) in SOURCES.items():
+        new = {name: sql(expr) for name, expr in counters(_trigger_row(table, 'NEW')).items()}
+        old = {name: sql(expr) for name, expr in counters(_trigger_row(table, 'OLD')).items()}
+        added = ' '.join(add_counter(name, f'({value})') for name, value in new.items())
+        removed = ' '.join(add_counter(name, f'-({value})') for name, value in old.items())
+        if metric:
+            added += ' ' + add_day(metric, 'NEW', 1)
+            removed += ' ' + add_day(metric, 'OLD', -1)
+        statements.append(f'CREATE TRIGGER IF NOT EXISTS stats_{table.name}_insert '
+                          f'AFTER INSERT ON {table.name} BEGIN {added} END')
+        statements.append(f'CREATE TRIGGER IF NOT EXISTS stats_{table.name}_delete '
+                          f'AFTER DELETE ON {table.name} BEGIN {removed} END')
+        if watched:
+            moved = ' '.join(add_counter(name, f'({new[name]}) - ({old[name]})')
+                             for name in new if new[name] != old[name])
+            changed = ' OR '.join(f'OLD.{column} IS NOT NEW.{column}' for column in watched)
+            statements.append(f'CREATE TRIGGER IF NOT EXISTS stats_{table.name}_update '
+                              f'AFTER UPDATE OF {", ".join(watched)} ON {table.name} '
+                              f'WHEN {changed} BEGIN {moved} END')
+    return statements
+
+
+def install_triggers(connection):
+    """Create the triggers that keep the dashboard figures current (SQLite only)"""
+    if connection.dialect.name != 'sqlite':
+        return
+    for ddl in _trigger_ddl(connection.dialect):
+        connection.execute(text(ddl))
+
+
+def drop_triggers(connection):
+    if connection.dialect.name != 'sqlite':
+        return
+    for name in TRIGGERS:
+        connection.execute(text(f'DROP TRIGGER IF EXISTS {name}'))
+
+
+@event.listens_for(db.metadata, 'after_create')
+def _create_triggers(target, connection, **kw):
+    # After every table, since the triggers span several tables
+    install_triggers(connection)
+
+
+# ---- rebuilding ----
+
+def _live_counters(connection):
+    values = {}
+    for table, (counters, _, _) in SOURCES.items():
+        sums = counters(table.c)
+        row = connection.execute(select(*[func.coalesce(func.sum(expr), 0) for expr in sums.values()])
+                                 .select_from(table)).one()
+        values.update(zip(sums, row))
+    return values
+
+
+def _day(column):
+    return func.date(column)
+
+
+def rebuild_counters(connection):
+    """Recompute every counter from its table (backfill or repair)"""
+    stat_counters = StatCounter.__table__
+    values = _live_counters(connection)
+    # Other rows (the catalog versions in app/http_cache.py) must only move forward
+    connection.execute(stat_counters.delete().where(stat_counters.c.name.in_(COUNTERS)))
+    connection.execute(stat_counters.insert(), [{'name': name, 'value': value}
+                                                for name, value in values.items()])
+
+
+def rebuild_series(connection):
+    """Recount the rows created per day (backfill or repair)"""
+    daily_stats = DailyStat.__table__
+    connection.execute(daily_stats.delete())
+    for table, (_, _, metric) in SOURCES.items():
+        if metric:
+            day = _day(table.c.created_at)
+            connection.execute(daily_stats.insert().from_select(
+                ['metric', 'day', 'value'],
+                select(literal_column(f"'{metric}'"), day, func.count()).select_from(table).group_by(day)
+            ))
+
+
+@contextmanager
+def bulk_load():
+    """Drop the triggers around a bulk insert, then reinstall them and recount
+
+    Per-row trigger work about doubles the time of a large insert.
+    """
+    with db.engine.begin() as conn:
+        drop_triggers(conn)
+    try:
+        yield
+    finally:
+        with db.engine.begin() as conn:
+            install_triggers(conn)
+            rebuild_counters(conn)
+            rebuild_series(conn)
+
+
+# ---- reading ----
+
+def counters():
+    """The store-wide figures as a Counters tuple"""
+    if db.engine.dialect.name == 'sqlite':
+        values = dict(db.session.execute(select(StatCounter.name, StatCounter.value)).all())
+    else:
+        values = _live_counters(db.session.connection())
+    return Counters(**{name: values.get(name, 0) for name in COUNTERS})
+
+
+def daily_series(days):
+    """``{metric: [(day, value), ...]}`` for the last ``days`` UTC days, oldest first"""
+    today = datetime.utcnow().date()
+    first = (today - timedelta(days=days - 1)).isoformat()
+    if db.engine.dialect.name == 'sqlite':
+        rows = db.session.execute(
+            select(DailyStat.metric, DailyStat.day, DailyStat.value)
+            .where(DailyStat.metric.in_(METRICS), DailyStat.day >= first)
+        ).all()
+    else:
+        rows = []
+        for table, (_, _, metric) in SOURCES.items():
+            if metric:
+                day = _day(table.c.created_at)
+                rows += [(metric, str(value_day), value) for value_day, value in db.session.execute(
+                    select(day, func.count()).select_from(table)
+                    .where(table.c.created_at >= first).group_by(day))]
+    values = {(metric, day): value for metric, day, value in rows}
+    dates = [(today - timedelta(days=n)).isoformat() for n in range(days - 1, -1, -1)]
+    return {metric: [(day, values.get((metric, day), 0)) for day in dates] for metric in METRICS}
@@ -0,0 +1,326 @@
+"""In-memory prefix index for search-box suggestions
+
+Titles and authors are normalized (lowercase, accents stripped,
+punctuation dropped). Every word start, apart from leading stopwords,
+becomes a key, so "gatsby" finds "The Great Gatsby". The keys live in
+one sorted list with a parallel array of book ids. A lookup is a bisect
+plus a short scan, ranked by rating. Every prefix matching more than
+DENSE_PREFIX_KEYS keys, however long, gets its top results precomputed,
+so no lookup scans more than that many keys: "a" and "silent" are one
+dictionary lookup each, and the rest are a bisect and a short scan.
+
+Each process holds its own index. It is built on first use; add, edit
+and delete views update it in place. Every TYPEAHEAD_SYNC_SECONDS a
+lookup also re-reads books whose ``updated_at`` moved, which picks up
+other workers' edits and rating changes. If a book disappeared, the
+index is rebuilt.
+"""
+import bisect
+import heapq
+import re
+import threading
+import time
+import unicodedata
+from array import array
+from datetime import timedelta
+
+from flask import current_app
+from sqlalchemy import func, select
+
+from app import db
+from app.models import Book
+
+# Prefixes matching more keys than this keep a precomputed top list
+DENSE_PREFIX_KEYS = 256
+
+# Results kept per precomputed prefix, and the most a lookup may ask for
+MAX_RESULTS = 10
+
+# How far before the last seen stamp each sync re-reads
+SYNC_OVERLAP = timedelta(seconds=60)
+
+# A sync that finds more changed books than this rebuilds instead
+SYNC_REBUILD_ROWS = 1000
+
+STOPWORDS = frozenset({'a', 'an', 'and', 'of', 'the', 'to', 'in', 'on', 'for'})
+
+_NON_WORD = re.compile(r'[^\w]+', re.UNICODE)
+
+
+def normalize(text):
+    """Lowercase, strip accents and collapse everything but letters and digits to single spaces"""
+    text = unicodedata.normalize('NFKD', text or '')
+    text = ''.join(ch for ch in text if not unicodedata.combining(ch))
+    return _NON_WORD.sub(' ', text.lower()).replace('_', ' ').strip()
+
+
+def book_keys(title, author):
+    """Index keys for a book: the normalized text from each non-stopword word start"""
+    keys = set()
+    for text in (normalize(title), normalize(author)):
+        if not text:
+            continue
+        words = text.split(' ')
+        keys.add(text)
+        for i, word in enumerate(words):
+            if word not in STOPWORDS:
+                keys.add(' '.join(words[i:]))
+    return keys
+
+
+class PrefixIndex:
+    """Sorted keys with parallel book ids, plus top lists for dense prefixes"""
+
+    def __init__(self):
+        self._keys = []
+        self._ids = array('l')
+        # id -> (title, author, rank, keys); rank sorts best first
+        self._books = {}
+        # prefix -> best book ids, for exactly the prefixes over DENSE_PREFIX_KEYS
+        self._top = {}
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._books)
+
+    @staticmethod
+    def _rank(average_rating, rating_count, book_id):
+        return (average_rating or 0.0, rating_count or 0, -book_id)
+
+    def load(self, rows):
+        """Replace the contents with ``(id, title, author, average_rating, rating_count)`` rows"""
+        books, pairs = {}, []
+        for book_id, title, author, rating, count in rows:
+            keys = book_keys(title, author)
+            books[book_id] = (title, author, self._rank(rating, count, book_id), keys)
+            pairs.extend((key, book_id) for key in keys)
+        pairs.sort()
+
+        with self._lock:
+            self._keys = [key for key, _ in pairs]
+            self._ids = array('l', (book_id for _, book_id in pairs))
+            self._books = books
+            self._top = self._dense_tops()
+
+    def _dense_tops(self):
+        top = {}
+        self._split(0, len(self._keys), 0, top)
+        return top
+
+    def _split(self, lo, hi, depth, top):
+        """Best ids among ``keys[lo:hi]``, which share their first ``depth`` characters
+
+        Groups the range by one more character, recursing into the dense
+        groups and recording their top lists, so each key is ranked once.
+        """
+        candidates = set()
+        pos = lo
+        while pos < hi:
+            key = self._keys[pos]
+            if len(key) <= depth:
+                candidates.add(self._ids[pos])
+                pos += 1
+                continue
+            prefix = key[:depth + 1]
+            end = bisect.bisect_left(self._keys, prefix + '\uffff', pos, hi)
+            if end - pos > DENSE_PREFIX_KEYS:
+                top[prefix] = self._split(pos, end, depth + 1, top)
+                candidates.update(top[prefix])
+            else:
+                candidates.update(self._ids[pos:end])
+            pos = end
+        return heapq.nlargest(MAX_RESULTS, candidates, key=lambda book_id: self._books[book_id][2])
+
+    def _range(self, prefix):
+        lo = bisect.bisect_left(self._keys, prefix)
+        return lo, bisect.bisect_left(self._keys, prefix + '\uffff', lo)
+
+    def _best(self, lo, hi, limit):
+        ids = set(self._ids[lo:hi])
+        return heapq.nlargest(limit, ids, key=lambda book_id: self._books[book_id][2])
+
+    def _matches(self, book_id, prefix):
+        entry = self._books.get(book_id)
+        return entry is not None and any(key.startswith(prefix) for key in entry[3])
+
+    def _touched_prefixes(self, keys):
+        # Dense prefixes and those with a top list; a prefix that is neither
+        # has no longer ones that are
+        touched = set()
+        for key in keys:
+            for length in range(1, len(key) + 1):
+                prefix = key[:length]
+                if prefix not in self._top:
+                    lo, hi = self._range(prefix)
+                    if hi - lo <= DENSE_PREFIX_KEYS:
+                        break
+                touched.add(prefix)
+        return touched
+
+    def _refresh_top(self, prefixes, changed):
+        """Update the top lists of ``prefixes`` after the books in ``changed`` moved
+
+        ``changed`` maps each added, edited or removed book to its rank
+        before the change (None if it is new). A top list only needs a scan
+        when one of its books got worse or stopped matching; otherwise the
+        new list is the best of the old one and the changed books.
+        """
+        rank = lambda book_id: self._books[book_id][2]
+        # prefix -> changed books that match it now
+        matching = {}
+        for book_id in changed:
+            for key in self._books[book_id][3] if book_id in self._books else ():
+                for length in range(1, len(key) + 1):
+                    if key[:length] not in prefixes:
+                        break
+                    matching.setdefault(key[:length], set()).add(book_id)
+        for prefix in prefixes:
+            lo, hi = self._range(prefix)
+            if hi - lo <= DENSE_PREFIX_KEYS:
+                self._top.pop(prefix, None)
+                continue
+            top = self._top.get(prefix)
+            if top is None or any(book_id in changed and not (self._matches(book_id, prefix)
+                                                              and rank(book_id) >= changed[book_id])
+                                  for book_id in top):
+                self._top[prefix] = self._best(lo, hi, MAX_RESULTS)
+                continue
+            candidates = {book_id for book_id in top if book_id not in changed}
+            candidates |= matching.get(prefix, set())
+            self._top[prefix] = heapq.nlargest(MAX_RESULTS, candidates, key=rank)
+
+    def _remove(self, book_id):
+        entry = self._books.pop(book_id, None)
+        if entry is None:
+            return None
+        for key in entry[3]:
+            lo = bisect.bisect_left(self._keys, key)
+            hi = bisect.bisect_right(self._keys, key, lo)
+            for pos in range(lo, hi):
+                if self._ids[pos] == book_id:
+                    del self._keys[pos]
+                    del self._ids[pos]
+                    break
+        return entry
+
+    def _add(self, book_id, title, author, rating, count):
+        keys = book_keys(title, author)
+        self._books[book_id] = (title, author, self._rank(rating, count, book_id), keys)
+        for key in keys:
+            pos = bisect.bisect_left(self._keys, key)
+            self._keys.insert(pos, key)
+            self._ids.insert(pos, book_id)
+        return keys
+
+    def _apply(self, rows, book_ids):
+        changed, keys = {}, set()
+        for book_id in book_ids:
+            entry = self._remove(book_id)
+            if entry is not None:
+                changed.setdefault(book_id, entry[2])
+                keys |= entry[3]
+        for book_id, title, author, rating, count in rows:
+            entry = self._remove(book_id)
+            changed.setdefault(book_id, entry and entry[2])
+            if entry is not None:
+                keys |= entry[3]
+            keys |= self._add(book_id, title, author, rating, count)
+        self._refresh_top(self._touched_prefixes(keys), changed)
+
+    def upsert(self, rows):
+        """Add or replace books from ``(id, title, author, average_rating, rating_count)`` rows"""
+        with self._lock:
+            self._apply(rows, ())
+
+    def remove(self, book_ids):
+        with self._lock:
+            self._apply((), book_ids)
+
+    def suggest(self, query, limit=MAX_RESULTS):
+        """Return ``(id, title, author)`` for the best books with a key starting with ``query``"""
+        prefix = normalize(query)
+        if not prefix:
+            return []
+        limit = max(1, min(limit, MAX_RESULTS))
+        with self._lock:
+            ids = self._top.get(prefix)
+            if ids is None:
+                # Not dense, so at most DENSE_PREFIX_KEYS keys to look at
+                ids = self._best(*self._range(prefix), limit)
+            return [(book_id, *self._books[book_id][:2]) for book_id in ids[:limit]]
+
+
+# ---- per-app index ----
+
+_COLUMNS = (Book.id, Book.title, Book.author, Book.average_rating, Book.rating_count)
+
+
+class _State:
+    def __init__(self):
+        self.index = None
+        self.synced_at = 0.0
+        self.stamp = None
+        self.lock = threading.Lock()
+
+
+def init_app(app):
+    app.extensions['typeahead'] = _State()
+
+
+def _build(state):
+    stamp = db.session.scalar(select(func.max(Book.updated_at)))
+    index = PrefixIndex()
+    index.load(db.session.execute(select(*_COLUMNS)))
+    state.index, state.stamp, state.synced_at = index, stamp, time.monotonic()
+    current_app.logger.info('Typeahead index built with %d books', len(index))
+
+
+def _sync(state):
+    """Apply books changed since the last sync; rebuild if many changed or any were deleted"""
+    stamp = db.session.scalar(select(func.max(Book.updated_at)))
+    if stamp is not None and (state.stamp is None or stamp > state.stamp):
+        changed = select(*_COLUMNS)
+        if state.stamp is not None:
+            # Stamps are taken at flush, so a slow transaction can commit an
+            # older one after we looked; re-reading a margin is harmless
+            changed = changed.where(Book.updated_at >= state.stamp - SYNC_OVERLAP)
+        rows = db.session.execute(changed.limit(SYNC_REBUILD_ROWS + 1)).all()
+        if len(rows) > SYNC_REBUILD_ROWS:
+            # Bulk imports and recommendation runs touch many books at once
+            _build(state)
+            return
+        state.index.upsert(rows)
+        state.stamp = stamp
+    if db.session.scalar(select(func.count(Book.id))) != len(state.index):
+        _build(state)
+    state.synced_at = time.monotonic()
+
+
+def get_index():
+    """The app's index, built on first use and kept in sync with the books table"""
+    state = current_app.extensions['typeahead']
+    if state.index is None or time.monotonic() - state.synced_at > current_app.config['TYPEAHEAD_SYNC_SECONDS']:
+        # One request builds or syncs; the rest keep using the current index
+        if state.lock.acquire(blocking=state.index is None):
+            try:
+                if state.index is None:
+                    _build(state)
+                elif time.monotonic() - state.synced_at > current_app.config['TYPEAHEAD_SYNC_SECONDS']:
+                    _sync(state)
+            finally:
+                state.lock.release()
+    return state.index
+
+
+def book_changed(book):
+    """Reflect an added or edited book in this process's index"""
+    index = current_app.extensions['typeahead'].index
+    if index is not None:
+        index.upsert([(book.id, book.title, book.author, book.average_rating, book.rating_count)])
+
+
+def book_deleted(book_id):
+    """Drop a deleted book from this process's index"""
+    index = current_app.extensions['typeahead'].index
+    if index is not None:
+        index.remove([book_id])
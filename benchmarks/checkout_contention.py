@@ -0,0 +1,160 @@
+"""Checkout contention benchmark: many buyers, one hot title
+
+Seeds a scratch database with one book holding ``--stock`` copies and
+``--buyers`` users who each have ``--quantity`` copies of it in their cart,
+then lets ``--threads`` workers check them all out at once. Reports
+throughput and latency and verifies there was no oversell: the copies sold
+match the stock decrement and the stock never goes negative.
+
+    python benchmarks/checkout_contention.py
+    python benchmarks/checkout_contention.py --buyers 1000 --stock 300 --threads 64
+    python benchmarks/checkout_contention.py --database postgresql://localhost/bench
+
+The target database is a scratch one: its tables are dropped and recreated.
+Exits with status 1 if any invariant is violated.
+"""
+import argparse
+import os
+import queue
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from config import Config  # noqa: E402
+from app import create_app, db  # noqa: E402
+from app.checkout import CheckoutError, place_order  # noqa: E402
+from app.models import Book, Cart, OrderItem, User  # noqa: E402
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--buyers', type=int, default=300, help='simulated buyers (default 300)')
+    parser.add_argument('--stock', type=int, default=100, help='copies of the hot title (default 100)')
+    parser.add_argument('--quantity', type=int, default=1, help='copies in each cart (default 1)')
+    parser.add_argument('--threads', type=int, default=32, help='concurrent workers (default 32)')
+    parser.add_argument('--retries', type=int, default=Config.CHECKOUT_RETRIES,
+                        help='CHECKOUT_RETRIES for the run')
+    parser.add_argument('--database', help='SQLAlchemy URL (default: a temporary SQLite file)')
+    return parser.parse_args()
+
+
+def make_app(args):
+    class BenchConfig(Config):
+        SQLALCHEMY_DATABASE_URI = args.database or \
+            'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'checkout_bench.db')
+        SQLALCHEMY_ENGINE_OPTIONS = {'pool_size': args.threads, 'max_overflow': 0}
+        CHECKOUT_RETRIES = args.retries
+        METRICS_ENABLED = False
+        CACHE_TYPE = 'null'
+
+    return create_app(BenchConfig)
+
+
+def seed(args):
+    """Create the hot book, the buyers and their carts; return the buyer ids"""
+    db.drop_all()
+    db.create_all()
+    book = Book(title='Launch Day Bestseller', author='Hot Author', price_npr=999.0,
+                category='Literature', stock_quantity=args.stock)
+    db.session.add(book)
+    db.session.flush()
+    # Buyers never log in, so an unusable hash keeps seeding fast
+    db.session.execute(User.__table__.insert(), [
+        {'username': f'buyer{i}', 'email': f'buyer{i}@example.com', 'password_hash': '!',
+         'is_admin': False}
+        for i in range(args.buyers)
+    ])
+    user_ids = [user_id for (user_id,) in db.session.query(User.id).order_by(User.id)]
+    db.session.execute(Cart.__table__.insert(), [
+        {'user_id': user_id, 'book_id': book.id, 'quantity': args.quantity} for user_id in user_ids
+    ])
+    db.session.commit()
+    return book.id, user_ids
+
+
+def run(app, user_ids, threads):
+    """Check every buyer out concurrently; return outcome counts and latencies"""
+    pending = queue.Queue()
+    for user_id in user_ids:
+        pending.put(user_id)
+    outcomes = {'ordered': 0, 'sold_out': 0, 'busy': 0}
+    latencies = []
+    lock = threading.Lock()
+    start = threading.Barrier(threads)
+
+    def worker():
+        start.wait()
+        while True:
+            try:
+                user_id = pending.get_nowait()
+            except queue.Empty:
+                return
+            with app.app_context():
+                began = time.perf_counter()
+                try:
+                    outcome = 'ordered' if place_order(user_id).ok else 'sold_out'
+                except CheckoutError:
+                    outcome = 'busy'
+                elapsed = time.perf_counter() - began
+            with lock:
+                outcomes[outcome] += 1
+                latencies.append(elapsed)
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    began = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return outcomes, latencies, time.perf_counter() - began
+
+
+def main():
+    args = parse_args()
+    app = make_app(args)
+    with app.app_context():
+        book_id, user_ids = seed(args)
+        url = db.engine.url.render_as_string(hide_password=True)
+
+    outcomes, latencies, elapsed = run(app, user_ids, args.threads)
+
+    with app.app_context():
+        final_stock = db.session.get(Book, book_id).stock_quantity
+        sold = db.session.query(db.func.coalesce(db.func.sum(OrderItem.quantity), 0)).scalar()
+
+    # Every buyer wants the same amount, so a remainder smaller than one cart stays unsold
+    sellable = args.stock - args.stock % args.quantity
+    expected_sold = min(sellable, args.buyers * args.quantity) if not outcomes['busy'] else None
+    latencies.sort()
+    print(f'database        {url}')
+    print(f'buyers          {args.buyers} x {args.quantity} copies, {args.stock} in stock, '
+          f'{args.threads} threads')
+    print(f'elapsed         {elapsed:.2f}s  ({len(latencies) / elapsed:,.0f} checkouts/s)')
+    print(f'latency         p50 {statistics.median(latencies) * 1000:.1f}ms  '
+          f'p95 {latencies[int(len(latencies) * 0.95) - 1] * 1000:.1f}ms  '
+          f'max {latencies[-1] * 1000:.1f}ms')
+    print(f'outcomes        {outcomes["ordered"]} ordered, {outcomes["sold_out"]} sold out, '
+          f'{outcomes["busy"]} gave up while the database was busy')
+    print(f'stock           {args.stock} -> {final_stock}, {sold} copies sold')
+
+    failures = []
+    if final_stock < 0:
+        failures.append('stock went negative')
+    if args.stock - final_stock != sold:
+        failures.append('copies sold do not match the stock decrement')
+    if sold != outcomes['ordered'] * args.quantity:
+        failures.append('order lines do not match the successful checkouts')
+    if expected_sold is not None and sold != expected_sold:
+        failures.append(f'expected {expected_sold} copies sold')
+    print(f'oversell        {max(sold - args.stock, 0)}')
+    for failure in failures:
+        print(f'FAIL: {failure}')
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,207 @@
+"""Mixed read/write throughput across database engine profiles
+
+Each profile runs in a fresh subprocess against its own scratch database
+seeded with a catalog and a set of logged-in users. ``--threads`` clients
+browse the catalog (home, category, book and search pages) and, with
+probability ``--write-ratio``, add to their cart or post a review, for
+``--duration`` seconds. The page cache is disabled so every read reaches
+the database.
+
+Profiles:
+
+- ``rollback-journal``: SQLite in its default journal mode, as before the
+  engine layer existed (writers block readers)
+- ``wal``: the shipped SQLITE_PRAGMAS (WAL, synchronous=NORMAL, larger
+  cache, mmap, busy timeout)
+- ``wal-replica``: WAL plus catalog reads routed to a replica bind. On
+  SQLite the "replica" is a second engine on the same file, so this
+  measures the routing overhead; pass ``--database`` and ``--replica`` to
+  compare a real primary/replica pair
+
+    python benchmarks/db_profiles.py
+    python benchmarks/db_profiles.py --threads 16 --duration 10 --write-ratio 0.3
+    python benchmarks/db_profiles.py --profiles wal-replica \\
+        --database postgresql://primary/bench --replica postgresql://replica/bench
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+PROFILES = ('rollback-journal', 'wal', 'wal-replica')
+
+SEARCH_TERMS = ('history', 'guide', 'photo', 'market', 'life', 'art', 'poems', 'world')
+
+PASSWORD = 'bench-password'
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--profiles', default=','.join(PROFILES),
+                        help='comma-separated profiles to run (default: all)')
+    parser.add_argument('--threads', type=int, default=8, help='concurrent clients (default 8)')
+    parser.add_argument('--duration', type=float, default=5.0, help='seconds per profile (default 5)')
+    parser.add_argument('--write-ratio', type=float, default=0.2,
+                        help='share of requests that write (default 0.2)')
+    parser.add_argument('--books', type=int, default=500, help='catalog size (default 500)')
+    parser.add_argument('--database', help='SQLAlchemy URL of a scratch primary (default: temporary SQLite)')
+    parser.add_argument('--replica', help='SQLAlchemy URL of its replica (for wal-replica)')
+    parser.add_argument('--json', dest='json_path', help='also write the results to this file')
+    parser.add_argument('--run-profile', help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def make_config(args, profile):
+    from config import Config
+
+    database = args.database or 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'profile_bench.db')
+
+    class BenchConfig(Config):
+        SQLALCHEMY_DATABASE_URI = database
+        WTF_CSRF_ENABLED = False
+        CACHE_TYPE = 'null'
+        METRICS_ENABLED = False
+        REPLICA_STICKY_SECONDS = 0
+
+    if profile == 'rollback-journal':
+        BenchConfig.SQLITE_PRAGMAS = {'journal_mode': 'DELETE', 'synchronous': 'FULL'}
+    if profile == 'wal-replica':
+        BenchConfig.DATABASE_REPLICA_URL = args.replica or database
+    return BenchConfig
+
+
+def seed(args, db):
+    from werkzeug.security import generate_password_hash
+    from app.models import BOOK_CATEGORIES, Book, User
+
+    db.drop_all()
+    db.create_all()
+    rng = random.Random(42)
+    db.session.execute(Book.__table__.insert(), [
+        {'title': f'{rng.choice(SEARCH_TERMS).title()} Book {i}', 'author': f'Author {i % 50}',
+         'price_npr': 200 + i % 700, 'category': BOOK_CATEGORIES[i % len(BOOK_CATEGORIES)],
+         'description': ' '.join(rng.choices(SEARCH_TERMS, k=20)), 'stock_quantity': 10 ** 6}
+        for i in range(args.books)
+    ])
+    # A cheap hash so logging the clients in does not dominate setup
+    password_hash = generate_password_hash(PASSWORD, method='pbkdf2:sha256:1000')
+    db.session.execute(User.__table__.insert(), [
+        {'username': f'bench{i}', 'email': f'bench{i}@example.com',
+         'password_hash': password_hash, 'is_admin': False}
+        for i in range(args.threads)
+    ])
+    db.session.commit()
+    if db.engine.dialect.name == 'sqlite':
+        from app import search
+        search.rebuild_index()
+
+
+def client_loop(app, args, index, deadline, results):
+    from app.models import BOOK_CATEGORIES
+
+    rng = random.Random(index)
+    client = app.test_client()
+    client.post('/login', data={'username': f'bench{index}', 'password': PASSWORD})
+    reads, writes, errors = [], [], 0
+    while time.perf_counter() < deadline:
+        book_id = rng.randint(1, args.books)
+        is_write = rng.random() < args.write_ratio
+        if is_write and rng.random() < 0.5:
+            send = lambda: client.post(f'/cart/add/{book_id}')
+        elif is_write:
+            send = lambda: client.post(f'/book/{book_id}/review',
+                                          data={'rating': str(rng.randint(1, 5)), 'review_text': 'bench'})
+        else:
+            url = rng.choice(['/', f'/category/{rng.choice(BOOK_CATEGORIES)}', f'/book/{book_id}',
+                              f'/search?q={rng.choice(SEARCH_TERMS)}'])
+            send = lambda: client.get(url)
+        began = time.perf_counter()
+        try:
+            status = send().status_code
+        except Exception:
+            status = 500
+        elapsed = time.perf_counter() - began
+        if status >= 500:
+            errors += 1
+        (writes if is_write else reads).append(elapsed)
+    results.append((reads, writes, errors))
+
+
+def run_profile(args, profile):
+    """Run one profile in this process and return its summary"""
+    from app import create_app, db
+
+    app = create_app(make_config(args, profile))
+    with app.app_context():
+        seed(args, db)
+
+    results = []
+    deadline = time.perf_counter() + args.duration
+    threads = [threading.Thread(target=client_loop, args=(app, args, i, deadline, results))
+               for i in range(args.threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    reads = sorted(t for r, _, _ in results for t in r)
+    writes = sorted(t for _, w, _ in results for t in w)
+
+    def p95(samples):
+        return samples[int(len(samples) * 0.95) - 1] * 1000 if samples else 0.0
+
+    return {
+        'profile': profile,
+        'reads_per_second': len(reads) / args.duration,
+        'writes_per_second': len(writes) / args.duration,
+        'read_p50_ms': statistics.median(reads) * 1000 if reads else 0.0,
+        'read_p95_ms': p95(reads),
+        'write_p50_ms': statistics.median(writes) * 1000 if writes else 0.0,
+        'write_p95_ms': p95(writes),
+        'errors': sum(e for _, _, e in results),
+    }
+
+
+def main():
+    args = parse_args()
+    if args.run_profile:
+        print(json.dumps(run_profile(args, args.run_profile)))
+        return 0
+
+    profiles = [p.strip() for p in args.profiles.split(',') if p.strip()]
+    unknown = set(profiles) - set(PROFILES)
+    if unknown:
+        sys.exit(f'Unknown profile(s): {", ".join(sorted(unknown))}')
+
+    summaries = []
+    for profile in profiles:
+        # The app registers its routes once per process, so each profile gets its own
+        output = subprocess.run([sys.executable, os.path.abspath(__file__), '--run-profile', profile,
+                                 *sys.argv[1:]], check=True, capture_output=True, text=True).stdout
+        summaries.append(json.loads(output.strip().splitlines()[-1]))
+
+    print(f'{args.threads} clients, {args.duration:.0f}s per profile, '
+          f'{args.write_ratio:.0%} writes, {args.books} books')
+    print(f'{"profile":<18}{"reads/s":>10}{"writes/s":>10}{"read p50":>10}{"read p95":>10}'
+          f'{"write p50":>11}{"write p95":>11}{"errors":>8}')
+    for s in summaries:
+        print(f'{s["profile"]:<18}{s["reads_per_second"]:>10,.0f}{s["writes_per_second"]:>10,.0f}'
+              f'{s["read_p50_ms"]:>8.1f}ms{s["read_p95_ms"]:>8.1f}ms'
+              f'{s["write_p50_ms"]:>9.1f}ms{s["write_p95_ms"]:>9.1f}ms{s["errors"]:>8}')
+    if args.json_path:
+        with open(args.json_path, 'w') as f:
+            json.dump(summaries, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
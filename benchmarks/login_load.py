@@ -0,0 +1,216 @@
+"""Login throughput versus catalog latency under concurrent load
+
+Each scenario runs in a fresh subprocess against a scratch SQLite database.
+``--login-threads`` clients log in over and over while ``--catalog-threads``
+clients browse book and category pages (page cache disabled), for
+``--duration`` seconds. Scenarios differ in PASSWORD_HASH_WORKERS:
+``inline`` gives every login thread its own worker, the equivalent of
+hashing on the request thread as the app used to, and a number caps the
+pool at that many concurrent hashes (excess logins queue, then get 503).
+
+The user lookup behind the login form (``username = ? OR email = ?``) is
+timed separately and its query plan printed.
+
+    python benchmarks/login_load.py
+    python benchmarks/login_load.py --scenarios inline,4,2,1 --login-threads 16
+    python benchmarks/login_load.py --method pbkdf2:sha256:600000
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+PASSWORD = 'bench-password'
+
+
+def parse_args():
+    from config import Config
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scenarios', default='inline,4,2',
+                        help="comma-separated hash pool sizes, 'inline' for one per login thread")
+    parser.add_argument('--login-threads', type=int, default=8, help='clients logging in (default 8)')
+    parser.add_argument('--catalog-threads', type=int, default=4, help='clients browsing (default 4)')
+    parser.add_argument('--duration', type=float, default=5.0, help='seconds per scenario (default 5)')
+    parser.add_argument('--method', default=Config.PASSWORD_HASH_METHOD,
+                        help=f'PASSWORD_HASH_METHOD (default {Config.PASSWORD_HASH_METHOD})')
+    parser.add_argument('--users', type=int, default=1000, help='registered users (default 1000)')
+    parser.add_argument('--json', dest='json_path', help='also write the results to this file')
+    parser.add_argument('--run-scenario', help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def make_app(args, workers):
+    from config import Config
+    from app import create_app
+
+    class BenchConfig(Config):
+        SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'login_bench.db')
+        WTF_CSRF_ENABLED = False
+        CACHE_TYPE = 'null'
+        METRICS_ENABLED = False
+        PASSWORD_HASH_METHOD = args.method
+        PASSWORD_HASH_WORKERS = workers
+        # inline: nothing waits, every login thread hashes at once
+        PASSWORD_HASH_QUEUE = 0 if workers >= args.login_threads else Config.PASSWORD_HASH_QUEUE
+
+    return create_app(BenchConfig)
+
+
+def seed(args, db):
+    from werkzeug.security import generate_password_hash
+    from app.models import BOOK_CATEGORIES, Book, User
+
+    db.create_all()
+    db.session.execute(Book.__table__.insert(), [
+        {'title': f'Book {i}', 'author': f'Author {i % 40}', 'price_npr': 300 + i,
+         'category': BOOK_CATEGORIES[i % len(BOOK_CATEGORIES)], 'stock_quantity': 10}
+        for i in range(400)
+    ])
+    # Every user shares one password, so a single hash seeds them all
+    password_hash = generate_password_hash(PASSWORD, method=args.method)
+    db.session.execute(User.__table__.insert(), [
+        {'username': f'reader{i}', 'email': f'reader{i}@example.com',
+         'password_hash': password_hash, 'is_admin': False}
+        for i in range(args.users)
+    ])
+    db.session.commit()
+
+
+def time_lookup(args, db):
+    """Time the login form's username-or-email lookup and return its plan"""
+    from sqlalchemy import or_
+    from app.models import User
+
+    rng = random.Random(1)
+    samples = []
+    for _ in range(2000):
+        ident = f'reader{rng.randrange(args.users)}'
+        if rng.random() < 0.5:
+            ident += '@example.com'
+        began = time.perf_counter()
+        User.query.filter(or_(User.username == ident, User.email == ident)).first()
+        samples.append(time.perf_counter() - began)
+    plan = []
+    if db.engine.dialect.name == 'sqlite':
+        plan = [row[-1] for row in db.session.execute(db.text(
+            'EXPLAIN QUERY PLAN SELECT * FROM users WHERE username = :v OR email = :v'), {'v': 'x'})]
+    return statistics.median(samples) * 1000, plan
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    if not samples:
+        return 0.0, 0.0
+    return statistics.median(samples) * 1000, samples[int(len(samples) * 0.95) - 1] * 1000
+
+
+def run_scenario(args, scenario):
+    from app import db
+
+    workers = args.login_threads if scenario == 'inline' else int(scenario)
+    app = make_app(args, workers)
+    with app.app_context():
+        seed(args, db)
+        lookup_ms, plan = time_lookup(args, db)
+
+    deadline = time.perf_counter() + args.duration
+    logins, rejected, catalog = [], [0], []
+    lock = threading.Lock()
+
+    def login_loop(index):
+        rng = random.Random(index)
+        while time.perf_counter() < deadline:
+            client = app.test_client()
+            began = time.perf_counter()
+            status = client.post('/login', data={'username': f'reader{rng.randrange(args.users)}',
+                                                 'password': PASSWORD}).status_code
+            elapsed = time.perf_counter() - began
+            with lock:
+                if status == 503:
+                    rejected[0] += 1
+                else:
+                    logins.append(elapsed)
+            if status == 503:
+                time.sleep(0.01)
+
+    def catalog_loop(index):
+        from app.models import BOOK_CATEGORIES
+        rng = random.Random(1000 + index)
+        client = app.test_client()
+        while time.perf_counter() < deadline:
+            url = rng.choice([f'/book/{rng.randint(1, 400)}', f'/category/{rng.choice(BOOK_CATEGORIES)}'])
+            began = time.perf_counter()
+            client.get(url)
+            with lock:
+                catalog.append(time.perf_counter() - began)
+
+    threads = ([threading.Thread(target=login_loop, args=(i,)) for i in range(args.login_threads)]
+               + [threading.Thread(target=catalog_loop, args=(i,)) for i in range(args.catalog_threads)])
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    app.extensions['password_hasher'].shutdown()
+
+    login_p50, login_p95 = percentiles(logins)
+    catalog_p50, catalog_p95 = percentiles(catalog)
+    return {
+        'scenario': scenario,
+        'hash_workers': workers,
+        'logins_per_second': len(logins) / args.duration,
+        'rejected_per_second': rejected[0] / args.duration,
+        'login_p50_ms': login_p50,
+        'login_p95_ms': login_p95,
+        'catalog_per_second': len(catalog) / args.duration,
+        'catalog_p50_ms': catalog_p50,
+        'catalog_p95_ms': catalog_p95,
+        'lookup_p50_ms': lookup_ms,
+        'lookup_plan': plan,
+    }
+
+
+def main():
+    args = parse_args()
+    if args.run_scenario:
+        print(json.dumps(run_scenario(args, args.run_scenario)))
+        return 0
+
+    summaries = []
+    for scenario in [s.strip() for s in args.scenarios.split(',') if s.strip()]:
+        if scenario != 'inline' and not scenario.isdigit():
+            sys.exit(f'Unknown scenario {scenario!r}')
+        # The app registers its routes once per process, so each scenario gets its own
+        output = subprocess.run([sys.executable, os.path.abspath(__file__), '--run-scenario', scenario,
+                                 *sys.argv[1:]], check=True, capture_output=True, text=True).stdout
+        summaries.append(json.loads(output.strip().splitlines()[-1]))
+
+    print(f'{args.login_threads} login + {args.catalog_threads} catalog clients, '
+          f'{args.duration:.0f}s per scenario, {args.method}')
+    print(f'{"scenario":<10}{"logins/s":>10}{"503/s":>8}{"login p50":>11}{"login p95":>11}'
+          f'{"catalog/s":>11}{"cat p50":>10}{"cat p95":>10}')
+    for s in summaries:
+        print(f'{s["scenario"]:<10}{s["logins_per_second"]:>10,.1f}{s["rejected_per_second"]:>8,.1f}'
+              f'{s["login_p50_ms"]:>9.1f}ms{s["login_p95_ms"]:>9.1f}ms{s["catalog_per_second"]:>11,.0f}'
+              f'{s["catalog_p50_ms"]:>8.1f}ms{s["catalog_p95_ms"]:>8.1f}ms')
+    if summaries:
+        print(f'user lookup (username OR email): p50 {summaries[0]["lookup_p50_ms"]:.3f}ms')
+        for line in summaries[0]['lookup_plan']:
+            print(f'  plan: {line}')
+    if args.json_path:
+        with open(args.json_path, 'w') as f:
+            json.dump(summaries, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
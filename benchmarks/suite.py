@@ -0,0 +1,438 @@
+"""Scenario benchmark suite with JSON results for comparing commits
+
+Seeds a scratch SQLite database with init_db.py's synthetic generator
+(skipped if ``--db`` already exists), then runs each scenario in a fresh
+subprocess. ``--threads`` clients run a weighted mix of operations for
+``--duration`` seconds. Book ids are drawn from a Zipf distribution, so
+hot books are hit most, as in real traffic.
+
+Operations: ``index``, ``category``, ``search``, ``book_detail``,
+``add_to_cart``, ``submit_review`` and ``login`` (a fresh session logging
+in each time). Scenarios are named mixes of those (see SCENARIOS).
+
+Modes:
+
+- ``client``: Flask's test client, in-process; measures the app alone
+- ``http``: a threaded werkzeug server in its own process, driven over
+  keep-alive HTTP connections; adds the WSGI server and sockets
+
+Throughput and latency percentiles are printed per scenario and
+operation. ``--json`` saves them with the commit and data set sizes, and
+``--compare`` checks a run against an earlier file, exiting non-zero when
+any operation's throughput or p95 latency regresses by more than
+``--threshold``.
+
+    python benchmarks/suite.py --books 20000 --users 2000 --reviews 200000 --json before.json
+    git checkout my-branch
+    python benchmarks/suite.py --db /tmp/bench.db --json after.json --compare before.json
+
+Scenarios with writes change the database. Reuse a ``--db`` only between
+runs you want to compare, or pass ``--reseed``. Page caching is off so
+every request reaches the database. Synthetic users keep their cheap
+generator hash; benchmarks/login_load.py covers real hashing costs.
+"""
+import argparse
+import http.client
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from http.cookies import SimpleCookie
+from urllib.parse import quote, urlencode
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+OPERATIONS = ('index', 'category', 'search', 'book_detail', 'add_to_cart', 'submit_review', 'login')
+
+# Scenario -> operation weights
+SCENARIOS = {
+    'browse': {'index': 2, 'category': 3, 'search': 2, 'book_detail': 5},
+    'shop': {'category': 3, 'search': 2, 'book_detail': 4, 'add_to_cart': 2},
+    'review': {'book_detail': 3, 'submit_review': 1},
+    'login': {'login': 1},
+    'mixed': {'index': 2, 'category': 3, 'search': 2, 'book_detail': 6, 'add_to_cart': 2,
+              'submit_review': 1, 'login': 1},
+}
+
+SEARCH_TERMS = ('river', 'empire', 'garden light', 'shadow', 'market', 'journey', 'atlas', 'secret')
+
+PERCENTILES = (50, 90, 95, 99)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS),
+                        help='comma-separated scenarios to run (default: all)')
+    parser.add_argument('--mode', choices=('client', 'http'), default='client',
+                        help='Flask test client or a real HTTP server (default client)')
+    parser.add_argument('--threads', type=int, default=8, help='concurrent clients (default 8)')
+    parser.add_argument('--duration', type=float, default=5.0, help='seconds per scenario (default 5)')
+    parser.add_argument('--db', help='SQLite file to use; seeded if missing (default: temporary)')
+    parser.add_argument('--reseed', action='store_true', help='rebuild --db even if it exists')
+    parser.add_argument('--books', type=int, default=5000, help='synthetic books (default 5000)')
+    parser.add_argument('--users', type=int, default=1000, help='synthetic users (default 1000)')
+    parser.add_argument('--reviews', type=int, default=50000, help='synthetic reviews (default 50000)')
+    parser.add_argument('--carts', type=int, default=200, help='synthetic carts (default 200)')
+    parser.add_argument('--seed', type=int, default=42, help='random seed (default 42)')
+    parser.add_argument('--json', dest='json_path', help='write the results to this file')
+    parser.add_argument('--compare', help='earlier results file to check for regressions')
+    parser.add_argument('--threshold', type=float, default=0.10,
+                        help='relative change counted as a regression (default 0.10)')
+    parser.add_argument('--run-scenario', help=argparse.SUPPRESS)
+    parser.add_argument('--seed-only', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--serve', action='store_true', help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def make_app(db_path):
+    from config import Config
+    from app import create_app
+    from init_db import SYNTHETIC_HASH_METHOD
+
+    class BenchConfig(Config):
+        SQLALCHEMY_DATABASE_URI = 'sqlite:///' + db_path
+        WTF_CSRF_ENABLED = False
+        CACHE_TYPE = 'null'
+        METRICS_ENABLED = False
+        REPLICA_STICKY_SECONDS = 0
+        # Matches the seeded hashes, so logins are not upgraded to scrypt
+        PASSWORD_HASH_METHOD = SYNTHETIC_HASH_METHOD
+
+    return create_app(BenchConfig)
+
+
+def seed(args):
+    from app import db
+    from init_db import generate_synthetic
+
+    if os.path.exists(args.db):
+        os.remove(args.db)
+    app = make_app(args.db)
+    with app.app_context():
+        db.create_all()
+        generate_synthetic(args.books, args.users, args.reviews, args.carts, seed=args.seed)
+
+
+def dataset_sizes(db_path):
+    import sqlite3
+
+    with sqlite3.connect(db_path) as conn:
+        return {table: conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+                for table in ('books', 'users', 'reviews', 'cart')}
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, check=True,
+                              capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# ---- clients ----
+
+class TestClient:
+    """Flask test client with the HttpClient interface"""
+
+    def __init__(self, app):
+        self._app = app
+        self._client = app.test_client()
+
+    def get(self, path):
+        return self._client.get(path).status_code
+
+    def post(self, path, data=None):
+        return self._client.post(path, data=data or {}).status_code
+
+    def fresh(self):
+        return TestClient(self._app)
+
+
+class HttpClient:
+    """Keep-alive HTTP connection that remembers cookies, without following redirects"""
+
+    def __init__(self, port):
+        self._port = port
+        self._conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        self._cookies = SimpleCookie()
+
+    def _request(self, method, path, body=None):
+        headers = {}
+        if self._cookies:
+            headers['Cookie'] = '; '.join(f'{k}={m.value}' for k, m in self._cookies.items())
+        if body is not None:
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        try:
+            self._conn.request(method, path, body=body, headers=headers)
+            response = self._conn.getresponse()
+        except (http.client.HTTPException, OSError):
+            # The server closed an idle connection; retry once on a new one
+            self._conn.close()
+            self._conn.request(method, path, body=body, headers=headers)
+            response = self._conn.getresponse()
+        response.read()
+        for header in response.headers.get_all('Set-Cookie') or ():
+            self._cookies.load(header)
+        return response.status
+
+    def get(self, path):
+        return self._request('GET', path)
+
+    def post(self, path, data=None):
+        return self._request('POST', path, urlencode(data or {}))
+
+    def fresh(self):
+        return HttpClient(self._port)
+
+
+# ---- scenarios ----
+
+class Workload:
+    """Picks operations and their targets for one client"""
+
+    def __init__(self, scenario, book_ids, user_count, rng):
+        from app.models import BOOK_CATEGORIES
+        from init_db import zipf_sampler
+
+        self.rng = rng
+        self.operations = list(SCENARIOS[scenario])
+        self.weights = list(SCENARIOS[scenario].values())
+        self.categories = BOOK_CATEGORIES
+        self.user_count = user_count
+        self.book_ids = book_ids[:]
+        rng.shuffle(self.book_ids)
+        self.draw = zipf_sampler(len(self.book_ids), 1.1, rng)
+
+    def book(self):
+        return self.book_ids[self.draw()]
+
+    def request(self, client, operation):
+        from init_db import SYNTHETIC_PASSWORD
+
+        rng = self.rng
+        if operation == 'index':
+            return client.get('/')
+        if operation == 'category':
+            return client.get(f'/category/{quote(rng.choice(self.categories))}')
+        if operation == 'search':
+            return client.get('/search?' + urlencode({'q': rng.choice(SEARCH_TERMS)}))
+        if operation == 'book_detail':
+            return client.get(f'/book/{self.book()}')
+        if operation == 'add_to_cart':
+            return client.post(f'/cart/add/{self.book()}')
+        if operation == 'submit_review':
+            return client.post(f'/book/{self.book()}/review',
+                               data={'rating': str(rng.randint(1, 5)), 'review_text': 'Benchmark review'})
+        if operation == 'login':
+            return client.fresh().post('/login', data={
+                'username': f'user{rng.randrange(self.user_count)}', 'password': SYNTHETIC_PASSWORD})
+        raise ValueError(operation)
+
+
+def client_loop(client, workload, index, deadline, results):
+    from init_db import SYNTHETIC_PASSWORD
+
+    samples = {operation: [] for operation in OPERATIONS}
+    errors = dict.fromkeys(OPERATIONS, 0)
+    client.post('/login', data={'username': f'user{index % workload.user_count}',
+                                'password': SYNTHETIC_PASSWORD})
+    while time.perf_counter() < deadline:
+        operation = workload.rng.choices(workload.operations, workload.weights)[0]
+        began = time.perf_counter()
+        try:
+            status = workload.request(client, operation)
+        except Exception:
+            status = 599
+        samples[operation].append(time.perf_counter() - began)
+        if status >= 500:
+            errors[operation] += 1
+    results.append((samples, errors))
+
+
+def percentile(sorted_samples, pct):
+    if not sorted_samples:
+        return 0.0
+    return sorted_samples[min(len(sorted_samples) - 1, int(len(sorted_samples) * pct / 100))]
+
+
+def summarize(samples, errors, duration):
+    summary = {}
+    for operation, times in samples.items():
+        if not times:
+            continue
+        times = sorted(times)
+        stats = {'requests': len(times), 'per_second': len(times) / duration,
+                 'errors': errors[operation], 'max_ms': times[-1] * 1000}
+        for pct in PERCENTILES:
+            stats[f'p{pct}_ms'] = percentile(times, pct) * 1000
+        summary[operation] = stats
+    everything = sorted(t for times in samples.values() for t in times)
+    summary['total'] = {'requests': len(everything), 'per_second': len(everything) / duration,
+                        'errors': sum(errors.values()),
+                        'max_ms': everything[-1] * 1000 if everything else 0.0,
+                        **{f'p{pct}_ms': percentile(everything, pct) * 1000 for pct in PERCENTILES}}
+    return summary
+
+
+def start_server(args):
+    """Launch the HTTP server subprocess and return it with its port"""
+    server = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--serve', '--db', args.db],
+                              stdout=subprocess.PIPE, text=True)
+    line = server.stdout.readline()
+    if not line.startswith('PORT '):
+        server.kill()
+        sys.exit('Benchmark server failed to start')
+    return server, int(line.split()[1])
+
+
+def serve(args):
+    from werkzeug.serving import WSGIRequestHandler, make_server
+
+    WSGIRequestHandler.protocol_version = 'HTTP/1.1'
+    WSGIRequestHandler.log_request = lambda *a, **k: None
+    server = make_server('127.0.0.1', 0, make_app(args.db), threaded=True)
+    print(f'PORT {server.server_port}', flush=True)
+    server.serve_forever()
+
+
+def run_scenario(args, scenario):
+    """Run one scenario in this process and return its summary"""
+    from app import db
+    from app.models import Book, User
+
+    app = make_app(args.db)
+    with app.app_context():
+        book_ids = [book_id for (book_id,) in db.session.query(Book.id)]
+        user_count = User.query.filter(User.username.like('user%')).count()
+
+    server = None
+    if args.mode == 'http':
+        server, port = start_server(args)
+        make_client = lambda: HttpClient(port)
+    else:
+        make_client = lambda: TestClient(app)
+
+    results = []
+    deadline = time.perf_counter() + args.duration
+    threads = [threading.Thread(target=client_loop, args=(
+        make_client(), Workload(scenario, book_ids, user_count, random.Random(args.seed + i)),
+        i, deadline, results)) for i in range(args.threads)]
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        if server is not None:
+            server.kill()
+
+    samples = {operation: [t for thread_samples, _ in results for t in thread_samples[operation]]
+               for operation in OPERATIONS}
+    errors = {operation: sum(thread_errors[operation] for _, thread_errors in results)
+              for operation in OPERATIONS}
+    return summarize(samples, errors, args.duration)
+
+
+# ---- reporting ----
+
+def print_results(results):
+    print(f'{"scenario":<10}{"operation":<15}{"req/s":>9}{"p50":>9}{"p90":>9}{"p95":>9}'
+          f'{"p99":>9}{"max":>9}{"errors":>8}')
+    for scenario, operations in results.items():
+        for operation, s in operations.items():
+            print(f'{scenario:<10}{operation:<15}{s["per_second"]:>9,.1f}'
+                  + ''.join(f'{s[key]:>7.1f}ms' for key in ('p50_ms', 'p90_ms', 'p95_ms', 'p99_ms', 'max_ms'))
+                  + f'{s["errors"]:>8}')
+
+
+def compare(results, baseline, threshold):
+    """Print changes against a baseline; return the regressions found"""
+    regressions = []
+    print(f'\nCompared with {baseline["meta"].get("commit") or "baseline"} '
+          f'({baseline["meta"].get("timestamp", "?")}):')
+    for scenario, operations in results.items():
+        for operation, s in operations.items():
+            before = baseline['results'].get(scenario, {}).get(operation)
+            if not before or not before['per_second'] or not before['p95_ms']:
+                continue
+            throughput = s['per_second'] / before['per_second'] - 1
+            latency = s['p95_ms'] / before['p95_ms'] - 1
+            flag = ''
+            if throughput < -threshold or latency > threshold:
+                flag = '  REGRESSION'
+                regressions.append((scenario, operation))
+            print(f'  {scenario:<10}{operation:<15}req/s {throughput:+7.1%}   p95 {latency:+7.1%}{flag}')
+    return regressions
+
+
+def main():
+    args = parse_args()
+    if args.serve:
+        serve(args)
+        return 0
+    if args.seed_only:
+        seed(args)
+        return 0
+    if args.run_scenario:
+        print(json.dumps(run_scenario(args, args.run_scenario)))
+        return 0
+
+    scenarios = [s.strip() for s in args.scenarios.split(',') if s.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        sys.exit(f'Unknown scenario(s): {", ".join(sorted(unknown))}')
+    if args.users < args.threads:
+        sys.exit('--users must be at least --threads')
+
+    if args.db is None:
+        args.db = os.path.join(tempfile.mkdtemp(), 'suite_bench.db')
+    args.db = os.path.abspath(args.db)
+    if args.reseed or not os.path.exists(args.db):
+        # Seeding runs in its own process too, since the app registers its routes once
+        subprocess.run([sys.executable, os.path.abspath(__file__), *sys.argv[1:],
+                        '--db', args.db, '--seed-only'], check=True,
+                       stdout=subprocess.DEVNULL)
+
+    results = {}
+    for scenario in scenarios:
+        output = subprocess.run([sys.executable, os.path.abspath(__file__), *sys.argv[1:],
+                                 '--db', args.db, '--run-scenario', scenario],
+                                check=True, capture_output=True, text=True).stdout
+        results[scenario] = json.loads(output.strip().splitlines()[-1])
+
+    sizes = dataset_sizes(args.db)
+    print(f'{args.mode} mode, {args.threads} clients, {args.duration:.0f}s per scenario; '
+          + ', '.join(f'{count:,} {table}' for table, count in sizes.items()))
+    print_results(results)
+
+    report = {
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'mode': args.mode, 'threads': args.threads, 'duration': args.duration,
+            'seed': args.seed, 'dataset': sizes,
+        },
+        'results': results,
+    }
+    if args.json_path:
+        with open(args.json_path, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
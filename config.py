@@ -10,6 +10,28 @@ class Config:
         'sqlite:///' + os.path.join(os.path.abspath(os.path.dirname(__file__)), 'bookstore.db')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     
+    # Run on every new SQLite connection. WAL lets readers proceed while a
+    # review or cart write is in progress; cache_size is in KiB when negative
+    SQLITE_PRAGMAS = {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'cache_size': -64000,
+        'mmap_size': 268435456,
+        'busy_timeout': 5000,
+    }
+    
+    # Connection pool for server databases (ignored for SQLite files)
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE') or 10)
+    DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW') or 20)
+    DB_POOL_TIMEOUT = 30
+    DB_POOL_RECYCLE = 1800
+    DB_POOL_PRE_PING = True
+    
+    # Optional read replica for the catalog views; a user's reads stay on
+    # the primary for REPLICA_STICKY_SECONDS after they write something
+    DATABASE_REPLICA_URL = os.environ.get('DATABASE_REPLICA_URL')
+    REPLICA_STICKY_SECONDS = 5
+    
     # WTForms configuration
     WTF_CSRF_ENABLED = True
     WTF_CSRF_TIME_LIMIT = None
@@ -21,3 +43,87 @@ class Config:
     
     # Pagination
     BOOKS_PER_PAGE = 20
+    REVIEWS_PER_PAGE = 10
+    # Days of new users and reviews charted on the admin dashboard
+    STATS_SERIES_DAYS = 30
+    
+    # Page cache for anonymous catalog pages: 'memory', 'sqlite' (shared by
+    # all workers on the host) or 'null'. Its invalidation counters are kept
+    # in CACHE_SQLITE_PATH whatever the type, so every worker sees them
+    CACHE_TYPE = os.environ.get('CACHE_TYPE') or 'memory'
+    CACHE_DEFAULT_TIMEOUT = 300
+    CACHE_THRESHOLD = 1000
+    CACHE_SQLITE_PATH = os.environ.get('CACHE_SQLITE_PATH') or \
+        os.path.join(os.path.abspath(os.path.dirname(__file__)), 'page_cache.db')
+    
+    # Request timing instrumentation (Server-Timing header, /admin/metrics)
+    METRICS_ENABLED = True
+    # Bearer token that lets a Prometheus scraper read /admin/metrics/prometheus
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+    
+    # Password hashing runs on a bounded pool (app/passwords.py). Any
+    # werkzeug method spec works, e.g. 'pbkdf2:sha256:600000'; stored hashes
+    # with other parameters are upgraded on the user's next login
+    PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD') or 'scrypt:32768:8:1'
+    PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS') or 4)
+    # Hashes allowed to wait for a worker before logins get a 503
+    PASSWORD_HASH_QUEUE = 32
+    PASSWORD_HASH_TIMEOUT = 10
+    
+    # Per-process cache of logged-in users' identities (app/identity.py),
+    # invalidated through the page cache's shared counters; 0 disables it
+    IDENTITY_CACHE_SIZE = 10000
+    IDENTITY_CACHE_TIMEOUT = 300
+    
+    # Local cover images (app/images.py). Variants are rendered by
+    # background jobs
+    COVER_STORAGE_DIR = os.environ.get('COVER_STORAGE_DIR') or \
+        os.path.join(os.path.abspath(os.path.dirname(__file__)), 'media', 'covers')
+    COVER_MAX_BYTES = 5 * 1024 * 1024
+    COVER_FETCH_TIMEOUT = 15
+    # Largest request body accepted (cover uploads)
+    MAX_CONTENT_LENGTH = 8 * 1024 * 1024
+    
+    # JSON API (app/api.py): default and largest page size, and the most
+    # ids one batch lookup may ask for
+    API_PAGE_SIZE = 20
+    API_MAX_PAGE_SIZE = 100
+    API_MAX_BATCH = 100
+    
+    # How often each process's search suggestion index (app/typeahead.py)
+    # picks up books changed by other processes
+    TYPEAHEAD_SYNC_SECONDS = 5
+    
+    # "Readers also liked" lists (app/recommendations.py): neighbours kept
+    # per book, the fewest shared readers a pair needs, and the least time
+    # between background refreshes after reviews (None turns those off)
+    RECOMMENDATIONS_PER_BOOK = 6
+    RECOMMENDATIONS_MIN_COREADERS = 2
+    RECOMMENDATIONS_REFRESH_SECONDS = 300
+    
+    # Background jobs (app/jobs.py): worker threads each web process starts
+    # on its first enqueue (0 when `flask --app run run-jobs` workers run),
+    # attempts before a job is marked failed, the first retry delay (doubled
+    # per attempt), how long a job may run before another worker takes it
+    # over, and how often idle workers look for due jobs
+    JOBS_IN_PROCESS_WORKERS = int(os.environ.get('JOBS_IN_PROCESS_WORKERS') or 2)
+    JOBS_MAX_ATTEMPTS = 5
+    JOBS_RETRY_SECONDS = 30
+    JOBS_LEASE_SECONDS = 600
+    JOBS_POLL_SECONDS = 1
+    
+    # Seconds a front proxy may serve an anonymous catalog page before
+    # revalidating it (app/http_cache.py); browsers always revalidate
+    HTTP_CACHE_SHARED_MAX_AGE = 60
+    
+    # Serve static files through the manifest written by `flask build-assets`
+    # (hashed names, precompressed copies, immutable caching). Without a
+    # built manifest, files are served from app/static as-is
+    USE_ASSET_MANIFEST = os.environ.get('USE_ASSET_MANIFEST', '1') != '0'
+    
+    # Attempts at a checkout transaction before giving up when the database
+    # is locked by other buyers (SQLite) or a deadlock is reported
+    CHECKOUT_RETRIES = 5
+    
+    # Fail views that exceed their @query_budget (always on when TESTING)
+    QUERY_BUDGET_ENFORCE = os.environ.get('QUERY_BUDGET_ENFORCE') == '1'
@@ -2,12 +2,160 @@
 """
 Database Initialization Script for Heaven Bookstore
 Creates tables and populates with sample data
+
+Optionally adds a deterministic synthetic catalog on top for load testing:
+
+    python init_db.py --books 100000 --users 20000 --reviews 2000000 --carts 5000
+
+Synthetic users are named user<N> and all share SYNTHETIC_PASSWORD.
 """
+import argparse
+import bisect
+import itertools
+import random
+from datetime import datetime, timedelta
+
+from werkzeug.security import generate_password_hash
+
+from app import create_app, db, search, stats
+from app.models import BOOK_CATEGORIES, Book, Cart, Review, User
+
+SYNTHETIC_PASSWORD = 'password123'
+# Cheap on purpose: hashing a million passwords with scrypt would take hours
+SYNTHETIC_HASH_METHOD = 'pbkdf2:sha256:1000'
+# Fixed so the same seed always produces the same rows
+SYNTHETIC_EPOCH = datetime(2024, 1, 1)
+
+TITLE_WORDS = ['Silent', 'River', 'Empire', 'Garden', 'Light', 'Shadow', 'Market', 'Journey',
+               'Mountain', 'Letters', 'City', 'Ocean', 'Memory', 'Atlas', 'Portrait', 'Habit',
+               'Fortune', 'Winter', 'Voices', 'Stranger', 'Lens', 'Grammar', 'Origins', 'Secret']
+FIRST_NAMES = ['Aarav', 'Maya', 'Sita', 'James', 'Elena', 'Kenji', 'Amara', 'Luca', 'Priya', 'Omar']
+LAST_NAMES = ['Shrestha', 'Gurung', 'Smith', 'Tanaka', 'Okafor', 'Rossi', 'Sharma', 'Haddad']
+REVIEW_TEXTS = ['Could not put it down.', 'Solid, if a little long.', 'Not for me.',
+                'Beautifully written.', 'A useful reference.', 'Worth every rupee.', None]
+# Ratings skew positive, as on most bookshops
+RATING_WEIGHTS = [4, 6, 15, 35, 40]
+
+
+def zipf_sampler(n, s, rng):
+    """Return a function drawing ranks 0..n-1 with probability proportional to 1/(rank+1)^s"""
+    cumulative = list(itertools.accumulate(1.0 / (rank + 1) ** s for rank in range(n)))
+    total = cumulative[-1]
+    return lambda: min(bisect.bisect_left(cumulative, rng.random() * total), n - 1)
+
+
+def zipf_allocation(total, n, s, cap):
+    """Split ``total`` over ``n`` ranks by 1/(rank+1)^s, at most ``cap`` each
+
+    Ranks that would exceed the cap get exactly ``cap`` and their excess is
+    spread over the rest, so the counts still add up to ``total`` (less
+    rounding) whenever ``n * cap`` allows it.
+    """
+    weights = [1.0 / (rank + 1) ** s for rank in range(n)]
+    remaining_weight = sum(weights)
+    capped = 0
+    # Weights fall with rank, so the capped ranks are a prefix
+    while capped < n and weights[capped] * (total - capped * cap) / remaining_weight > cap:
+        remaining_weight -= weights[capped]
+        capped += 1
+    scale = (total - capped * cap) / remaining_weight if remaining_weight else 0
+    return [cap] * capped + [round(w * scale) for w in weights[capped:]]
+
+
+def _insert_batches(table, rows, batch_size, label):
+    batch, written = [], 0
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            db.session.execute(table.insert(), batch)
+            db.session.commit()
+            written += len(batch)
+            batch = []
+            print(f"  {written:,} {label}", end='\r', flush=True)
+    if batch:
+        db.session.execute(table.insert(), batch)
+        db.session.commit()
+        written += len(batch)
+    print(f"  {written:,} {label}")
+    return written
+
+
+def generate_synthetic(books=0, users=0, reviews=0, carts=0, seed=42, zipf=1.1, batch_size=10000):
+    """Append a deterministic synthetic data set to the current database
+
+    Books are spread evenly over the categories. Review counts per book
+    follow a Zipf distribution over a shuffled popularity ranking, so a few
+    books carry most reviews; no user reviews a book twice. Carts hold one
+    to five popular books each. Rating aggregates, the search index and the
+    dashboard statistics are rebuilt at the end. Needs an app context.
+    """
+    with stats.bulk_load():
+        rng = random.Random(seed)
+
+        if books:
+            print(f"Adding {books:,} synthetic books...")
+            def book_rows():
+                for i in range(books):
+                    created = SYNTHETIC_EPOCH + timedelta(minutes=i)
+                    yield {
+                        'isbn': f'979{seed % 1000:03d}{i:07d}',
+                        'title': ' '.join(rng.sample(TITLE_WORDS, rng.randint(2, 4))),
+                        'author': f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}',
+                        'price_npr': float(rng.randrange(300, 4000, 25)),
+                        'category': BOOK_CATEGORIES[i % len(BOOK_CATEGORIES)],
+                        'description': ' '.join(rng.choices(TITLE_WORDS, k=30)).capitalize() + '.',
+                        'stock_quantity': rng.choice([0, 5, 20, 50, 100, 1000]),
+                        'created_at': created,
+                        'updated_at': created,
+                    }
+            _insert_batches(Book.__table__, book_rows(), batch_size, 'books')
+
+        if users:
+            print(f"Adding {users:,} synthetic users...")
+            password_hash = generate_password_hash(SYNTHETIC_PASSWORD, method=SYNTHETIC_HASH_METHOD)
+            user_rows = ({'username': f'user{i}', 'email': f'user{i}@example.com',
+                          'password_hash': password_hash, 'is_admin': False,
+                          'created_at': SYNTHETIC_EPOCH + timedelta(seconds=i)}
+                         for i in range(users))
+            _insert_batches(User.__table__, user_rows, batch_size, 'users')
+
+        book_ids = [book_id for (book_id,) in db.session.query(Book.id).order_by(Book.id)]
+        user_ids = [user_id for (user_id,) in db.session.query(User.id).order_by(User.id)]
+        popularity = book_ids[:]
+        rng.shuffle(popularity)
 
-from app import create_app, db
-from app.models import User, Book
+        if reviews and book_ids and user_ids:
+            print(f"Adding {reviews:,} synthetic reviews...")
+            counts = zipf_allocation(reviews, len(popularity), zipf, len(user_ids))
+            def review_rows():
+                for book_id, count in zip(popularity, counts):
+                    for user_id in rng.sample(user_ids, count):
+                        yield {
+                            'user_id': user_id, 'book_id': book_id,
+                            'rating': rng.choices(range(1, 6), RATING_WEIGHTS)[0],
+                            'review_text': rng.choice(REVIEW_TEXTS),
+                            'created_at': SYNTHETIC_EPOCH + timedelta(seconds=rng.randrange(365 * 86400)),
+                        }
+            _insert_batches(Review.__table__, review_rows(), batch_size, 'reviews')
+            print("Recomputing rating aggregates...")
+            Book.rebuild_rating_aggregates()
 
-def init_database():
+        if carts and book_ids and user_ids:
+            print(f"Adding {min(carts, len(user_ids)):,} synthetic carts...")
+            draw = zipf_sampler(len(popularity), zipf, rng)
+            def cart_rows():
+                for user_id in rng.sample(user_ids, min(carts, len(user_ids))):
+                    for book_id in {popularity[draw()] for _ in range(rng.randint(1, 5))}:
+                        yield {'user_id': user_id, 'book_id': book_id, 'quantity': rng.randint(1, 3),
+                               'added_at': SYNTHETIC_EPOCH + timedelta(seconds=rng.randrange(365 * 86400))}
+            _insert_batches(Cart.__table__, cart_rows(), batch_size, 'cart lines')
+
+        if (books or reviews) and db.engine.dialect.name == 'sqlite':
+            print("Rebuilding search index...")
+            search.rebuild_index()
+
+
+def init_database(books=0, users=0, reviews=0, carts=0, seed=42):
     """Initialize database with tables and sample data"""
     app = create_app()
     
@@ -188,6 +336,14 @@ def init_database():
         # Commit all books
         db.session.commit()
         
+        # Build the full-text search index
+        if db.engine.dialect.name == 'sqlite':
+            print("Building search index...")
+            search.rebuild_index()
+        
+        if books or users or reviews or carts:
+            generate_synthetic(books, users, reviews, carts, seed=seed)
+        
         print(f"\n{'='*50}")
         print("Database initialization complete!")
         print(f"{'='*50}")
@@ -199,8 +355,22 @@ def init_database():
         print(f"\nTest User Credentials:")
         print(f"  Username: john_doe")
         print(f"  Password: password123")
+        if users:
+            print(f"\nSynthetic users: user0 .. user{users - 1} / {SYNTHETIC_PASSWORD}")
         print(f"{'='*50}\n")
 
 
+def parse_args():
+    parser = argparse.ArgumentParser(description='Create the database with sample data.')
+    parser.add_argument('--books', type=int, default=0, help='synthetic books to add (default 0)')
+    parser.add_argument('--users', type=int, default=0, help='synthetic users to add (default 0)')
+    parser.add_argument('--reviews', type=int, default=0,
+                        help='synthetic reviews to add, Zipf-distributed over books (default 0)')
+    parser.add_argument('--carts', type=int, default=0, help='synthetic users with a cart (default 0)')
+    parser.add_argument('--seed', type=int, default=42, help='random seed (default 42)')
+    return parser.parse_args()
+
+
 if __name__ == '__main__':
-    init_database()
+    args = parse_args()
+    init_database(args.books, args.users, args.reviews, args.carts, args.seed)
@@ -0,0 +1,72 @@
+import pytest
+from flask.testing import FlaskClient
+
+from app import create_app, db
+from app.models import BOOK_CATEGORIES, Book, User
+from config import Config
+
+
+class Client(FlaskClient):
+    """Runs each request in its own app context, with its own ``g`` and session, as a server would"""
+
+    def open(self, *args, **kwargs):
+        with self.application.app_context():
+            return super().open(*args, **kwargs)
+
+
+@pytest.fixture(scope='session')
+def _app(tmp_path_factory):
+    # Views register on the first app created, so one app serves every test
+    tmp_path = tmp_path_factory.mktemp('bookstore')
+
+    class TestConfig(Config):
+        TESTING = True
+        SQLALCHEMY_DATABASE_URI = f'sqlite:///{tmp_path / "bookstore.db"}'
+        CACHE_SQLITE_PATH = str(tmp_path / 'page_cache.db')
+        COVER_STORAGE_DIR = str(tmp_path / 'covers')
+        WTF_CSRF_ENABLED = False
+        JOBS_IN_PROCESS_WORKERS = 0
+        USE_ASSET_MANIFEST = False
+
+    app = create_app(TestConfig)
+    app.test_client_class = Client
+    return app
+
+
+@pytest.fixture
+def app(_app):
+    """The app with empty tables and caches"""
+    with _app.app_context():
+        db.create_all()
+        _app.extensions['page_cache'].clear()
+        _app.extensions['identity_cache'].clear()
+        yield _app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+def make_user(username='reader', **kwargs):
+    user = User(username=username, email=f'{username}@example.com', password_hash='x', **kwargs)
+    db.session.add(user)
+    db.session.commit()
+    return user
+
+
+def make_books(count, **kwargs):
+    books = [Book(isbn=f'978{n:010d}', title=f'Book {n}', author=f'Author {n}', price_npr=100.0 + n,
+                  category=BOOK_CATEGORIES[n % len(BOOK_CATEGORIES)], stock_quantity=10, **kwargs)
+             for n in range(count)]
+    db.session.add_all(books)
+    db.session.commit()
+    return books
+
+
+def log_in(client, user):
+    with client.session_transaction() as session:
+        session['_user_id'] = user.get_id()
+        session['_fresh'] = True
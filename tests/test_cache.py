@@ -0,0 +1,30 @@
+from app import db
+from app.cache import SQLiteCounters
+from app.models import Book
+from tests.conftest import make_books
+
+
+def other_process_counters(app):
+    # A fresh connection to the counters file, as another worker would have
+    return SQLiteCounters(app.config['CACHE_SQLITE_PATH'])
+
+
+def test_page_cache_hit(app, client):
+    book = make_books(1)[0]
+    assert client.get(f'/book/{book.id}').headers['X-Cache'] == 'MISS'
+    assert client.get(f'/book/{book.id}').headers['X-Cache'] == 'HIT'
+
+
+def test_invalidation_from_another_process_reaches_the_memory_cache(app, client):
+    assert app.config['CACHE_TYPE'] == 'memory'
+    book = make_books(1)[0]
+    client.get(f'/book/{book.id}')
+
+    # Another worker changes the price and invalidates the page
+    db.session.execute(db.update(Book).where(Book.id == book.id).values(price_npr=4321.0))
+    db.session.commit()
+    other_process_counters(app).incr(f'gen:book:{book.id}')
+
+    response = client.get(f'/book/{book.id}')
+    assert response.headers['X-Cache'] == 'MISS'
+    assert b'4321.00' in response.data
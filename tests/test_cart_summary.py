@@ -0,0 +1,51 @@
+from app import db
+from app.cache import SQLiteCounters
+from app.models import Book, Cart
+from tests.conftest import log_in, make_books, make_user
+
+
+def test_adding_updates_the_badge_in_place(app, client):
+    user = make_user()
+    book = make_books(1)[0]
+    log_in(client, user)
+    client.get('/profile')
+
+    response = client.post(f'/cart/add/{book.id}', headers={'X-Requested-With': 'XMLHttpRequest'})
+
+    assert response.get_json()['cart_count'] == 1
+
+
+def test_summary_reloads_after_a_change_from_another_device(app, client):
+    user = make_user()
+    first, second = make_books(2)
+    log_in(client, user)
+    response = client.post(f'/cart/add/{first.id}', headers={'X-Requested-With': 'XMLHttpRequest'})
+    assert response.get_json()['cart_count'] == 1
+
+    # Another device, served by another worker, adds a second book
+    other_device = app.test_client()
+    log_in(other_device, user)
+    response = other_device.post(f'/cart/add/{second.id}', headers={'X-Requested-With': 'XMLHttpRequest'})
+    assert response.get_json()['cart_count'] == 2
+
+    response = client.post(f'/cart/add/{first.id}', headers={'X-Requested-With': 'XMLHttpRequest'})
+    assert response.get_json()['cart_count'] == 2
+    with client.session_transaction() as session:
+        assert session['cart_summary']['subtotal'] == 2 * first.price_npr + second.price_npr
+
+
+def test_summary_reloads_after_a_catalog_change(app, client):
+    user = make_user()
+    book = make_books(1)[0]
+    log_in(client, user)
+    client.post(f'/cart/add/{book.id}', headers={'X-Requested-With': 'XMLHttpRequest'})
+
+    # An admin in another worker deletes the book
+    db.session.execute(db.delete(Cart).where(Cart.book_id == book.id))
+    db.session.execute(db.delete(Book).where(Book.id == book.id))
+    db.session.commit()
+    SQLiteCounters(app.config['CACHE_SQLITE_PATH']).incr('gen:catalog')
+
+    client.get('/profile')
+    with client.session_transaction() as session:
+        assert session['cart_summary']['count'] == 0
@@ -0,0 +1,16 @@
+from app import db
+from app.models import Cart
+from tests.conftest import log_in, make_books, make_user
+
+
+def test_saved_quantities_are_capped_at_stock(app, client):
+    user = make_user()
+    book = make_books(1)[0]
+    log_in(client, user)
+    client.post(f'/cart/add/{book.id}', headers={'X-Requested-With': 'XMLHttpRequest'})
+    item = Cart.query.filter_by(user_id=user.id).one()
+
+    client.post('/cart/update', data={f'quantity-{item.id}': '500'})
+
+    assert db.session.scalar(db.select(Cart.quantity).where(Cart.id == item.id)) == book.stock_quantity
+    assert client.post(f'/cart/update/{item.id}', data={'quantity': '500'}).status_code == 404
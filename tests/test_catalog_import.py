@@ -0,0 +1,47 @@
+import csv
+
+from app.catalog_import import _save_checkpoint, import_catalog, source_fingerprint
+from app.models import Book
+
+
+def write_feed(path, first_isbn, rows):
+    with open(path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, ['isbn', 'title', 'author', 'price_npr', 'category', 'stock_quantity'])
+        writer.writeheader()
+        for n in range(rows):
+            writer.writerow({'isbn': str(first_isbn + n), 'title': f'Title {n}', 'author': 'Author',
+                             'price_npr': '500', 'category': 'Reference', 'stock_quantity': '3'})
+
+
+def test_resume_skips_rows_recorded_for_the_same_file(app, tmp_path):
+    feed = str(tmp_path / 'feed.csv')
+    write_feed(feed, 9780000000000, 5)
+    _save_checkpoint(feed, source_fingerprint(feed), 2)
+
+    report = import_catalog(feed, resume=True)
+
+    assert (report.skipped, report.read, report.stale_checkpoint) == (2, 3, False)
+    assert Book.query.count() == 3
+
+
+def test_checkpoint_from_a_replaced_feed_is_ignored(app, tmp_path):
+    feed = str(tmp_path / 'feed.csv')
+    write_feed(feed, 9780000000000, 5)
+    _save_checkpoint(feed, source_fingerprint(feed), 2)
+    # Tonight's feed replaces the one whose import failed
+    write_feed(feed, 9790000000000, 5)
+
+    report = import_catalog(feed, resume=True)
+
+    assert (report.skipped, report.read, report.stale_checkpoint) == (0, 5, True)
+    assert Book.query.count() == 5
+
+
+def test_checkpoint_is_ignored_unless_resuming(app, tmp_path):
+    feed = str(tmp_path / 'feed.csv')
+    write_feed(feed, 9780000000000, 5)
+    _save_checkpoint(feed, source_fingerprint(feed), 2)
+
+    report = import_catalog(feed)
+
+    assert (report.skipped, report.read) == (0, 5)
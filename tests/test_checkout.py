@@ -0,0 +1,112 @@
+import threading
+
+import pytest
+from sqlalchemy.exc import OperationalError
+
+from app import checkout, db
+from app.models import Book, Cart, Order
+from tests.conftest import log_in, make_books, make_user
+
+
+def stock_of(book_id):
+    return db.session.scalar(db.select(Book.stock_quantity).where(Book.id == book_id))
+
+
+def test_two_buyers_racing_for_the_last_copy(app, monkeypatch):
+    book = make_books(1)[0]
+    book.stock_quantity = 1
+    buyers = [make_user('ann').id, make_user('ben').id]
+    db.session.add_all([Cart(user_id=user_id, book_id=book.id, quantity=1) for user_id in buyers])
+    db.session.commit()
+
+    # Both read their carts before either reserves
+    both_read = threading.Barrier(2, timeout=5)
+    first_read = threading.local()
+    cart_lines = checkout._cart_lines
+
+    def cart_lines_together(user_id):
+        lines = cart_lines(user_id)
+        if not getattr(first_read, 'done', False):
+            first_read.done = True
+            both_read.wait()
+        return lines
+
+    monkeypatch.setattr(checkout, '_cart_lines', cart_lines_together)
+    results = {}
+
+    def buy(user_id):
+        with app.app_context():
+            result = checkout.place_order(user_id)
+            results[user_id] = (result.ok, result.shortages)
+
+    threads = [threading.Thread(target=buy, args=(user_id,)) for user_id in buyers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(ok for ok, _ in results.values()) == [False, True]
+    [shortages] = [shortages for ok, shortages in results.values() if not ok]
+    assert shortages == [checkout.Shortage(book.id, book.title, 1, 0)]
+    assert stock_of(book.id) == 0
+    assert db.session.scalar(db.select(db.func.count()).select_from(Order)) == 1
+
+
+def test_a_locked_database_is_retried(app, monkeypatch):
+    user = make_user()
+    book = make_books(1)[0]
+    db.session.add(Cart(user_id=user.id, book_id=book.id, quantity=2))
+    db.session.commit()
+    reserve = checkout._reserve
+    calls = []
+
+    def locked_once(book_id, quantity):
+        calls.append(book_id)
+        if len(calls) == 1:
+            raise OperationalError('UPDATE books', {}, Exception('database is locked'))
+        return reserve(book_id, quantity)
+
+    monkeypatch.setattr(checkout, '_reserve', locked_once)
+
+    result = checkout.place_order(user.id)
+
+    assert result.ok and len(calls) == 2
+    assert stock_of(book.id) == 8
+    assert Cart.query.filter_by(user_id=user.id).count() == 0
+
+
+def test_a_database_locked_through_every_retry_gives_up(app, monkeypatch):
+    user = make_user()
+    book = make_books(1)[0]
+    db.session.add(Cart(user_id=user.id, book_id=book.id, quantity=1))
+    db.session.commit()
+
+    def locked(book_id, quantity):
+        raise OperationalError('UPDATE books', {}, Exception('database is locked'))
+
+    monkeypatch.setattr(checkout, '_reserve', locked)
+
+    with pytest.raises(checkout.CheckoutError):
+        checkout.place_order(user.id)
+    assert stock_of(book.id) == 10
+
+
+def test_a_short_line_rolls_back_the_whole_order(app, client):
+    user = make_user()
+    plenty, scarce = make_books(2)
+    scarce.stock_quantity = 1
+    db.session.add_all([Cart(user_id=user.id, book_id=plenty.id, quantity=3),
+                        Cart(user_id=user.id, book_id=scarce.id, quantity=2)])
+    db.session.commit()
+    log_in(client, user)
+
+    response = client.post('/checkout')
+
+    assert response.status_code == 302 and response.headers['Location'].endswith('/cart')
+    assert (stock_of(plenty.id), stock_of(scarce.id)) == (10, 1)
+    cart = db.session.execute(db.select(Cart.book_id, Cart.quantity).where(Cart.user_id == user.id)).all()
+    assert sorted(cart) == [(plenty.id, 3), (scarce.id, 2)]
+    assert db.session.scalar(db.select(db.func.count()).select_from(Order)) == 0
+    with client.session_transaction() as session:
+        messages = [message for _, message in session['_flashes']]
+    assert 'Only 1 of "Book 1" left (you asked for 2).' in messages
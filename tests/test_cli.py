@@ -0,0 +1,25 @@
+from sqlalchemy import text
+
+from app import db
+from app.cli import upgrade_schema
+from app.models import Book, Review
+from tests.conftest import make_books, make_user
+
+
+def test_upgrade_counts_existing_reviews_into_rating_totals(app):
+    book_id = make_books(1)[0].id
+    for stars, username in [(5, 'ann'), (4, 'ben'), (2, 'cat')]:
+        db.session.add(Review(book_id=book_id, user_id=make_user(username).id, rating=stars))
+    db.session.commit()
+    db.session.close()
+    # Take books back to before the rating totals and histogram
+    with db.engine.begin() as conn:
+        for column in ['rating_count', 'rating_sum'] + [f'rating_{stars}_count' for stars in range(1, 6)]:
+            conn.execute(text(f'ALTER TABLE books DROP COLUMN {column}'))
+
+    changes = upgrade_schema(db)
+
+    assert 'added column books.rating_sum' in changes
+    upgraded = db.session.get(Book, book_id)
+    assert (upgraded.rating_count, upgraded.rating_sum) == (3, 11)
+    assert upgraded.rating_histogram == [(5, 1), (4, 1), (3, 0), (2, 1), (1, 0)]
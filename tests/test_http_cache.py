@@ -0,0 +1,78 @@
+from app import db, recommendations
+from app.http_cache import catalog_version
+from app.models import Book, Review
+from tests.conftest import make_books, make_user
+
+
+def test_catalog_versions_move_with_every_book_change(app):
+    book = make_books(1)[0]
+    category = book.category
+    before = catalog_version(), catalog_version(category), catalog_version('Reference')
+
+    book.stock_quantity -= 1
+    db.session.commit()
+
+    assert catalog_version() != before[0]
+    assert catalog_version(category) != before[1]
+    assert catalog_version('Reference') == before[2]
+
+
+def test_catalog_version_is_a_key_lookup(app):
+    make_books(3)
+    plan = db.session.execute(db.text(
+        "EXPLAIN QUERY PLAN SELECT value FROM stat_counters WHERE name = 'catalog_version'"
+    )).all()
+    assert 'SEARCH' in plan[0][-1]
+
+
+def test_recategorising_moves_both_categories(app):
+    book = make_books(1)[0]
+    old, new = book.category, 'Reference' if book.category != 'Reference' else 'Biography'
+    before = catalog_version(old), catalog_version(new)
+
+    book.category = new
+    db.session.commit()
+
+    assert catalog_version(old) != before[0]
+    assert catalog_version(new) != before[1]
+
+
+def test_recommendation_refresh_moves_only_the_book_page(app, client):
+    book, other = make_books(2)
+    for username in ['ann', 'ben']:
+        user = make_user(username)
+        db.session.add_all([Review(user_id=user.id, book_id=book.id, rating=5),
+                            Review(user_id=user.id, book_id=other.id, rating=4)])
+    db.session.commit()
+    etag = client.get(f'/book/{book.id}').headers['ETag']
+    before = catalog_version(), catalog_version(book.category)
+
+    recommendations.refresh(full=True)
+
+    assert recommendations.also_liked(book.id) == [other]
+    assert (catalog_version(), catalog_version(book.category)) == before
+    assert client.get(f'/book/{book.id}', headers={'If-None-Match': etag}).status_code == 200
+
+
+def test_cached_page_is_not_served_under_a_newer_etag(app, client):
+    book = make_books(1)[0]
+    first = client.get(f'/book/{book.id}')
+
+    # A change whose page cache invalidation never arrived
+    db.session.execute(db.update(Book).where(Book.id == book.id).values(price_npr=4321.0))
+    db.session.commit()
+
+    second = client.get(f'/book/{book.id}')
+    assert second.headers['ETag'] != first.headers['ETag']
+    assert second.headers['X-Cache'] == 'MISS'
+    assert b'4321.00' in second.data
+
+
+def test_unchanged_page_is_answered_with_304(app, client):
+    book = make_books(1)[0]
+    etag = client.get(f'/book/{book.id}').headers['ETag']
+
+    response = client.get(f'/book/{book.id}', headers={'If-None-Match': etag})
+
+    assert response.status_code == 304
+    assert client.get(f'/book/{book.id}').headers['X-Cache'] == 'HIT'
@@ -0,0 +1,22 @@
+from app import db
+from app.cache import MemoryCache
+from app.identity import _key
+from tests.conftest import log_in, make_user
+
+
+def test_demotion_reaches_identities_cached_by_other_workers(app, client, monkeypatch):
+    admin = make_user('admin', is_admin=True)
+    log_in(client, admin)
+    assert client.get('/admin').status_code == 200
+
+    # Another worker holds the same cached identity
+    other_worker = MemoryCache()
+    key = _key(admin.id)
+    other_worker.set(key, app.extensions['identity_cache'].get(key))
+
+    admin.is_admin = False
+    db.session.commit()
+
+    monkeypatch.setitem(app.extensions, 'identity_cache', other_worker)
+    response = client.get('/admin')
+    assert response.status_code == 302
@@ -0,0 +1,25 @@
+import pytest
+
+from app import images
+from app.models import Job
+from tests.conftest import make_books
+
+
+@pytest.mark.parametrize('url', ['file:///etc/passwd', 'FILE:///etc/passwd', 'ftp://example.com/cover.jpg',
+                                 '/etc/passwd', 'data:image/png;base64,AAAA'])
+def test_non_http_urls_are_not_fetched(app, url):
+    with pytest.raises(images.CoverError):
+        images.fetch(url)
+
+
+def test_non_http_urls_are_not_queued(app):
+    book = make_books(1)[0]
+    with pytest.raises(images.CoverError):
+        images.ingest_url(book.id, 'file:///etc/passwd')
+    assert Job.query.count() == 0
+
+
+def test_redirects_to_other_schemes_are_refused():
+    handler = images._RedirectHandler()
+    with pytest.raises(images.CoverError):
+        handler.redirect_request(None, None, 302, 'Found', {}, 'file:///etc/passwd')
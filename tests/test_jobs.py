@@ -0,0 +1,84 @@
+import json
+from datetime import datetime, timedelta
+
+from app import db, jobs
+from app.models import Job
+
+calls = []
+
+
+@jobs.task('test.record')
+def record(**kwargs):
+    calls.append(kwargs)
+
+
+@jobs.task('test.fail')
+def fail(**kwargs):
+    raise ValueError('cover service unreachable')
+
+
+def test_enqueueing_a_pending_key_again_takes_the_new_arguments(app):
+    jobs.enqueue('test.record', key='cover:1', path='first.jpg')
+    db.session.commit()
+    jobs.enqueue('test.record', key='cover:1', path='second.jpg')
+    db.session.commit()
+
+    job = Job.query.one()
+    assert (job.dedup_key, job.coalesced, json.loads(job.args)) == ('cover:1', 1, {'path': 'second.jpg'})
+
+
+def test_claim_takes_the_oldest_due_job_once(app):
+    jobs.enqueue('test.record', n=1)
+    jobs.enqueue('test.record', n=2)
+    jobs.enqueue('test.record', delay=60, n=3)
+    db.session.commit()
+
+    first, second = jobs._claim(), jobs._claim()
+
+    assert [json.loads(first.args), json.loads(second.args)] == [{'n': 1}, {'n': 2}]
+    assert (first.attempts, second.attempts) == (1, 1)
+    assert jobs._claim() is None
+    assert sorted(db.session.scalars(db.select(Job.status))) == ['pending', 'running', 'running']
+
+
+def test_a_failed_job_is_retried_after_its_backoff(app):
+    jobs.enqueue('test.fail', book_id=1)
+    db.session.commit()
+    started = datetime.utcnow()
+
+    assert jobs.run_one() is False
+
+    job = Job.query.one()
+    assert (job.status, job.attempts, job.locked_at) == ('pending', 1, None)
+    assert 'cover service unreachable' in job.last_error
+    backoff = timedelta(seconds=app.config['JOBS_RETRY_SECONDS'])
+    assert started + backoff <= job.run_after <= datetime.utcnow() + backoff
+    assert jobs.run_one() is None
+
+
+def test_a_job_out_of_attempts_is_marked_failed(app):
+    jobs.enqueue('test.fail', book_id=1)
+    db.session.commit()
+    db.session.execute(db.update(Job).values(attempts=Job.max_attempts - 1))
+    db.session.commit()
+
+    assert jobs.run_one() is False
+
+    assert Job.query.one().status == 'failed'
+
+
+def test_stale_running_jobs_are_handed_out_again(app):
+    jobs.enqueue('test.record', n=1)
+    jobs.enqueue('test.record', n=2)
+    db.session.commit()
+    stale, fresh = jobs._claim(), jobs._claim()
+    expired = datetime.utcnow() - timedelta(seconds=app.config['JOBS_LEASE_SECONDS'] + 1)
+    db.session.execute(db.update(Job).where(Job.id == stale.id).values(locked_at=expired))
+    db.session.commit()
+
+    assert jobs.recover_stale() == 1
+
+    statuses = dict(db.session.execute(db.select(Job.id, Job.status)).all())
+    assert statuses == {stale.id: 'pending', fresh.id: 'running'}
+    assert jobs.run_pending() == (1, 0)
+    assert calls == [{'n': 1}]
@@ -0,0 +1,62 @@
+import pytest
+
+from app import db
+from app.models import Book, Cart, Review
+from app.query_budget import QueryBudgetExceeded, count_queries, query_budget
+from tests.conftest import log_in, make_books, make_user
+
+
+def test_cart_page_stays_within_budget_with_many_items(app, client):
+    user = make_user()
+    books = make_books(50)
+    db.session.add_all(Cart(user_id=user.id, book_id=book.id, quantity=2) for book in books)
+    db.session.commit()
+    log_in(client, user)
+
+    response = client.get('/cart')
+
+    assert response.status_code == 200
+    assert response.data.count(b'name="quantity-') == 50
+
+
+def test_book_page_stays_within_budget_with_many_reviews(app, client):
+    book = make_books(1)[0]
+    readers = [make_user(f'reader{n}') for n in range(40)]
+    db.session.add_all(Review(user_id=reader.id, book_id=book.id, rating=n % 5 + 1,
+                              review_text=f'Review {n}')
+                       for n, reader in enumerate(readers))
+    db.session.commit()
+
+    response = client.get(f'/book/{book.id}')
+
+    assert response.status_code == 200
+    assert b'Review 39' in response.data
+
+
+def test_logged_in_book_page_stays_within_budget(app, client):
+    book = make_books(1)[0]
+    user = make_user()
+    db.session.add(Review(user_id=user.id, book_id=book.id, rating=4))
+    db.session.commit()
+    log_in(client, user)
+
+    assert client.get(f'/book/{book.id}').status_code == 200
+
+
+def test_exceeding_the_budget_raises(app):
+    @query_budget(1)
+    def two_queries():
+        db.session.execute(db.select(Book.id)).all()
+        db.session.execute(db.select(Review.id)).all()
+
+    with app.test_request_context():
+        with pytest.raises(QueryBudgetExceeded, match='issued 2 SQL statements'):
+            two_queries()
+
+
+def test_count_queries_counts_statements_in_the_block(app):
+    make_books(3)
+    with count_queries() as counter:
+        for book in Book.query.all():
+            book.title
+    assert counter.count == 1
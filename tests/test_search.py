@@ -0,0 +1,61 @@
+import re
+
+import pytest
+
+from app import db, search
+from app.models import BOOK_CATEGORIES, Book
+from tests.conftest import log_in, make_books, make_user
+
+RESULT_TITLE = re.compile(r'<h3 class="book-title">\s*<a [^>]*>([^<]*)</a>')
+
+
+@pytest.fixture
+def index(app):
+    search.rebuild_index()
+    yield
+    db.session.execute(db.text(f'DROP TABLE {search.FTS_TABLE}'))
+    db.session.commit()
+    search._indexed_databases.clear()
+
+
+def results(client, query):
+    return RESULT_TITLE.findall(client.get('/search', query_string={'q': query}).get_data(as_text=True))
+
+
+def book_form(book=None, **fields):
+    form = {'isbn': '', 'title': 'Book', 'author': 'Author', 'price_npr': '100',
+            'category': BOOK_CATEGORIES[0], 'description': '', 'image_url': '', 'stock_quantity': '5'}
+    if book is not None:
+        form.update(isbn=book.isbn, title=book.title, author=book.author, price_npr=str(book.price_npr),
+                    category=book.category, description=book.description or '',
+                    stock_quantity=str(book.stock_quantity))
+    form.update(fields)
+    return form
+
+
+def test_admin_changes_show_up_in_search(app, client, index):
+    log_in(client, make_user('admin', is_admin=True))
+
+    added = client.post('/admin/book/add', data=book_form(title='Zanzibar Tides', author='Mira Sen'))
+    assert added.status_code == 302
+    assert results(client, 'zanzibar') == ['Zanzibar Tides']
+
+    book = Book.query.filter_by(title='Zanzibar Tides').one()
+    edited = client.post(f'/admin/book/edit/{book.id}', data=book_form(book, title='Monsoon Letters'))
+    assert edited.status_code == 302
+    assert results(client, 'zanzibar') == []
+    assert results(client, 'monsoon') == ['Monsoon Letters']
+
+    client.post(f'/admin/book/delete/{book.id}')
+    assert results(client, 'monsoon') == []
+
+
+def test_title_matches_rank_above_author_and_description_matches(app, client, index):
+    in_description, in_author, in_title = make_books(3)
+    in_description.description = 'A tale of the harbour at Valparaiso'
+    in_author.author = 'Ana Valparaiso'
+    in_title.title = 'Valparaiso Nights'
+    db.session.commit()
+    search.rebuild_index()
+
+    assert results(client, 'valpar') == ['Valparaiso Nights', in_author.title, in_description.title]
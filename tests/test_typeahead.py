@@ -0,0 +1,67 @@
+import random
+
+import pytest
+
+from app import typeahead
+from app.typeahead import PrefixIndex, book_keys
+from tests.conftest import make_books
+
+WORDS = ['silent', 'silver', 'river', 'rivet', 'garden', 'gate', 'shadow', 'shade', 'atlas', 'a']
+
+
+def brute_force(books, prefix):
+    matches = [book for book in books.values()
+               if any(key.startswith(prefix) for key in book_keys(book[1], book[2]))]
+    matches.sort(key=lambda book: (book[3] or 0.0, book[4] or 0, -book[0]), reverse=True)
+    return [book[0] for book in matches]
+
+
+def random_book(rng, book_id):
+    return (book_id, ' '.join(rng.sample(WORDS, rng.randint(1, 4))), rng.choice(WORDS).title(),
+            rng.choice([None, rng.random() * 5]), rng.randint(0, 5))
+
+
+def assert_matches(index, books):
+    for query in ['s', 'si', 'sil', 'Silent', 'silent r', 'rive', 'g', 'gate', 'a', 'at', 'zz']:
+        expected = brute_force(books, typeahead.normalize(query))
+        for limit in (1, 3, typeahead.MAX_RESULTS):
+            assert [row[0] for row in index.suggest(query, limit)] == expected[:limit]
+    assert index.suggest('', 5) == []
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_top_lists_stay_exact_through_changes(monkeypatch, seed):
+    monkeypatch.setattr(typeahead, 'DENSE_PREFIX_KEYS', 8)
+    rng = random.Random(seed)
+    books = {book_id: random_book(rng, book_id) for book_id in range(1, 200)}
+    index = PrefixIndex()
+    index.load(books.values())
+    assert index._top
+    assert_matches(index, books)
+
+    for _ in range(20):
+        changed = [random_book(rng, rng.randint(1, 250)) for _ in range(rng.randint(1, 5))]
+        index.upsert(changed)
+        books.update((book[0], book) for book in changed)
+        removed = rng.sample(sorted(books), rng.randint(0, 3))
+        index.remove(removed)
+        for book_id in removed:
+            del books[book_id]
+        assert_matches(index, books)
+
+
+def test_no_lookup_scans_a_dense_prefix(monkeypatch):
+    monkeypatch.setattr(typeahead, 'DENSE_PREFIX_KEYS', 8)
+    rng = random.Random(1)
+    index = PrefixIndex()
+    index.load(random_book(rng, book_id) for book_id in range(1, 500))
+    for prefix in ['s', 'si', 'silent', 'silent ', 'silent r']:
+        lo, hi = index._range(prefix)
+        assert (hi - lo > typeahead.DENSE_PREFIX_KEYS) == (prefix in index._top)
+
+
+def test_suggest_api_clamps_the_limit(app, client):
+    make_books(12)
+    for limit, expected in [('-3', 1), ('1', 1), ('50', typeahead.MAX_RESULTS)]:
+        response = client.get(f'/api/v1/suggest?q=book&limit={limit}')
+        assert len(response.get_json()['data']) == expected